@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Ingest benchmark: runs BookPopulator against a local fake Open Library server
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class FakeOpenLibraryServer:
+    """Deterministic local stand-in for the Open Library search, works, Books and covers APIs"""
+    
+    def __init__(self, corpus_size: int = 10000, latency: float = 0.05, error_rate: float = 0.0,
+                 subjects: Optional[List[str]] = None, seed: int = 42, throttle_rps: Optional[float] = None,
+                 capacity: Optional[int] = None, outage: Optional[Tuple[float, float]] = None):
+        from openlibrary_client import DEFAULT_SUBJECTS
+        
+        self.corpus_size = corpus_size
+        self.latency = latency
+        self.error_rate = error_rate
+        # Fault injection: 429 + Retry-After above throttle_rps, latency growing with requests in
+        # flight beyond capacity, and a (start, duration) window in seconds answered with 503s
+        self.throttle_rps = throttle_rps
+        self.capacity = capacity
+        self.outage = outage
+        self.recent = deque()
+        self.in_flight = 0
+        self.started_at = None
+        self.throttled_count = 0
+        self.subjects = subjects or DEFAULT_SUBJECTS
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self.server = None
+    
+    def work(self, number: int) -> Dict:
+        """The search doc for work number n; subjects are assigned round-robin"""
+        subject = self.subjects[number % len(self.subjects)]
+        doc = {
+            'key': f"/works/OL{number}W",
+            'title': f"{subject.title()} Work {number}",
+            'author_name': [f"Author {number % 997}"],
+            'first_publish_year': 1900 + number % 120,
+            'isbn': [f"{number:010d}"],
+            'subject': [subject, f"topic {number % 50}"],
+            'cover_i': number + 1,
+            'cover_edition_key': f"OL{number}M"
+        }
+        # Like the real index, search docs often lack edition details the Books API has
+        if number % 3:
+            doc.update(publisher=[f"Publisher {number % 31}"], number_of_pages_median=100 + number % 400)
+        return doc
+    
+    def edition(self, number: int) -> Dict:
+        """The jscmd=data Books API record for the edition of work number n"""
+        return {
+            'key': f"/books/OL{number}M",
+            'title': self.work(number)['title'],
+            'identifiers': {'isbn_10': [f"{number:010d}"], 'isbn_13': [f"978{number:010d}"]},
+            'publishers': [{'name': f"Publisher {number % 31}"}],
+            'number_of_pages': 100 + number % 400
+        }
+    
+    def books_api(self, bibkeys: List[str]) -> Dict:
+        found = {}
+        for bibkey in bibkeys:
+            match = re.fullmatch(r'ISBN:(?:978)?(\d{10})|OLID:OL(\d+)M', bibkey)
+            number = int(match.group(1) or match.group(2)) if match else None
+            if number is not None and number < self.corpus_size:
+                found[bibkey] = self.edition(number)
+        return found
+    
+    def search(self, query: str, limit: int, page: int, offset: Optional[int] = None) -> Dict:
+        if query.startswith('key:'):
+            # key:("/works/OL1W" OR "/works/OL2W") lookups used by refresh
+            numbers = [int(n) for n in re.findall(r'/works/OL(\d+)W', query) if int(n) < self.corpus_size]
+            docs = [self.work(number) for number in numbers][:limit]
+            return {'numFound': len(numbers), 'start': 0, 'docs': docs}
+        
+        match = re.match(r'subject:(.+)', query)
+        if not match or match.group(1) not in self.subjects:
+            return {'numFound': 0, 'start': 0, 'docs': []}
+        
+        # Works with number % len(subjects) == position belong to this subject
+        position = self.subjects.index(match.group(1))
+        numbers = range(position, self.corpus_size, len(self.subjects))
+        start = offset if offset is not None else (page - 1) * limit
+        return {
+            'numFound': len(numbers),
+            'start': start,
+            'docs': [self.work(number) for number in numbers[start:start + limit]]
+        }
+    
+    def work_details(self, number: int) -> Optional[Dict]:
+        if not 0 <= number < self.corpus_size:
+            return None
+        return {
+            'key': f"/works/OL{number}W",
+            'title': self.work(number)['title'],
+            'description': {'type': '/type/text', 'value': f"A generated description for work {number}. " * 5}
+        }
+    
+    def cover(self, cover_id: int) -> Optional[bytes]:
+        """A solid-colour 200x300 PNG; only 40 distinct images exist and every 7th cover is missing"""
+        if cover_id % 7 == 0:
+            return None
+        shade = cover_id % 40
+        row = b'\x00' + bytes((shade * 6, 255 - shade * 6, 128)) * 200
+        
+        def chunk(kind: bytes, data: bytes) -> bytes:
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        
+        return (
+            b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', 200, 300, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(row * 300))
+            + chunk(b'IEND', b'')
+        )
+    
+    def admit(self) -> Optional[int]:
+        """Count a request and decide which injected fault (429 or 503), if any, answers it"""
+        with self.lock:
+            now = time.monotonic()
+            self.started_at = self.started_at or now
+            self.request_count += 1
+            
+            if self.throttle_rps:
+                while self.recent and now - self.recent[0] > 1.0:
+                    self.recent.popleft()
+                if len(self.recent) >= self.throttle_rps:
+                    self.throttled_count += 1
+                    return 429
+                self.recent.append(now)
+            
+            self.in_flight += 1
+            elapsed = now - self.started_at
+            in_outage = self.outage and self.outage[0] <= elapsed < self.outage[0] + self.outage[1]
+            if in_outage or self.random.random() < self.error_rate:
+                self.error_count += 1
+                return 503
+            return None
+    
+    def _handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def _send(self, status: int, body: Optional[Dict] = None, headers: Optional[Dict] = None):
+                payload = json.dumps(body).encode('utf-8') if body is not None else b''
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def do_GET(self):
+                fault = server.admit()
+                if fault == 429:
+                    return self._send(429, {'error': 'rate limited'}, {'Retry-After': '1'})
+                slowdown = max(1.0, server.in_flight / server.capacity) if server.capacity else 1.0
+                try:
+                    time.sleep(server.latency * slowdown)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+                if fault:
+                    return self._send(fault, {'error': 'injected failure'})
+                
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                
+                if url.path == '/search.json':
+                    limit = int(params.get('limit', ['100'])[0])
+                    page = int(params.get('page', ['1'])[0])
+                    offset = int(params['offset'][0]) if 'offset' in params else None
+                    return self._send(200, server.search(params.get('q', [''])[0], limit, page, offset))
+                
+                match = re.fullmatch(r'/b/id/(\d+)-L\.jpg', url.path)
+                if match:
+                    image = server.cover(int(match.group(1)))
+                    if image is None:
+                        return self._send(404, {'error': 'notfound'})
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/png')
+                    self.send_header('Content-Length', str(len(image)))
+                    self.end_headers()
+                    return self.wfile.write(image)
+                
+                if url.path == '/api/books':
+                    bibkeys = params.get('bibkeys', [''])[0].split(',')
+                    return self._send(200, server.books_api([bibkey for bibkey in bibkeys if bibkey]))
+                
+                match = re.fullmatch(r'/works/OL(\d+)W\.json', url.path)
+                details = server.work_details(int(match.group(1))) if match else None
+                if details is None:
+                    return self._send(404, {'error': 'notfound'})
+                return self._send(200, details)
+        
+        return Handler
+    
+    def start(self) -> str:
+        """Start serving on a free local port and return the base URL"""
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-openlibrary', daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}"
+    
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+def point_config_at(base_url: str):
+    """Redirect all Open Library URLs in Config to base_url"""
+    Config.OPENLIBRARY_BASE_URL = base_url
+    Config.OPENLIBRARY_SEARCH_URL = f"{base_url}/search.json"
+    Config.OPENLIBRARY_WORKS_URL = f"{base_url}/works"
+    Config.OPENLIBRARY_BOOKS_API_URL = f"{base_url}/api/books"
+    Config.OPENLIBRARY_COVERS_URL = base_url
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_benchmark(args) -> Dict:
+    server = FakeOpenLibraryServer(
+        args.corpus_size, args.latency, args.error_rate,
+        throttle_rps=args.throttle_rps, capacity=args.capacity, outage=args.outage
+    )
+    point_config_at(server.start())
+    
+    scratch_db = None
+    if args.database_url:
+        Config.DB_URL = args.database_url
+    else:
+        fd, scratch_db = tempfile.mkstemp(suffix='.db', prefix='litwise_bench_')
+        os.close(fd)
+        Config.DB_URL = f"sqlite:///{scratch_db}"
+    Config.REQUESTS_PER_SECOND = args.rps
+    Config.MAX_CONCURRENT_REQUESTS = args.workers
+    
+    # Imported after Config is patched so every component picks up the benchmark settings
+    from sqlalchemy import event
+    from database import db_manager, init_database
+    from metrics import metrics
+    from populate_books import BookPopulator
+    
+    try:
+        if not init_database():
+            raise RuntimeError("Failed to initialize benchmark database")
+        
+        round_trips = {'count': 0}
+        
+        @event.listens_for(db_manager.engine, 'before_cursor_execute')
+        def count_round_trip(*_):
+            round_trips['count'] += 1
+        
+        populator = BookPopulator(batch_size=args.batch_size)
+        latencies = []
+        populator.client.session.hooks['response'].append(
+            lambda response, *_, **__: latencies.append(response.elapsed.total_seconds())
+        )
+        
+        setup_round_trips = round_trips['count']
+        started = time.perf_counter()
+        if args.stream:
+            inserted = populator.stream_and_save_books(args.count)
+        else:
+            inserted = populator.fetch_and_save_books(args.count)
+        elapsed = time.perf_counter() - started
+        db_round_trips = round_trips['count'] - setup_round_trips
+        
+        # Every fake work has a description and an edition, so anything missing was dropped on a failure
+        from sqlalchemy import func, or_, select
+        from models import Book
+        with db_manager.engine.connect() as connection:
+            incomplete = connection.execute(
+                select(func.count()).select_from(Book).where(or_(Book.description.is_(None), Book.isbn13.is_(None)))
+            ).scalar()
+        
+        return {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'config': {
+                'count': args.count,
+                'mode': 'stream' if args.stream else 'batch',
+                'corpus_size': args.corpus_size,
+                'latency': args.latency,
+                'error_rate': args.error_rate,
+                'throttle_rps': args.throttle_rps,
+                'capacity': args.capacity,
+                'outage': args.outage,
+                'rps': args.rps,
+                'workers': args.workers,
+                'batch_size': args.batch_size or Config.DB_BATCH_SIZE,
+                'database': db_manager.engine.dialect.name
+            },
+            'results': {
+                'inserted': inserted,
+                'elapsed_seconds': round(elapsed, 3),
+                'books_per_second': round(inserted / elapsed, 2) if elapsed else None,
+                'requests': len(latencies),
+                'server_requests': server.request_count,
+                'injected_errors': server.error_count,
+                'throttled': server.throttled_count,
+                'incomplete_books': incomplete,
+                'controller': populator.client.controller.get_stats(),
+                'request_latency_p50_ms': round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+                'request_latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+                'db_round_trips': db_round_trips,
+                'db_round_trips_per_book': round(db_round_trips / inserted, 3) if inserted else None
+            },
+            'metrics': metrics.snapshot()
+        }
+    finally:
+        db_manager.close_connection()
+        server.stop()
+        if scratch_db and os.path.exists(scratch_db):
+            os.remove(scratch_db)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark book ingest against a local fake Open Library")
+    parser.add_argument('--count', type=int, default=1000, help="Books to ingest")
+    parser.add_argument('--stream', action='store_true', help="Use the streaming pipeline")
+    parser.add_argument('--corpus-size', type=int, default=20000, help="Works served by the fake API")
+    parser.add_argument('--latency', type=float, default=0.05, help="Fake API latency per request in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument('--throttle-rps', type=float, help="Answer requests above this rate with 429 + Retry-After")
+    parser.add_argument('--capacity', type=int, help="Requests in flight before fake latency grows proportionally")
+    parser.add_argument('--outage', type=float, nargs=2, metavar=('START', 'SECONDS'),
+                        help="Answer every request with 503 for SECONDS, starting START seconds in")
+    parser.add_argument('--rps', type=float, default=200.0, help="Client rate limit in requests per second")
+    parser.add_argument('--workers', type=int, default=Config.MAX_CONCURRENT_REQUESTS, help="Concurrent requests")
+    parser.add_argument('--batch-size', type=int, help="Rows per bulk upsert")
+    parser.add_argument('--database-url', help="SQLAlchemy URL (default: temporary SQLite file)")
+    parser.add_argument('--output', help="Write results as JSON to this file")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING)
+    
+    result = run_benchmark(args)
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+Cached read API for books: an in-process LRU/TTL cache with coalesced misses and batched IN lookups
+"""
+
+import logging
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import or_, select
+
+from config import get_config
+from metrics import metrics
+from models import Book
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+def _normalize_isbn(isbn: str) -> str:
+    return isbn.replace('-', '').replace(' ', '').upper()
+
+def _normalize_work_key(key: str) -> str:
+    return key if key.startswith('/') else f"/works/{key}"
+
+def _size_of(book: Optional[Dict]) -> int:
+    """Rough memory footprint of a cached book dict"""
+    if book is None:
+        return 64
+    return sys.getsizeof(book) + sum(sys.getsizeof(value) for value in book.values())
+
+class BookCache:
+    """Thread-safe LRU cache bounded by entry count and approximate bytes, with a TTL per entry"""
+    
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()  # key -> (expires_at, size, value)
+        self.total_bytes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key: Hashable):
+        """The cached value (None is a cached "not found"), or _MISSING"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return _MISSING
+            self.entries.move_to_end(key)
+            return entry[2]
+    
+    def put(self, key: Hashable, value, size: int = 64):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.total_bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+    
+    def discard(self, keys: Iterable[Hashable]):
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self._drop(key)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+    
+    def _drop(self, key: Hashable):
+        self.total_bytes -= self.entries.pop(key)[1]
+
+class _Flight:
+    """A database lookup other threads can wait on instead of repeating it"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+# Live services, so writers can invalidate them without holding a reference
+_services = weakref.WeakSet()
+
+def invalidate_books(books: Iterable[Dict]):
+    """Drop written books from every BookService in this process
+    
+    Takes the written rows (id, work_key, isbn, isbn13), so cached "not found" answers for
+    their work keys and ISBNs go too.
+    """
+    books = list(books)
+    if books:
+        for service in list(_services):
+            service.invalidate(books)
+
+class BookService:
+    """Read-side lookups by id, work key and ISBN, returning Book.to_dict() dictionaries
+    
+    Books are cached by id; work keys and ISBNs are cached as aliases resolving to an id.
+    Misses are fetched with one IN query per batch (chunks of in_batch_size), and a thread
+    that misses a key already being fetched waits for that query instead of issuing its
+    own. Absent books are cached too. BulkBookWriter invalidates what it writes through
+    invalidate_books(); writes from other processes show up once entries expire.
+    """
+    
+    def __init__(self, session_factory: Optional[Callable] = None, max_entries: Optional[int] = None,
+                 max_mb: Optional[float] = None, ttl: Optional[float] = None, in_batch_size: int = 500):
+        config = get_config()
+        if session_factory is None:
+            from database import db_manager
+            session_factory = db_manager.get_session
+        self.session_factory = session_factory
+        self.cache = BookCache(
+            max_entries or config.BOOK_CACHE_MAX_ENTRIES,
+            int((max_mb or config.BOOK_CACHE_MAX_MB) * 1024 * 1024),
+            ttl if ttl is not None else config.BOOK_CACHE_TTL
+        )
+        self.in_batch_size = in_batch_size
+        self.flights: Dict[Tuple, _Flight] = {}
+        self.generation = 0  # Bumped by invalidate(); fetches that overlap one do not fill the cache
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'queries': 0, 'invalidated': 0}
+        _services.add(self)
+    
+    def _count(self, name: str, amount: int = 1):
+        if amount:
+            with self.lock:
+                self.stats[name] += amount
+            metrics.inc('book_cache_total', amount, result=name)
+    
+    def _query(self, column, values: List) -> List[Dict]:
+        session = self.session_factory()
+        if session is None:
+            raise RuntimeError("Failed to get database session")
+        try:
+            books = []
+            for start in range(0, len(values), self.in_batch_size):
+                chunk = values[start:start + self.in_batch_size]
+                self._count('queries')
+                if column is None:  # ISBNs match either column
+                    condition = or_(Book.isbn.in_(chunk), Book.isbn13.in_(chunk))
+                else:
+                    condition = column.in_(chunk)
+                books.extend(book.to_dict() for book in session.execute(select(Book).where(condition)).scalars())
+            return books
+        finally:
+            session.close()
+    
+    def _resolve(self, keys: List[Tuple], fetch: Callable[[List], Dict]) -> Dict[Tuple, object]:
+        """Values for cache keys, fetching the misses nobody else is already fetching in one batch"""
+        found = {}
+        waiting = {}
+        leading = {}
+        for key in keys:
+            value = self.cache.get(key)
+            if value is not _MISSING:
+                found[key] = value
+                continue
+            with self.lock:
+                flight = self.flights.get(key)
+                if flight is None:
+                    leading[key] = self.flights[key] = _Flight()
+                else:
+                    waiting[key] = flight
+        self._count('hits', len(found))
+        self._count('coalesced', len(waiting))
+        self._count('misses', len(leading))
+        
+        if leading:
+            try:
+                fetched = fetch([key[1] for key in leading])
+                for key, flight in leading.items():
+                    flight.value = found[key] = fetched.get(key[1])
+            except BaseException as e:
+                for flight in leading.values():
+                    flight.error = e
+                raise
+            finally:
+                with self.lock:
+                    for key, flight in leading.items():
+                        self.flights.pop(key, None)
+                        flight.done.set()
+        
+        for key, flight in waiting.items():
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            found[key] = flight.value
+        return found
+    
+    def _fetch_ids(self, book_ids: List[int]) -> Dict[int, Optional[Dict]]:
+        generation = self.generation
+        books = {book['id']: book for book in self._query(Book.id, book_ids)}
+        if generation != self.generation:
+            return books
+        for book_id in book_ids:
+            self.cache.put(('id', book_id), books.get(book_id), _size_of(books.get(book_id)))
+        return books
+    
+    def _fetch_aliases(self, kind: str, column, values: List[str]) -> Dict[str, Optional[int]]:
+        generation = self.generation
+        books = self._query(column, values)
+        ids = {}
+        for book in sorted(books, key=lambda book: book['id']):
+            for field in (('isbn', 'isbn13') if kind == 'isbn' else ('work_key',)):
+                if book[field] is not None:
+                    ids.setdefault(book[field], book['id'])
+        if generation != self.generation:
+            return ids
+        for book in books:
+            self.cache.put(('id', book['id']), book, _size_of(book))
+        for value in values:
+            self.cache.put((kind, value), ids.get(value))
+        return ids
+    
+    def get_many(self, book_ids: Iterable[int]) -> Dict[int, Dict]:
+        """Books by id; ids that do not exist are left out"""
+        keys = [('id', int(book_id)) for book_id in dict.fromkeys(book_ids)]
+        found = self._resolve(keys, self._fetch_ids)
+        return {key[1]: dict(book) for key, book in found.items() if book is not None}
+    
+    def get_book(self, book_id: int) -> Optional[Dict]:
+        return self.get_many([book_id]).get(int(book_id))
+    
+    def _get_by_alias(self, kind: str, column, value: str, matches: Callable[[Dict], bool]) -> Optional[Dict]:
+        key = (kind, value)
+        book_id = self._resolve([key], lambda values: self._fetch_aliases(kind, column, values))[key]
+        if book_id is None:
+            return None
+        book = self.get_book(book_id)
+        if book is not None and matches(book):
+            return book
+        # The book was edited since the alias was cached; look the alias up again
+        self.cache.discard([key])
+        book_id = self._fetch_aliases(kind, column, [value]).get(value)
+        return self.get_book(book_id) if book_id is not None else None
+    
+    def get_by_work_key(self, work_key: str) -> Optional[Dict]:
+        work_key = _normalize_work_key(work_key)
+        return self._get_by_alias('work_key', Book.work_key, work_key, lambda book: book['work_key'] == work_key)
+    
+    def get_by_isbn(self, isbn: str) -> Optional[Dict]:
+        isbn = _normalize_isbn(isbn)
+        return self._get_by_alias('isbn', None, isbn, lambda book: isbn in (book['isbn'], book['isbn13']))
+    
+    def invalidate(self, books: Iterable[Dict]):
+        """Forget cached entries (and "not found" answers) for written books"""
+        keys = []
+        for book in books:
+            if book.get('id') is not None:
+                keys.append(('id', book['id']))
+            if book.get('work_key'):
+                keys.append(('work_key', book['work_key']))
+            for field in ('isbn', 'isbn13'):
+                if book.get(field):
+                    keys.append(('isbn', _normalize_isbn(book[field])))
+        with self.lock:
+            self.generation += 1
+        self.cache.discard(keys)
+        self._count('invalidated', len(keys))
+    
+    def get_stats(self) -> Dict:
+        """Return hit/miss counters and current cache size"""
+        with self.lock:
+            stats = dict(self.stats)
+        return dict(stats, entries=len(self.cache.entries), size_bytes=self.cache.total_bytes,
+                    evictions=self.cache.evictions)
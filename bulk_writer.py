@@ -0,0 +1,252 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func, insert, or_, select, update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from book_service import invalidate_books
+from config import Config
+from dedup import FingerprintIndex, book_fingerprint, content_hash
+from models import Book
+from subjects import sync_book_subjects
+
+logger = logging.getLogger(__name__)
+
+class BulkBookWriter:
+    """Buffers formatted books and writes them with one multi-row upsert per batch"""
+    
+    def __init__(self, session: Session, batch_size: Optional[int] = None,
+                 fingerprints: Optional[FingerprintIndex] = None, track_ids: bool = False):
+        self.session = session
+        self.fingerprints = fingerprints
+        self.track_ids = track_ids
+        self.written_ids: List[int] = []  # Ids of inserted or updated rows, when track_ids is set
+        self.batch_size = batch_size or Config.DB_BATCH_SIZE
+        self.buffer: List[Dict] = []
+        self.failed_rows: List[Dict] = []  # Rows of the last flushed batch that could not be written
+        self.totals = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+        self.dialect = session.get_bind().dialect.name
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+    
+    def add(self, book_data: Dict) -> Optional[Dict]:
+        """Buffer a formatted book, flushing when the batch is full"""
+        self.buffer.append(book_data)
+        if len(self.buffer) >= self.batch_size:
+            return self.flush()
+        return None
+    
+    def flush(self) -> Dict:
+        """Write all buffered books and return the counts for this batch"""
+        rows, self.buffer = self.buffer, []
+        self.failed_rows = []
+        result = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+        if not rows:
+            return result
+        
+        try:
+            try:
+                result, written = self._write_batch(rows)
+            except IntegrityError:
+                # Usually a book another process committed after the fingerprints were preloaded
+                self.session.rollback()
+                result, written = self._write_batch(rows, check_all=True)
+            self.session.commit()
+            self._remember(written)
+        except SQLAlchemyError as e:
+            self.session.rollback()
+            logger.warning(f"Batch of {len(rows)} books failed ({e}), retrying row by row")
+            result = self._write_rows_individually(rows)
+        
+        for name, count in result.items():
+            self.totals[name] += count
+        
+        logger.info(
+            f"Batch written: {result['inserted']} inserted, {result['updated']} updated, "
+            f"{result['unchanged']} unchanged, {result['skipped']} skipped, {result['failed']} failed"
+        )
+        return result
+    
+    def _write_rows_individually(self, rows: List[Dict]) -> Dict:
+        """Fallback used to isolate bad rows after a batch fails"""
+        result = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+        for row in rows:
+            try:
+                row_result, written = self._write_batch([row], check_all=True)
+                self.session.commit()
+                self._remember(written)
+            except SQLAlchemyError as e:
+                self.session.rollback()
+                logger.error(f"Error saving book '{row.get('title')}': {e}")
+                self.failed_rows.append(row)
+                row_result = {'failed': 1}
+            
+            for name, count in row_result.items():
+                result[name] += count
+        return result
+    
+    def _remember(self, written: List[Dict]):
+        """Record fingerprints (and optionally ids) of committed rows and invalidate cached copies"""
+        if self.fingerprints is not None:
+            for row in written:
+                self.fingerprints.add(row['fingerprint'])
+        
+        if self.track_ids:
+            self.written_ids.extend(row['id'] for row in written)
+        
+        # Cached reads in this process must not keep serving the old rows
+        invalidate_books(written)
+    
+    def _write_batch(self, rows: List[Dict], check_all: bool = False) -> Tuple[Dict, List[Dict]]:
+        """Classify rows against the database and upsert the ones worth writing
+        
+        check_all looks every fingerprint up in the database, for when the preloaded index
+        may be stale because another process (e.g. a parallel ingest shard) wrote the row.
+        """
+        result = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+        candidates = []
+        seen_keys = set()
+        seen_fingerprints = set()
+        
+        for row in rows:
+            key = row.get('openlibrary_key')
+            fingerprint = book_fingerprint(row['title'], row['author'])
+            
+            if (key and key in seen_keys) or fingerprint in seen_fingerprints:
+                result['skipped'] += 1
+                continue
+            seen_keys.add(key)
+            seen_fingerprints.add(fingerprint)
+            
+            candidates.append(dict(row, fingerprint=fingerprint, content_hash=content_hash(row)))
+        
+        if not candidates:
+            return result, []
+        
+        # Fingerprints the exact preloaded index already holds need no lookup; everything else
+        # that may exist (a Bloom filter rules out the rest) is checked in the same query
+        known = set()
+        if not check_all and self.fingerprints is not None and self.fingerprints.exact:
+            known = {row['fingerprint'] for row in candidates if row['fingerprint'] in self.fingerprints}
+        keys = {row['openlibrary_key'] for row in candidates if row.get('openlibrary_key')}
+        fingerprints = {
+            row['fingerprint'] for row in candidates
+            if row['fingerprint'] not in known
+            and (check_all or self.fingerprints is None or row['fingerprint'] in self.fingerprints)
+        }
+        
+        # One indexed round-trip to find everything this batch could collide with
+        existing = self.session.execute(
+            select(Book.openlibrary_key, Book.fingerprint, Book.content_hash).where(
+                or_(Book.openlibrary_key.in_(keys), Book.fingerprint.in_(fingerprints))
+            )
+        ).all()
+        existing_hashes = {row.openlibrary_key: row.content_hash for row in existing if row.openlibrary_key}
+        stored_fingerprints = {row.openlibrary_key: row.fingerprint for row in existing if row.openlibrary_key}
+        existing_fingerprints = {row.fingerprint: row.openlibrary_key for row in existing if row.fingerprint}
+        
+        to_write = []
+        unchanged_keys = []
+        now = datetime.now()
+        
+        for row in candidates:
+            key = row.get('openlibrary_key')
+            if row['fingerprint'] in known:
+                # A known book is only written if it is a re-fetch of the row stored under this key
+                duplicate = not key or stored_fingerprints.get(key) != row['fingerprint']
+            else:
+                owner = existing_fingerprints.get(row['fingerprint'], key)
+                duplicate = owner != key or (not key and row['fingerprint'] in existing_fingerprints)
+            
+            if duplicate:
+                # Same title and author already stored under another key
+                logger.info(f"Book already exists: {row['title']} by {row['author']}")
+                result['skipped'] += 1
+                continue
+            
+            if key in existing_hashes and existing_hashes[key] == row['content_hash']:
+                # Re-fetched but identical; only the fetch time moves
+                result['unchanged'] += 1
+                unchanged_keys.append(key)
+                continue
+            
+            result['updated' if key in existing_hashes else 'inserted'] += 1
+            to_write.append(dict(row, created_at=now, updated_at=now, last_fetched_at=now))
+        
+        if unchanged_keys:
+            self.session.execute(
+                update(Book)
+                .where(Book.openlibrary_key.in_(unchanged_keys))
+                .values(last_fetched_at=now, updated_at=Book.updated_at)
+            )
+        
+        if to_write and self.dialect == 'mysql':
+            to_write = self._write_mysql(to_write, set(existing_hashes), result)
+        elif to_write:
+            self.session.execute(self._upsert_statement(to_write))
+        
+        if to_write:
+            # Resolve ids of the written rows so subjects can be linked in the same transaction
+            ids = dict(self.session.execute(
+                select(Book.fingerprint, Book.id).where(Book.fingerprint.in_([row['fingerprint'] for row in to_write]))
+            ).all())
+            for row in to_write:
+                row['id'] = ids.get(row['fingerprint'])
+            
+            sync_book_subjects(
+                self.session,
+                {row['id']: row.get('subjects') for row in to_write if row['id'] is not None},
+                replace=result['updated'] > 0
+            )
+        return result, to_write
+    
+    def _write_mysql(self, rows: List[Dict], existing_keys: set, result: Dict) -> List[Dict]:
+        """Upsert rows with one INSERT ... ON DUPLICATE KEY UPDATE that never crosses openlibrary_keys
+        
+        The statement also fires on the fingerprint index, so every assignment keeps the stored
+        value unless the existing row has the same openlibrary_key. Rows that did not end up
+        stored under their own key (another process stored the same fingerprint meanwhile) are
+        re-classified as skipped; returns the rows written.
+        """
+        table = Book.__table__
+        stmt = mysql.insert(table).values(rows)
+        same_key = table.c.openlibrary_key == stmt.inserted.openlibrary_key
+        # openlibrary_key itself is never assigned, so the guard always sees the stored key
+        update_columns = [column for column in rows[0] if column not in ('id', 'created_at', 'openlibrary_key')]
+        self.session.execute(stmt.on_duplicate_key_update({
+            column: func.IF(same_key, stmt.inserted[column], table.c[column]) for column in update_columns
+        }))
+        
+        fingerprints = [row['fingerprint'] for row in rows]
+        owners = dict(self.session.execute(
+            select(Book.fingerprint, Book.openlibrary_key).where(Book.fingerprint.in_(fingerprints))
+        ).all())
+        written = []
+        for row in rows:
+            if row['fingerprint'] in owners and owners[row['fingerprint']] == row.get('openlibrary_key'):
+                written.append(row)
+                continue
+            logger.info(f"Book already exists: {row['title']} by {row['author']}")
+            result['updated' if row.get('openlibrary_key') in existing_keys else 'inserted'] -= 1
+            result['skipped'] += 1
+        return written
+    
+    def _upsert_statement(self, rows: List[Dict]):
+        """Build a dialect-specific multi-row upsert keyed on openlibrary_key (MySQL uses _write_mysql)"""
+        update_columns = [column for column in rows[0] if column not in ('id', 'created_at')]
+        
+        if self.dialect == 'sqlite':
+            stmt = sqlite.insert(Book.__table__).values(rows)
+            return stmt.on_conflict_do_update(
+                index_elements=[Book.openlibrary_key],
+                set_={column: stmt.excluded[column] for column in update_columns}
+            )
+        
+        # Other backends get a plain multi-row insert; updates are not supported there
+        return insert(Book.__table__).values(rows)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Local full-text search over the catalog (MySQL FULLTEXT / SQLite FTS5)
+"""
+
+import argparse
+import logging
+import re
+import sys
+from typing import Dict, List
+from sqlalchemy import inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import Book
+
+logger = logging.getLogger(__name__)
+
+SEARCH_COLUMNS = ('title', 'author', 'subjects', 'description')
+MYSQL_INDEX_NAME = 'ft_books_text'
+
+# External-content FTS5 table kept in sync with books by triggers, so ingest needs no extra code.
+# The update trigger only fires for indexed columns, so touching fetch timestamps stays cheap.
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE books_fts USING fts5(
+        title, author, subjects, description,
+        content='books', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author, subjects, description)
+        VALUES (new.id, new.title, new.author, new.subjects, new.description);
+    END""",
+    """CREATE TRIGGER books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, subjects, description)
+        VALUES ('delete', old.id, old.title, old.author, old.subjects, old.description);
+    END""",
+    """CREATE TRIGGER books_fts_au AFTER UPDATE OF title, author, subjects, description ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author, subjects, description)
+        VALUES ('delete', old.id, old.title, old.author, old.subjects, old.description);
+        INSERT INTO books_fts(rowid, title, author, subjects, description)
+        VALUES (new.id, new.title, new.author, new.subjects, new.description);
+    END""",
+    "INSERT INTO books_fts(books_fts) VALUES ('rebuild')"
+]
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+def ensure_search_index(engine: Engine):
+    """Create the full-text index for the current backend if it does not exist yet"""
+    dialect = engine.dialect.name
+    
+    if dialect == 'mysql':
+        indexes = {index['name'] for index in inspect(engine).get_indexes('books')}
+        if MYSQL_INDEX_NAME not in indexes:
+            logger.info("Creating FULLTEXT index on books")
+            with engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE books ADD FULLTEXT INDEX {MYSQL_INDEX_NAME} ({', '.join(SEARCH_COLUMNS)})"
+                ))
+    
+    elif dialect == 'sqlite':
+        if 'books_fts' not in inspect(engine).get_table_names():
+            logger.info("Creating FTS5 search table for books")
+            with engine.begin() as conn:
+                for statement in SQLITE_FTS_DDL:
+                    conn.execute(text(statement))
+            return
+        
+        # Earlier versions re-indexed on every update, whichever column changed
+        with engine.begin() as conn:
+            trigger = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'books_fts_au'")).scalar()
+            if trigger and 'UPDATE OF' not in trigger:
+                logger.info("Narrowing FTS5 update trigger to indexed columns")
+                conn.execute(text("DROP TRIGGER books_fts_au"))
+                conn.execute(text(SQLITE_FTS_DDL[3]))
+
+def _fts5_query(query: str) -> str:
+    # Quote every token so user input can never be parsed as FTS5 syntax; the last one matches as a prefix
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return ''
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+def search_catalog(session: Session, query: str, limit: int = 20, offset: int = 0) -> Dict:
+    """Ranked, paginated search over title, author, subjects and description"""
+    dialect = session.get_bind().dialect.name
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    
+    if dialect == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            return {'query': query, 'total': 0, 'limit': limit, 'offset': offset, 'results': []}
+        # bm25() is lower-is-better; weight title and author matches above subjects and descriptions
+        ranked = text(
+            "SELECT rowid AS id, -bm25(books_fts, 10.0, 5.0, 2.0, 1.0) AS score FROM books_fts "
+            "WHERE books_fts MATCH :match ORDER BY bm25(books_fts, 10.0, 5.0, 2.0, 1.0) "
+            "LIMIT :limit OFFSET :offset"
+        )
+        count = text("SELECT COUNT(*) FROM books_fts WHERE books_fts MATCH :match")
+    elif dialect == 'mysql':
+        match = query
+        against = f"MATCH ({', '.join(SEARCH_COLUMNS)}) AGAINST (:match IN NATURAL LANGUAGE MODE)"
+        ranked = text(
+            f"SELECT id, {against} AS score FROM books WHERE {against} "
+            f"ORDER BY score DESC LIMIT :limit OFFSET :offset"
+        )
+        count = text(f"SELECT COUNT(*) FROM books WHERE {against}")
+    else:
+        raise ValueError(f"Full-text search is not supported on {dialect}")
+    
+    params = {'match': match, 'limit': limit, 'offset': offset}
+    scores = {row.id: row.score for row in session.execute(ranked, params)}
+    total = session.execute(count, params).scalar() if scores or offset else 0
+    
+    books = {book.id: book for book in session.execute(select(Book).where(Book.id.in_(list(scores)))).scalars()}
+    results: List[Dict] = [
+        dict(books[book_id].to_dict(), score=round(float(score), 4))
+        for book_id, score in scores.items()
+        if book_id in books
+    ]
+    return {'query': query, 'total': total, 'limit': limit, 'offset': offset, 'results': results}
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the local book catalog")
+    parser.add_argument('query')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--page', type=int, default=1)
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING)
+    
+    from database import db_manager
+    session = db_manager.get_session()
+    if not session:
+        logger.error("Failed to get database session")
+        sys.exit(1)
+    
+    try:
+        page = search_catalog(session, args.query, args.limit, (args.page - 1) * args.limit)
+    finally:
+        session.close()
+    
+    print(f"{page['total']} results for '{args.query}'")
+    for book in page['results']:
+        print(f"  [{book['score']:.2f}] {book['title']} by {book['author']} ({book['first_publish_year']})")
+
+if __name__ == "__main__":
+    main()
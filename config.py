@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,16 +11,80 @@ class Config:
     DB_NAME = os.getenv('DB_NAME', 'litwise_books')
     DB_USER = os.getenv('DB_USER', 'root')
     DB_PASSWORD = os.getenv('DB_PASSWORD', '')
+    DB_URL = os.getenv('DATABASE_URL')  # Overrides the MySQL settings, e.g. sqlite:///litwise_books.db
+    DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 500))  # Rows per bulk upsert
+    FINGERPRINT_BLOOM_THRESHOLD = int(os.getenv('FINGERPRINT_BLOOM_THRESHOLD', 5_000_000))  # Use a Bloom filter above this many rows
     
     # Open Library API
-    OPENLIBRARY_BASE_URL = "https://openlibrary.org"
+    OPENLIBRARY_BASE_URL = os.getenv('OPENLIBRARY_BASE_URL', "https://openlibrary.org")
     OPENLIBRARY_SEARCH_URL = f"{OPENLIBRARY_BASE_URL}/search.json"
     OPENLIBRARY_WORKS_URL = f"{OPENLIBRARY_BASE_URL}/works"
+    OPENLIBRARY_BOOKS_API_URL = f"{OPENLIBRARY_BASE_URL}/api/books"
+    OPENLIBRARY_COVERS_URL = os.getenv('OPENLIBRARY_COVERS_URL', "https://covers.openlibrary.org")
+    BIBKEYS_PER_REQUEST = int(os.getenv('BIBKEYS_PER_REQUEST', 50))  # ISBNs/OLIDs per Books API call
     
     # Request settings
     REQUEST_TIMEOUT = 30
     REQUEST_DELAY = 0.5  # Delay between API calls to be respectful
     
+    # Concurrency settings
+    REQUESTS_PER_SECOND = float(os.getenv('REQUESTS_PER_SECOND', 1 / REQUEST_DELAY))  # Shared across all workers
+    MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 8))
+    SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 100))  # Docs per search request when harvesting
+    
+    # Retries and circuit breaking (REQUESTS_PER_SECOND and MAX_CONCURRENT_REQUESTS become ceilings
+    # that the client backs off from when Open Library throttles or slows down)
+    MAX_REQUEST_ATTEMPTS = int(os.getenv('MAX_REQUEST_ATTEMPTS', 5))
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 0.1))  # Seconds; doubled per attempt, with full jitter
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 30))
+    RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', 0.2))  # Retries earned per successful request
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 10))  # Consecutive failures that open it
+    CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', 5))  # First pause before probing; doubles
+    CIRCUIT_MAX_WAIT = float(os.getenv('CIRCUIT_MAX_WAIT', 300))  # Longest a request waits on an open circuit
+    
+    # HTTP response cache (disabled unless a path is set)
+    HTTP_CACHE_PATH = os.getenv('HTTP_CACHE_PATH')
+    HTTP_CACHE_MAX_MB = int(os.getenv('HTTP_CACHE_MAX_MB', 512))
+    HTTP_CACHE_TTLS = {  # Seconds before an entry must be revalidated
+        'search': 24 * 3600,
+        'works': 7 * 24 * 3600,
+        'editions': 30 * 24 * 3600,
+        'books': 30 * 24 * 3600
+    }
+    
+    # Local cover image store
+    COVER_CACHE_DIR = os.getenv('COVER_CACHE_DIR', 'covers')
+    COVER_CACHE_MAX_MB = int(os.getenv('COVER_CACHE_MAX_MB', 2048))
+    COVER_THUMBNAIL_SIZE = (160, 240)  # Max width, height
+    COVERS_PER_SECOND = float(os.getenv('COVERS_PER_SECOND', 5))
+    
+    # Instrumentation (counters and histograms are cheap enough to leave on)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+    
+    # Recommendation index
+    SIMILARITY_INDEX_PATH = os.getenv('SIMILARITY_INDEX_PATH', 'similarity_index')
+    
+    # Memory-mapped catalog snapshot for database-free lookups
+    CATALOG_SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH', 'catalog_snapshot')
+    
+    # In-process cache of book lookups (see book_service.py)
+    BOOK_CACHE_MAX_ENTRIES = int(os.getenv('BOOK_CACHE_MAX_ENTRIES', 100_000))
+    BOOK_CACHE_MAX_MB = float(os.getenv('BOOK_CACHE_MAX_MB', 256))
+    BOOK_CACHE_TTL = float(os.getenv('BOOK_CACHE_TTL', 300))  # Seconds; bounds staleness after other processes write
+    
+    # Keyword tags extracted from descriptions and subjects
+    TAGS_PER_BOOK = int(os.getenv('TAGS_PER_BOOK', 10))
+    TAG_MIN_DOCUMENT_FREQUENCY = int(os.getenv('TAG_MIN_DOCUMENT_FREQUENCY', 2))  # Rarer terms are treated as noise
+    TAG_WORKERS = int(os.getenv('TAG_WORKERS', 0)) or None  # Processes; default one per core
+    TAG_FREQUENCIES_PATH = os.getenv('TAG_FREQUENCIES_PATH', 'tag_frequencies.npz')
+    
     @property
     def DATABASE_URL(self):
-        return f"mysql+pymysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}" 
\ No newline at end of file
+        if self.DB_URL:
+            return self.DB_URL
+        return f"mysql+pymysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}" 
+
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    """Process-wide Config instance shared by the client, database layer and CLI"""
+    return Config()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Cover image prefetcher with a content-addressed, size-capped local store
+"""
+
+import argparse
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam, select, update
+
+from config import Config
+from metrics import metrics
+from models import Book
+from openlibrary_client import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Marks books whose cover does not exist upstream so they are not retried on every run
+NO_COVER = ''
+
+_SIGNATURES = ((b'\xff\xd8\xff', '.jpg'), (b'\x89PNG', '.png'), (b'GIF8', '.gif'), (b'RIFF', '.webp'))
+
+def _extension(data: bytes) -> str:
+    for signature, extension in _SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    return '.img'
+
+class CoverStore:
+    """Images stored under their SHA-256, so identical covers share one file, with LRU eviction"""
+    
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 thumbnail_size: Optional[Tuple[int, int]] = None):
+        self.root = root or Config.COVER_CACHE_DIR
+        self.max_bytes = max_bytes or Config.COVER_CACHE_MAX_MB * 1024 * 1024
+        self.thumbnail_size = thumbnail_size or Config.COVER_THUMBNAIL_SIZE
+        self.lock = threading.Lock()
+        self.evicted: List[str] = []  # Relative paths removed since the last drain_evicted()
+        os.makedirs(self.root, exist_ok=True)
+        
+        self.conn = sqlite3.connect(os.path.join(self.root, 'index.db'), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                thumbnail_path TEXT,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_blobs_accessed_at ON blobs (accessed_at)")
+        self.conn.commit()
+        
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        
+        try:
+            from PIL import Image
+            self.image_module = Image
+        except ImportError:
+            logger.warning("Pillow is not installed, covers will be stored without thumbnails")
+            self.image_module = None
+    
+    def _write(self, relative_path: str, data: bytes):
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{threading.get_ident()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    def _thumbnail(self, data: bytes) -> Optional[bytes]:
+        if self.image_module is None:
+            return None
+        try:
+            with self.image_module.open(io.BytesIO(data)) as image:
+                image = image.convert('RGB')
+                image.thumbnail(self.thumbnail_size)
+                output = io.BytesIO()
+                image.save(output, 'JPEG', quality=80, optimize=True)
+                return output.getvalue()
+        except Exception as e:
+            logger.warning(f"Could not build thumbnail: {e}")
+            return None
+    
+    def put(self, data: bytes) -> Tuple[str, Optional[str]]:
+        """Store an image (once per distinct content) and return its relative path and thumbnail path"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            row = self.conn.execute("SELECT path, thumbnail_path FROM blobs WHERE digest = ?", (digest,)).fetchone()
+            if row:
+                self.conn.execute("UPDATE blobs SET accessed_at = ? WHERE digest = ?", (time.time(), digest))
+                self.conn.commit()
+                metrics.inc('covers_deduplicated_total')
+                return row[0], row[1]
+        
+        # Encoding happens outside the lock so workers can build thumbnails in parallel
+        path = os.path.join(digest[:2], digest[2:4], f"{digest}{_extension(data)}")
+        self._write(path, data)
+        thumbnail = self._thumbnail(data)
+        thumbnail_path = None
+        if thumbnail is not None:
+            thumbnail_path = os.path.join('thumbs', digest[:2], f"{digest}.jpg")
+            self._write(thumbnail_path, thumbnail)
+        size = len(data) + len(thumbnail or b'')
+        
+        with self.lock:
+            inserted = self.conn.execute(
+                "INSERT OR IGNORE INTO blobs (digest, path, thumbnail_path, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (digest, path, thumbnail_path, size, time.time())
+            ).rowcount
+            if inserted:
+                self.total_bytes += size
+                if self.total_bytes > self.max_bytes:
+                    self._evict()
+            self.conn.commit()
+        return path, thumbnail_path
+    
+    def open_path(self, relative_path: Optional[str]) -> Optional[str]:
+        """Absolute path for a stored image, marking it as recently used; None if it was evicted"""
+        if not relative_path:
+            return None
+        digest = os.path.basename(relative_path).split('.', 1)[0]
+        with self.lock:
+            touched = self.conn.execute(
+                "UPDATE blobs SET accessed_at = ? WHERE digest = ?", (time.time(), digest)
+            ).rowcount
+            self.conn.commit()
+        return os.path.join(self.root, relative_path) if touched else None
+    
+    def _evict(self):
+        """Delete least recently used images until the store is back under 90% of its budget"""
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute("SELECT digest, path, thumbnail_path, size FROM blobs ORDER BY accessed_at").fetchall()
+        
+        evicted = []
+        for digest, path, thumbnail_path, size in rows:
+            if self.total_bytes <= target:
+                break
+            for relative_path in (path, thumbnail_path):
+                if relative_path and os.path.exists(os.path.join(self.root, relative_path)):
+                    os.remove(os.path.join(self.root, relative_path))
+            evicted.append((digest,))
+            self.evicted.append(path)
+            self.total_bytes -= size
+        
+        self.conn.executemany("DELETE FROM blobs WHERE digest = ?", evicted)
+        metrics.inc('covers_evicted_total', len(evicted))
+        logger.info(f"Evicted {len(evicted)} cover images")
+    
+    def drain_evicted(self) -> List[str]:
+        """Paths evicted since the last call, minus any that were stored again in the meantime"""
+        with self.lock:
+            evicted, self.evicted = self.evicted, []
+            stored = {
+                row[0] for row in self.conn.execute(
+                    f"SELECT path FROM blobs WHERE path IN ({','.join('?' * len(evicted))})", evicted
+                )
+            } if evicted else set()
+        return [path for path in evicted if path not in stored]
+    
+    def get_stats(self) -> Dict:
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+            return {'images': count, 'size_bytes': self.total_bytes, 'max_bytes': self.max_bytes}
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class CoverPrefetcher:
+    """Downloads covers for books that have a cover URL but no local copy, one committed batch at a time"""
+    
+    def __init__(self, store: Optional[CoverStore] = None, max_workers: Optional[int] = None,
+                 rate_limiter: Optional[TokenBucket] = None, batch_size: int = 100):
+        self.store = store or CoverStore()
+        self.max_workers = max_workers or Config.MAX_CONCURRENT_REQUESTS
+        self.rate_limiter = rate_limiter or TokenBucket(Config.COVERS_PER_SECOND)
+        self.batch_size = batch_size
+        
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': 'LitWise-Books/1.0 (https://github.com/yourusername/litwise-books)'
+        })
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.max_workers * 2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def _download(self, url: str) -> Optional[bytes]:
+        """Fetch one cover; b'' means the cover does not exist, None means a transient failure"""
+        metrics.observe('covers_rate_limit_wait_seconds', self.rate_limiter.acquire())
+        started = time.perf_counter()
+        try:
+            # default=false turns the placeholder image into a 404 for books without a cover
+            response = self.session.get(url, params={'default': 'false'}, timeout=Config.REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            logger.warning(f"Error downloading cover {url}: {e}")
+            return None
+        finally:
+            metrics.observe('covers_download_seconds', time.perf_counter() - started)
+        
+        metrics.inc('covers_requests_total', status=str(response.status_code))
+        if response.status_code == 404:
+            return b''
+        if not response.ok:
+            logger.warning(f"Error downloading cover {url}: HTTP {response.status_code}")
+            return None
+        metrics.inc('covers_bytes_total', len(response.content))
+        return response.content
+    
+    def _fetch(self, book: Tuple[int, str]) -> Optional[Dict]:
+        book_id, url = book
+        data = self._download(url)
+        if data is None:
+            return None
+        if not data:
+            return {'book_id': book_id, 'cover_path': NO_COVER, 'cover_thumbnail_path': None}
+        path, thumbnail_path = self.store.put(data)
+        return {'book_id': book_id, 'cover_path': path, 'cover_thumbnail_path': thumbnail_path}
+    
+    def _pending(self, session, after_id: int, book_ids: Optional[List[int]]) -> List[Tuple[int, str]]:
+        query = (
+            select(Book.id, Book.cover_image_url)
+            .where(Book.id > after_id, Book.cover_image_url.isnot(None), Book.cover_path.is_(None))
+            .order_by(Book.id)
+            .limit(self.batch_size)
+        )
+        if book_ids is not None:
+            query = query.where(Book.id.in_(book_ids))
+        return [tuple(row) for row in session.execute(query)]
+    
+    def _forget_evicted(self, session):
+        evicted = self.store.drain_evicted()
+        if evicted:
+            session.execute(
+                update(Book)
+                .where(Book.cover_path.in_(evicted))
+                .values(cover_path=None, cover_thumbnail_path=None, updated_at=Book.updated_at)
+            )
+    
+    def prefetch(self, session, book_ids: Optional[Iterable[int]] = None, limit: Optional[int] = None) -> Dict:
+        """Download missing covers (optionally only for book_ids); safe to interrupt and re-run"""
+        book_ids = sorted(set(book_ids)) if book_ids is not None else None
+        totals = {'stored': 0, 'missing': 0, 'failed': 0}
+        record = (
+            update(Book.__table__)
+            .where(Book.__table__.c.id == bindparam('book_id'))
+            .values(
+                cover_path=bindparam('cover_path'),
+                cover_thumbnail_path=bindparam('cover_thumbnail_path'),
+                updated_at=Book.__table__.c.updated_at
+            )
+        )
+        
+        last_id = 0
+        processed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while limit is None or processed < limit:
+                # Chunk the id filter so IN lists stay small; pending books are found from the last id onwards
+                chunk_ids = None
+                if book_ids is not None:
+                    chunk_ids = [book_id for book_id in book_ids if book_id > last_id][:self.batch_size]
+                    if not chunk_ids:
+                        break
+                batch = self._pending(session, last_id, chunk_ids)
+                if limit is not None:
+                    batch = batch[:limit - processed]
+                if not batch:
+                    if chunk_ids:
+                        last_id = chunk_ids[-1]
+                        continue
+                    break
+                
+                results = list(executor.map(self._fetch, batch))
+                stored = [result for result in results if result is not None]
+                if stored:
+                    session.execute(record, stored)
+                self._forget_evicted(session)
+                session.commit()
+                
+                totals['failed'] += len(results) - len(stored)
+                totals['missing'] += sum(1 for result in stored if result['cover_path'] == NO_COVER)
+                totals['stored'] += sum(1 for result in stored if result['cover_path'] != NO_COVER)
+                processed += len(batch)
+                last_id = max(batch[-1][0], chunk_ids[-1] if chunk_ids else 0)
+                logger.info(f"Cover prefetch progress: {totals}")
+        
+        logger.info(f"Cover prefetch finished: {totals}, store: {self.store.get_stats()}")
+        return totals
+
+def cover_file(session, store: CoverStore, book_id: int, thumbnail: bool = True) -> Optional[str]:
+    """Local file for a book's cover (or thumbnail), or None if it has not been fetched"""
+    row = session.execute(select(Book.cover_path, Book.cover_thumbnail_path).where(Book.id == book_id)).first()
+    if row is None:
+        return None
+    return store.open_path(row.cover_thumbnail_path if thumbnail and row.cover_thumbnail_path else row.cover_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Download cover images into the local cover store")
+    parser.add_argument('--limit', type=int, help="Stop after this many books")
+    parser.add_argument('--batch-size', type=int, default=100, help="Books committed per batch")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    from database import init_database, db_manager
+    if not init_database():
+        logger.error("Failed to initialize database. Please check your database configuration.")
+        sys.exit(1)
+    
+    session = db_manager.get_session()
+    prefetcher = CoverPrefetcher(batch_size=args.batch_size)
+    try:
+        prefetcher.prefetch(session, limit=args.limit)
+    finally:
+        session.close()
+        prefetcher.store.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,95 @@
-from sqlalchemy import create_engine
+import time
+from typing import Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.exc import SQLAlchemyError
 from models import Base, Book
-from config import Config
+from config import get_config
+from metrics import metrics
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long connect() waits, including on an exhausted pool"""
+    
+    def connect(self):
+        with metrics.timer('db_pool_checkout_seconds'):
+            return super().connect()
+
 class DatabaseManager:
     def __init__(self):
-        self.config = Config()
+        self.config = get_config()
         self.engine = None
         self.SessionLocal = None
         
-    def connect(self):
-        """Create database engine and session factory"""
+    def connect(self, pool_size: Optional[int] = None):
+        """Create database engine and session factory, optionally with a sized connection pool"""
         try:
+            pool_options = {'pool_size': pool_size, 'max_overflow': pool_size} if pool_size else {}
+            url = make_url(self.config.DATABASE_URL)
+            if metrics.enabled and url.get_dialect().get_pool_class(url) is QueuePool:
+                # Pool events only fire once a connection is handed out, so the wait is timed in the pool
+                pool_options['poolclass'] = TimedQueuePool
             self.engine = create_engine(
-                self.config.DATABASE_URL,
+                url,
                 pool_pre_ping=True,
-                pool_recycle=300
+                pool_recycle=300,
+                **pool_options
             )
             self.SessionLocal = sessionmaker(
                 autocommit=False, 
                 autoflush=False, 
                 bind=self.engine
             )
+            if metrics.enabled:
+                self._instrument()
             logger.info("Database connection established successfully")
             return True
         except SQLAlchemyError as e:
             logger.error(f"Failed to connect to database: {e}")
             return False
     
+    def _instrument(self):
+        """Record per-statement time and commit time (pool checkout wait is timed by TimedQueuePool)"""
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('statement_started', []).append(time.perf_counter())
+        
+        @event.listens_for(self.engine, 'after_cursor_execute')
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+            operation = (statement.split(None, 1) or ['other'])[0].upper()
+            metrics.observe('db_statement_seconds', elapsed, operation=operation)
+        
+        @event.listens_for(self.engine, 'handle_error')
+        def statement_failed(context):
+            started = context.connection.info.get('statement_started') if context.connection else None
+            if started:
+                started.pop()
+            metrics.inc('db_errors_total')
+        
+        @event.listens_for(self.SessionLocal, 'before_commit')
+        def before_commit(session):
+            session.info['commit_started'] = time.perf_counter()
+        
+        @event.listens_for(self.SessionLocal, 'after_commit')
+        def after_commit(session):
+            started = session.info.pop('commit_started', None)
+            if started is not None:
+                metrics.observe('db_commit_seconds', time.perf_counter() - started)
+    
     def create_tables(self):
         """Create all tables in the database"""
         try:
             Base.metadata.create_all(bind=self.engine)
             logger.info("Database tables created successfully")
-            return True
+            
+            # Tables that already existed may predate newer columns and indexes
+            from migrations import run_migrations
+            return run_migrations(self.engine)
         except SQLAlchemyError as e:
             logger.error(f"Failed to create tables: {e}")
             return False
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import logging
+import math
+import re
+import unicodedata
+from typing import Dict, Optional
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from config import Config
+from models import Book
+
+logger = logging.getLogger(__name__)
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+# Formatted fields that make up a book's content; a change in any of them means the row must be rewritten
+CONTENT_FIELDS = (
+    'title', 'author', 'isbn', 'isbn13', 'first_publish_year', 'publisher', 'number_of_pages',
+    'work_key', 'description', 'subjects', 'cover_image_url', 'language'
+)
+
+def normalize_text(value: Optional[str]) -> str:
+    """Lowercase, strip accents and punctuation, and collapse whitespace"""
+    if not value:
+        return ''
+    if not value.isascii():  # ASCII has no accents to strip, which skips the per-character pass
+        value = unicodedata.normalize('NFKD', value)
+        value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(' ', value.casefold()).strip()
+
+def book_fingerprint(title: Optional[str], author: Optional[str]) -> str:
+    """Build the dedup key for a book from its normalized title and author set"""
+    authors = sorted(filter(None, (normalize_text(name) for name in (author or '').split(','))))
+    payload = f"{normalize_text(title)}\x1f{'|'.join(authors)}"
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def content_hash(book: Dict) -> str:
+    """Hash the content fields of a formatted book (or a row read back from the database)"""
+    payload = json.dumps([book.get(field) for field in CONTENT_FIELDS], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+class BloomFilter:
+    """Fixed-size Bloom filter over hex fingerprints"""
+    
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, fingerprint: str):
+        # Fingerprints are already uniformly distributed, so double hashing on two slices is enough
+        h1 = int(fingerprint[:16], 16)
+        h2 = int(fingerprint[16:32], 16) | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+    
+    def add(self, fingerprint: str):
+        for position in self._positions(fingerprint):
+            self.bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, fingerprint: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(fingerprint))
+
+class FingerprintIndex:
+    """In-memory view of the fingerprints already stored in the books table"""
+    
+    def __init__(self, use_bloom: bool = False, capacity: int = 0):
+        self.exact = not use_bloom
+        self.members = set() if self.exact else BloomFilter(capacity)
+    
+    @classmethod
+    def preload(cls, session: Session, bloom_threshold: Optional[int] = None) -> 'FingerprintIndex':
+        """Stream every stored fingerprint into a set, or a Bloom filter for very large tables"""
+        bloom_threshold = bloom_threshold or Config.FINGERPRINT_BLOOM_THRESHOLD
+        count = session.execute(select(func.count(Book.fingerprint))).scalar() or 0
+        
+        # Leave headroom so the filter keeps its error rate while the ingest adds rows
+        index = cls(use_bloom=count > bloom_threshold, capacity=count * 2)
+        rows = session.execute(
+            select(Book.fingerprint).where(Book.fingerprint.isnot(None)).execution_options(yield_per=10000)
+        )
+        for fingerprint in rows.scalars():
+            index.add(fingerprint)
+        
+        logger.info(f"Preloaded {count} fingerprints into {'a set' if index.exact else 'a Bloom filter'}")
+        return index
+    
+    def _member(self, fingerprint: str):
+        # 64-bit prefixes keep the exact set compact; collisions are negligible at catalog scale
+        return int(fingerprint[:16], 16) if self.exact else fingerprint
+    
+    def add(self, fingerprint: str):
+        self.members.add(self._member(fingerprint))
+    
+    def __contains__(self, fingerprint: str) -> bool:
+        return self._member(fingerprint) in self.members
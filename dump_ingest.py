@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Bulk ingest from Open Library data dump files (ol_dump_works/editions/authors .txt.gz)
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+from contextlib import closing
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from bulk_writer import BulkBookWriter
+from database import init_database, db_manager
+from dedup import FingerprintIndex
+from openlibrary_client import OpenLibraryClient
+
+logger = logging.getLogger(__name__)
+
+_YEAR = re.compile(r'\b(\d{4})\b')
+
+def open_dump(path: str):
+    """Open a dump file as text, decompressing gzip on the fly"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'rt', encoding='utf-8')
+
+def split_byte_ranges(path: str, count: int) -> List[Tuple[int, int]]:
+    """Cut an uncompressed dump into count (start, end) byte ranges for iter_dump_records"""
+    size = os.path.getsize(path)
+    bounds = [size * index // count for index in range(count + 1)]
+    return [(bounds[index], bounds[index + 1]) for index in range(count)]
+
+def _iter_range_lines(path: str, start: int, end: int) -> Iterator[str]:
+    """Lines that start inside [start, end); the line straddling start belongs to the previous range"""
+    with open(path, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode('utf-8')
+
+def iter_dump_records(path: str, record_type: str, byte_range: Optional[Tuple[int, int]] = None,
+                      shard: Optional[Tuple[int, int]] = None) -> Iterator[Tuple[str, Dict]]:
+    """Yield (key, record) for one record type, parsing the JSON column only for matching lines
+    
+    byte_range (uncompressed files only) restricts the scan to one slice of the file;
+    shard=(index, count) keeps only keys whose hash falls in that shard.
+    """
+    prefix = f"{record_type}\t"
+    if byte_range is not None:
+        if path.endswith('.gz'):
+            raise ValueError("Byte ranges need an uncompressed dump; use hash shards for .gz files")
+        lines = _iter_range_lines(path, *byte_range)
+    else:
+        lines = open_dump(path)
+    
+    with closing(lines):
+        for line_number, line in enumerate(lines, 1):
+            if not line.startswith(prefix):
+                continue
+            try:
+                _, key, _, _, payload = line.rstrip('\n').split('\t', 4)
+                if shard is not None and zlib.crc32(key.encode('utf-8')) % shard[1] != shard[0]:
+                    continue
+                yield key, json.loads(payload)
+            except ValueError as e:
+                logger.warning(f"Skipping malformed line {line_number} in {path}: {e}")
+
+def work_to_search_doc(work: Dict, author_names: List[str], edition: Optional[Dict] = None) -> Dict:
+    """Map a work record (plus its best edition) onto the search API's doc shape"""
+    year = _YEAR.search(work.get('first_publish_date') or '')
+    covers = [cover for cover in work.get('covers', []) if isinstance(cover, int) and cover > 0]
+    edition = edition or {}
+    
+    return {
+        'key': work.get('key'),
+        'title': work.get('title'),
+        'author_name': author_names,
+        'first_publish_year': int(year.group(1)) if year else None,
+        'isbn': [isbn for isbn in (edition.get('isbn_10'), edition.get('isbn_13')) if isbn],
+        'subject': [subject for subject in work.get('subjects', []) if isinstance(subject, str)],
+        'cover_i': covers[0] if covers else None,
+        'publisher': [edition['publisher']] if edition.get('publisher') else [],
+        'number_of_pages_median': edition.get('number_of_pages')
+    }
+
+class DumpIngester:
+    """Streams dump files through format_book_data into the bulk writer"""
+    
+    def __init__(self, scratch_path: Optional[str] = None, batch_size: Optional[int] = None,
+                 lookup_batch: int = 1000):
+        self.client = OpenLibraryClient()
+        self.batch_size = batch_size
+        self.lookup_batch = lookup_batch
+        
+        # Author names and edition summaries live on disk so memory stays bounded
+        self.temporary_scratch = scratch_path is None
+        if self.temporary_scratch:
+            fd, scratch_path = tempfile.mkstemp(suffix='.db', prefix='litwise_dump_')
+            os.close(fd)
+        self.scratch_path = scratch_path
+        self.scratch = sqlite3.connect(scratch_path)
+        self.scratch.executescript("""
+            PRAGMA journal_mode=OFF;
+            PRAGMA synchronous=OFF;
+            CREATE TABLE IF NOT EXISTS authors (key TEXT PRIMARY KEY, name TEXT);
+            CREATE TABLE IF NOT EXISTS editions (
+                work_key TEXT PRIMARY KEY,
+                isbn_10 TEXT,
+                isbn_13 TEXT,
+                publisher TEXT,
+                number_of_pages INTEGER
+            );
+        """)
+    
+    def close(self):
+        """Close the scratch database, deleting it if it was a temp file"""
+        self.scratch.close()
+        if self.temporary_scratch and os.path.exists(self.scratch_path):
+            os.remove(self.scratch_path)
+    
+    def _bulk_load(self, sql: str, rows: Iterator[Tuple], label: str, chunk_size: int = 10000) -> int:
+        count = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                self.scratch.executemany(sql, chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            self.scratch.executemany(sql, chunk)
+            count += len(chunk)
+        self.scratch.commit()
+        logger.info(f"Loaded {count} {label}")
+        return count
+    
+    def load_authors(self, path: str) -> int:
+        """Index author names by key"""
+        rows = (
+            (key, record.get('name'))
+            for key, record in iter_dump_records(path, '/type/author')
+            if record.get('name')
+        )
+        return self._bulk_load("INSERT OR REPLACE INTO authors VALUES (?, ?)", rows, 'authors')
+    
+    def load_editions(self, path: str) -> int:
+        """Keep, per work, the first known ISBNs, publisher and page count across its editions"""
+        def rows():
+            for _, record in iter_dump_records(path, '/type/edition'):
+                isbn_10 = (record.get('isbn_10') or [None])[0]
+                isbn_13 = (record.get('isbn_13') or [None])[0]
+                publisher = (record.get('publishers') or [None])[0]
+                pages = record.get('number_of_pages')
+                pages = pages if isinstance(pages, int) else None
+                for work in record.get('works', []):
+                    if work.get('key'):
+                        yield work['key'], isbn_10, isbn_13, publisher, pages
+        
+        return self._bulk_load("""
+            INSERT INTO editions VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(work_key) DO UPDATE SET
+                isbn_10 = COALESCE(isbn_10, excluded.isbn_10),
+                isbn_13 = COALESCE(isbn_13, excluded.isbn_13),
+                publisher = COALESCE(publisher, excluded.publisher),
+                number_of_pages = COALESCE(number_of_pages, excluded.number_of_pages)
+        """, rows(), 'edition summaries')
+    
+    def _lookup(self, table: str, key_column: str, keys: List[str], chunk_size: int = 500) -> Dict[str, Dict]:
+        """Rows by key, in chunks that stay under older SQLite builds' 999-variable limit"""
+        found = {}
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            cursor = self.scratch.execute(f"SELECT * FROM {table} WHERE {key_column} IN ({placeholders})", chunk)
+            columns = [column[0] for column in cursor.description]
+            found.update((row[0], dict(zip(columns, row))) for row in cursor)
+        return found
+    
+    def _format_batch(self, works: List[Dict]) -> Iterator[Dict]:
+        author_keys = list({
+            author['author']['key']
+            for work in works
+            for author in work.get('authors', [])
+            if isinstance(author.get('author'), dict) and author['author'].get('key')
+        })
+        authors = self._lookup('authors', 'key', author_keys)
+        editions = self._lookup('editions', 'work_key', [work['key'] for work in works])
+        
+        for work in works:
+            names = [
+                authors[author['author']['key']]['name']
+                for author in work.get('authors', [])
+                if isinstance(author.get('author'), dict) and author['author'].get('key') in authors
+            ]
+            doc = work_to_search_doc(work, names, editions.get(work['key']))
+            # The work record doubles as work_details so descriptions are extracted the same way
+            yield self.client.format_book_data(doc, work)
+    
+    def iter_formatted_works(self, path: str, limit: Optional[int] = None, byte_range: Optional[Tuple[int, int]] = None,
+                             shard: Optional[Tuple[int, int]] = None) -> Iterator[Dict]:
+        """Stream formatted books from the works dump, resolving authors and editions in batches"""
+        batch = []
+        produced = 0
+        for key, work in iter_dump_records(path, '/type/work', byte_range, shard):
+            if not work.get('title'):
+                continue
+            work.setdefault('key', key)
+            batch.append(work)
+            if limit and produced + len(batch) >= limit:
+                break
+            if len(batch) >= self.lookup_batch:
+                yield from self._format_batch(batch)
+                produced += len(batch)
+                batch = []
+        if batch:
+            yield from self._format_batch(batch)
+    
+    def ingest(self, works_path: str, editions_path: Optional[str] = None,
+               authors_path: Optional[str] = None, limit: Optional[int] = None,
+               byte_range: Optional[Tuple[int, int]] = None, shard: Optional[Tuple[int, int]] = None,
+               on_progress: Optional[Callable[[Dict], None]] = None, progress_every: int = 100000) -> Dict:
+        """Load the lookup dumps, then stream works (or one byte range or shard of them) into the database"""
+        started = time.monotonic()
+        if authors_path:
+            self.load_authors(authors_path)
+        if editions_path:
+            self.load_editions(editions_path)
+        
+        session = db_manager.get_session()
+        if not session:
+            logger.error("Failed to get database session")
+            return {}
+        
+        try:
+            writer = BulkBookWriter(session, self.batch_size, FingerprintIndex.preload(session))
+            processed = 0
+            for book in self.iter_formatted_works(works_path, limit, byte_range, shard):
+                writer.add(book)
+                processed += 1
+                if processed % progress_every == 0:
+                    rate = processed / (time.monotonic() - started)
+                    logger.info(f"Processed {processed} works ({rate:.0f}/s): {writer.totals}")
+                    if on_progress:
+                        on_progress(dict(writer.totals, processed=processed))
+            writer.flush()
+            
+            elapsed = time.monotonic() - started
+            logger.info(f"Dump ingest finished: {processed} works in {elapsed:.1f}s, {writer.totals}")
+            return dict(writer.totals, processed=processed)
+        finally:
+            session.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest books from Open Library dump files")
+    parser.add_argument('--works', required=True, help="Path to ol_dump_works_*.txt.gz")
+    parser.add_argument('--editions', help="Path to ol_dump_editions_*.txt.gz (ISBNs, publishers, pages)")
+    parser.add_argument('--authors', help="Path to ol_dump_authors_*.txt.gz (author names)")
+    parser.add_argument('--limit', type=int, help="Stop after this many works")
+    parser.add_argument('--scratch', help="SQLite file for author/edition lookups (default: temp file)")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    if not init_database():
+        logger.error("Failed to initialize database. Please check your database configuration.")
+        sys.exit(1)
+    
+    ingester = DumpIngester(args.scratch)
+    try:
+        ingester.ingest(args.works, args.editions, args.authors, args.limit)
+    finally:
+        ingester.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Stream the books table to Parquet or JSONL without loading it into memory
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import sys
+import time
+from typing import Iterator, List, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import Book
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = [column.name for column in Book.__table__.columns]
+
+def resolve_columns(names: Optional[Sequence[str]] = None) -> List:
+    """Map column names to Book table columns, defaulting to all of them"""
+    names = list(names or EXPORT_COLUMNS)
+    unknown = [name for name in names if name not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return [Book.__table__.c[name] for name in names]
+
+def iter_book_chunks(session: Session, columns: List, chunk_size: int = 10000,
+                     limit: Optional[int] = None) -> Iterator[List[tuple]]:
+    """Yield lists of plain row tuples using a server-side cursor, never building ORM objects"""
+    query = select(*columns).order_by(Book.id)
+    if limit:
+        query = query.limit(limit)
+    
+    result = session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+    for partition in result.partitions():
+        yield [tuple(row) for row in partition]
+
+def _arrow_type(column):
+    import pyarrow as pa
+    
+    python_type = column.type.python_type
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is datetime.datetime:
+        return pa.timestamp('us')
+    if python_type is datetime.date:
+        return pa.date32()
+    return pa.string()
+
+def write_parquet(chunks: Iterator[List[tuple]], columns: List, path: str, compression: str = 'zstd') -> int:
+    """Write each chunk as its own row group so only one chunk is ever held in memory"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+    
+    schema = pa.schema([pa.field(column.name, _arrow_type(column)) for column in columns])
+    count = 0
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for rows in chunks:
+            values = list(zip(*rows))
+            arrays = [pa.array(list(column_values), type=field.type) for column_values, field in zip(values, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    return count
+
+def write_jsonl(chunks: Iterator[List[tuple]], columns: List, path: str) -> int:
+    """One JSON object per line; gzip-compressed when the path ends in .gz"""
+    names = [column.name for column in columns]
+    opener = gzip.open if path.endswith('.gz') else open
+    count = 0
+    with opener(path, 'wt', encoding='utf-8') as f:
+        for rows in chunks:
+            f.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False, default=str) + '\n' for row in rows)
+            count += len(rows)
+    return count
+
+def export_books(session: Session, path: str, output_format: Optional[str] = None,
+                 columns: Optional[Sequence[str]] = None, chunk_size: int = 10000,
+                 limit: Optional[int] = None) -> int:
+    """Export the catalog to path; the format defaults to the file extension"""
+    if output_format is None:
+        output_format = 'parquet' if path.endswith('.parquet') else 'jsonl'
+    table_columns = resolve_columns(columns)
+    chunks = iter_book_chunks(session, table_columns, chunk_size, limit)
+    
+    started = time.monotonic()
+    if output_format == 'parquet':
+        count = write_parquet(chunks, table_columns, path)
+    elif output_format == 'jsonl':
+        count = write_jsonl(chunks, table_columns, path)
+    else:
+        raise ValueError(f"Unsupported export format: {output_format}")
+    
+    logger.info(f"Exported {count} books to {path} in {time.monotonic() - started:.1f}s")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the book catalog to Parquet or JSONL")
+    parser.add_argument('path', help="Output file (.parquet, .jsonl or .jsonl.gz)")
+    parser.add_argument('--format', choices=['parquet', 'jsonl'], help="Defaults to the file extension")
+    parser.add_argument('--columns', help=f"Comma-separated columns (default: all of {', '.join(EXPORT_COLUMNS)})")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="Rows fetched and written per chunk")
+    parser.add_argument('--limit', type=int, help="Export at most this many books")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    from database import db_manager
+    session = db_manager.get_session()
+    if not session:
+        logger.error("Failed to get database session")
+        sys.exit(1)
+    
+    try:
+        columns = [name.strip() for name in args.columns.split(',')] if args.columns else None
+        export_books(session, args.path, args.format, columns, args.chunk_size, args.limit)
+    except (ValueError, RuntimeError) as e:
+        logger.error(f"Export failed: {e}")
+        sys.exit(1)
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    main()
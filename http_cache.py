@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+from typing import Dict, Optional
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """Persistent SQLite-backed cache for Open Library HTTP responses"""
+    
+    def __init__(self, path: str, ttls: Optional[Dict[str, int]] = None,
+                 max_bytes: int = 512 * 1024 * 1024, default_ttl: int = 86400):
+        self.path = path
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'stores': 0, 'evictions': 0}
+        
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                cache_key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)")
+        self.conn.commit()
+        
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    
+    @staticmethod
+    def make_key(url: str, params: Optional[Dict] = None) -> str:
+        """Build a stable cache key from the URL and its query parameters"""
+        if not params:
+            return url
+        return f"{url}?{urlencode(sorted(params.items()))}"
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """Return the cached entry for a key, with a 'fresh' flag, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, etag, last_modified, expires_at FROM responses WHERE cache_key = ?",
+                (key,)
+            ).fetchone()
+            
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            
+            body, etag, last_modified, expires_at = row
+            fresh = expires_at > time.time()
+            if fresh:
+                self.stats['hits'] += 1
+                self.conn.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE cache_key = ?",
+                    (time.time(), key)
+                )
+                self.conn.commit()
+            else:
+                self.stats['misses'] += 1
+        
+        return {
+            'body': zlib.decompress(body).decode('utf-8'),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fresh': fresh
+        }
+    
+    def put(self, key: str, endpoint: str, body: str,
+            etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Store a response body, evicting least recently used entries if over budget"""
+        data = zlib.compress(body.encode('utf-8'))
+        now = time.time()
+        expires_at = now + self.ttls.get(endpoint, self.default_ttl)
+        
+        with self.lock:
+            previous = self.conn.execute(
+                "SELECT size FROM responses WHERE cache_key = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(cache_key, endpoint, body, size, etag, last_modified, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, data, len(data), etag, last_modified, expires_at, now)
+            )
+            self.total_bytes += len(data) - (previous[0] if previous else 0)
+            self.stats['stores'] += 1
+            
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            
+            self.conn.commit()
+    
+    def refresh(self, key: str, endpoint: str):
+        """Extend the lifetime of an entry after a 304 Not Modified response"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE responses SET expires_at = ?, accessed_at = ? WHERE cache_key = ?",
+                (now + self.ttls.get(endpoint, self.default_ttl), now, key)
+            )
+            self.conn.commit()
+            self.stats['revalidated'] += 1
+    
+    def _evict(self):
+        """Drop least recently accessed entries until the cache is back under 90% of its budget"""
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute(
+            "SELECT cache_key, size FROM responses ORDER BY accessed_at"
+        )
+        
+        evicted = []
+        for cache_key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((cache_key,))
+            self.total_bytes -= size
+        
+        self.conn.executemany("DELETE FROM responses WHERE cache_key = ?", evicted)
+        self.stats['evictions'] += len(evicted)
+        logger.info(f"Evicted {len(evicted)} cached responses")
+    
+    def get_stats(self) -> Dict:
+        """Return hit/miss counters and current cache size"""
+        with self.lock:
+            return dict(self.stats, size_bytes=self.total_bytes)
+    
+    def close(self):
+        """Close the underlying SQLite connection"""
+        with self.lock:
+            self.conn.close()
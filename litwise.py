@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Unified LitWise command line; heavy modules are imported only by the subcommand that needs them
+"""
+
+import argparse
+import logging
+import sys
+from typing import List, Optional
+
+logger = logging.getLogger('litwise')
+
+def _session():
+    from database import db_manager
+    session = db_manager.get_session()
+    if not session:
+        logger.error("Failed to get database session")
+        sys.exit(1)
+    return session
+
+def cmd_populate(args):
+    from populate_books import run
+    run(args)
+
+def cmd_refresh(args):
+    from database import init_database
+    from metrics import metrics
+    from populate_books import BookPopulator
+    
+    if not init_database():
+        logger.error("Failed to initialize database. Please check your database configuration.")
+        sys.exit(1)
+    totals = BookPopulator().refresh_stale_books(args.count, args.stale_days)
+    if args.metrics:
+        metrics.write(args.metrics)
+    if not totals:
+        sys.exit(1)
+
+def cmd_stats(args):
+    from sqlalchemy import func, select
+    from models import Book, Subject
+    
+    session = _session()
+    try:
+        total, last_fetched = session.execute(select(func.count(Book.id), func.max(Book.last_fetched_at))).one()
+        subjects = session.execute(select(func.count(Subject.id))).scalar()
+        recent = session.execute(
+            select(Book.title, Book.author, Book.first_publish_year).order_by(Book.id.desc()).limit(args.recent)
+        ).all()
+    finally:
+        session.close()
+    
+    print(f"Books:         {total}")
+    print(f"Subjects:      {subjects}")
+    print(f"Last fetched:  {last_fetched or 'never'}")
+    if recent:
+        print("Recent additions:")
+        for title, author, year in recent:
+            print(f"  - {title} by {author} ({year})")
+
+def cmd_search(args):
+    from catalog_search import search_catalog
+    
+    session = _session()
+    try:
+        page = search_catalog(session, args.query, args.limit, (args.page - 1) * args.limit)
+    finally:
+        session.close()
+    
+    print(f"{page['total']} results for '{args.query}'")
+    for book in page['results']:
+        print(f"  [{book['score']:.2f}] {book['title']} by {book['author']} ({book['first_publish_year']})")
+
+def cmd_recommend(args):
+    from config import get_config
+    from recommender import SimilarityIndex
+    
+    path = args.index or get_config().SIMILARITY_INDEX_PATH
+    if args.build:
+        session = _session()
+        try:
+            SimilarityIndex.build_from_database(session).save(path)
+        finally:
+            session.close()
+        return
+    
+    index = SimilarityIndex.load(path)
+    if args.book_id is not None:
+        results = index.similar_books(args.book_id, args.k)
+    elif args.text:
+        results = index.similar_to_text(args.text, args.k)
+    else:
+        logger.error("Give a book id, --text or --build")
+        sys.exit(2)
+    
+    for book_id, score in results:
+        print(f"{book_id}\t{score:.3f}")
+
+def cmd_export(args):
+    from export import export_books
+    
+    session = _session()
+    try:
+        columns = [name.strip() for name in args.columns.split(',')] if args.columns else None
+        export_books(session, args.path, args.format, columns, args.chunk_size, args.limit)
+    except (ValueError, RuntimeError) as e:
+        logger.error(f"Export failed: {e}")
+        sys.exit(1)
+    finally:
+        session.close()
+
+def cmd_snapshot(args):
+    import json
+    from snapshot import CatalogSnapshot, build_snapshot
+    
+    if args.build:
+        session = _session()
+        try:
+            build_snapshot(session, args.path)
+        finally:
+            session.close()
+        return
+    if not args.key:
+        logger.error("Give a book id, work key or ISBN, or --build")
+        sys.exit(2)
+    
+    book = CatalogSnapshot.open(args.path).lookup(args.key)
+    if book is None:
+        logger.error(f"No book found for {args.key}")
+        sys.exit(1)
+    print(json.dumps(book, indent=2, ensure_ascii=False))
+
+def cmd_covers(args):
+    from covers import CoverPrefetcher
+    
+    session = _session()
+    prefetcher = CoverPrefetcher(batch_size=args.batch_size)
+    try:
+        prefetcher.prefetch(session, limit=args.limit)
+    finally:
+        session.close()
+        prefetcher.store.close()
+
+def cmd_tags(args):
+    from tags import TagExtractor, books_by_tag, tags_for_book
+    
+    session = _session()
+    try:
+        if args.book is not None:
+            for tag, weight in tags_for_book(session, args.book):
+                print(f"{weight:.3f}\t{tag}")
+        elif args.tag:
+            for book_id, weight in books_by_tag(session, args.tag, args.limit):
+                print(f"{book_id}\t{weight:.3f}")
+        else:
+            TagExtractor(workers=args.workers, chunk_size=args.chunk_size).extract(session, rebuild=args.rebuild)
+    finally:
+        session.close()
+
+def cmd_check(args):
+    from test_connection import test_connection
+    if not test_connection():
+        sys.exit(1)
+
+def _command(argv: Optional[List[str]]) -> Optional[str]:
+    """The subcommand named in argv; the top-level options take no values"""
+    for arg in sys.argv[1:] if argv is None else argv:
+        if not arg.startswith('-'):
+            return arg
+    return None
+
+def build_parser(argv: Optional[List[str]] = None) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='litwise', description="LitWise Books command line")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log at INFO level")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    populate = subparsers.add_parser('populate', help="Add books from Open Library")
+    populate.set_defaults(handler=cmd_populate, verbose=True)
+    if _command(argv) == 'populate':
+        # Importing populate_books loads the client and database layers, so only do it for this subcommand
+        from populate_books import add_populate_arguments
+        add_populate_arguments(populate)
+    
+    refresh = subparsers.add_parser('refresh', help="Re-fetch stale works, rewriting only changed ones")
+    refresh.set_defaults(handler=cmd_refresh, verbose=True)
+    refresh.add_argument('count', type=int, help="Number of least recently fetched works")
+    refresh.add_argument('--stale-days', type=float, help="Only works not fetched for this many days")
+    refresh.add_argument('--metrics', help="Write run metrics here")
+    
+    stats = subparsers.add_parser('stats', help="Catalog statistics")
+    stats.set_defaults(handler=cmd_stats)
+    stats.add_argument('--recent', type=int, default=5, help="Recent additions to list")
+    
+    search = subparsers.add_parser('search', help="Full-text search over the local catalog")
+    search.set_defaults(handler=cmd_search)
+    search.add_argument('query')
+    search.add_argument('--limit', type=int, default=10)
+    search.add_argument('--page', type=int, default=1)
+    
+    recommend = subparsers.add_parser('recommend', help="Similar books from the recommendation index")
+    recommend.set_defaults(handler=cmd_recommend)
+    recommend.add_argument('book_id', type=int, nargs='?')
+    recommend.add_argument('--text', help="Recommend for free text instead of a book id")
+    recommend.add_argument('--build', action='store_true', help="(Re)build the index from the database")
+    recommend.add_argument('--index', help="Index directory (default: SIMILARITY_INDEX_PATH)")
+    recommend.add_argument('-k', type=int, default=10)
+    
+    export = subparsers.add_parser('export', help="Stream the catalog to Parquet or JSONL")
+    export.set_defaults(handler=cmd_export)
+    export.add_argument('path', help="Output file (.parquet, .jsonl or .jsonl.gz)")
+    export.add_argument('--format', choices=['parquet', 'jsonl'])
+    export.add_argument('--columns', help="Comma-separated columns (default: all)")
+    export.add_argument('--chunk-size', type=int, default=10000)
+    export.add_argument('--limit', type=int)
+    
+    covers = subparsers.add_parser('covers', help="Download missing covers into the local cover store")
+    covers.set_defaults(handler=cmd_covers, verbose=True)
+    covers.add_argument('--limit', type=int)
+    covers.add_argument('--batch-size', type=int, default=100)
+    
+    snapshot = subparsers.add_parser('snapshot', help="Build or query the memory-mapped catalog snapshot")
+    snapshot.set_defaults(handler=cmd_snapshot)
+    snapshot.add_argument('key', nargs='?', help="Book id, work key (OL123W or /works/OL123W) or ISBN")
+    snapshot.add_argument('--build', action='store_true', help="Build a new snapshot from the database")
+    snapshot.add_argument('--path', help="Snapshot directory (default: CATALOG_SNAPSHOT_PATH)")
+    
+    tags = subparsers.add_parser('tags', help="Extract keyword tags, or list them for a book or tag")
+    tags.set_defaults(handler=cmd_tags, verbose=True)
+    tags.add_argument('--book', type=int, help="List the tags of this book id")
+    tags.add_argument('--tag', help="List the books this tag describes best")
+    tags.add_argument('--limit', type=int, default=20)
+    tags.add_argument('--rebuild', action='store_true', help="Recount term frequencies and re-tag every book")
+    tags.add_argument('--workers', type=int, help="Worker processes (default: TAG_WORKERS or one per core)")
+    tags.add_argument('--chunk-size', type=int, default=5000)
+    
+    check = subparsers.add_parser('check', help="Test the database connection")
+    check.set_defaults(handler=cmd_check, verbose=True)
+    return parser
+
+def main(argv=None):
+    args = build_parser(argv).parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
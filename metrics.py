@@ -0,0 +1,204 @@
+"""
+Lightweight in-process metrics (counters and histograms) with Prometheus/JSON export
+"""
+
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+# Upper bounds in seconds; wide enough for both sub-millisecond statements and slow API calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+class Counter:
+    """Monotonically increasing value"""
+    
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect plus three additions under a lock"""
+    
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+    
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+    
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Estimate a quantile by interpolating linearly inside the bucket that contains it"""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return None
+        
+        rank = fraction * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """Named, labelled counters and histograms shared by the whole process"""
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.counters: Dict[Tuple[str, Tuple], Counter] = {}
+        self.histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self.help: Dict[str, str] = {}
+        self.lock = threading.Lock()
+    
+    def _get(self, store: Dict, factory, name: str, labels: Dict) -> object:
+        key = (name, tuple(sorted(labels.items())))
+        metric = store.get(key)
+        if metric is None:
+            with self.lock:
+                metric = store.setdefault(key, factory())
+        return metric
+    
+    def describe(self, name: str, text: str):
+        """Attach HELP text used in the Prometheus export"""
+        self.help[name] = text
+    
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        if self.enabled:
+            self._get(self.counters, Counter, name, labels).inc(amount)
+    
+    def observe(self, name: str, value: float, **labels):
+        if self.enabled:
+            self._get(self.histograms, Histogram, name, labels).observe(value)
+    
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the duration of the with-block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+    
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+    
+    def snapshot(self) -> Dict:
+        """JSON-friendly view with count, sum and estimated p50/p90/p99 for each histogram"""
+        counters = {}
+        for (name, labels), counter in sorted(self.counters.items()):
+            counters.setdefault(name, []).append({'labels': dict(labels), 'value': counter.value})
+        
+        histograms = {}
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            histograms.setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': round(histogram.sum, 6),
+                'p50': _round(histogram.quantile(0.5)),
+                'p90': _round(histogram.quantile(0.9)),
+                'p99': _round(histogram.quantile(0.99))
+            })
+        return {'counters': counters, 'histograms': histograms}
+    
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines: List[str] = []
+        
+        def header(name: str, kind: str):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        previous = None
+        for (name, labels), counter in sorted(self.counters.items()):
+            if name != previous:
+                header(name, 'counter')
+                previous = name
+            lines.append(f"{name}{_format_labels(labels)} {counter.value:g}")
+        
+        previous = None
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            if name != previous:
+                header(name, 'histogram')
+                previous = name
+            with histogram.lock:
+                counts = list(histogram.counts)
+                total, total_sum = histogram.count, histogram.sum
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total_sum:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {total}")
+        
+        return '\n'.join(lines) + '\n'
+    
+    def write(self, path: str):
+        """Write a Prometheus text file (.prom/.txt) or a JSON snapshot (anything else)"""
+        with open(path, 'w') as f:
+            if path.endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2)
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 6) if value is not None else None
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+# Process-wide registry used by the client and database layers
+metrics = MetricsRegistry(enabled=Config.METRICS_ENABLED)
+
+metrics.describe('openlibrary_request_seconds', "Open Library HTTP request latency by endpoint")
+metrics.describe('openlibrary_requests_total', "Open Library HTTP requests by endpoint and status")
+metrics.describe('openlibrary_response_bytes_total', "Response body bytes received by endpoint")
+metrics.describe('openlibrary_retries_total', "Requests retried after a failure, by endpoint and reason")
+metrics.describe('openlibrary_window_decreases_total', "Adaptive request window cuts by signal (throttled, error, latency)")
+metrics.describe('openlibrary_circuit_transitions_total', "Circuit breaker state changes by new state")
+metrics.describe('openlibrary_rate_limit_wait_seconds', "Time spent waiting on the shared rate limiter")
+metrics.describe('openlibrary_cache_total', "Response cache lookups by result (hit, revalidated, miss)")
+metrics.describe('openlibrary_json_decode_seconds', "Time spent decoding JSON responses")
+metrics.describe('format_book_seconds', "Time spent in format_book_data")
+metrics.describe('covers_download_seconds', "Cover image download latency")
+metrics.describe('covers_requests_total', "Cover image requests by status")
+metrics.describe('covers_bytes_total', "Cover image bytes downloaded")
+metrics.describe('covers_rate_limit_wait_seconds', "Time spent waiting on the cover rate limiter")
+metrics.describe('covers_deduplicated_total', "Downloaded covers whose content was already stored")
+metrics.describe('covers_evicted_total', "Cover images evicted from the local store")
+metrics.describe('book_cache_total', "Book lookups by result (hits, misses, coalesced, queries, invalidated)")
+metrics.describe('db_pool_checkout_seconds', "Time spent waiting for a pooled database connection")
+metrics.describe('db_statement_seconds', "Database statement execution time by operation")
+metrics.describe('db_errors_total', "Database statements that raised an error")
+metrics.describe('db_commit_seconds', "Session commit time, including the final flush")
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Idempotent schema migrations for databases created by earlier versions
+"""
+
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from catalog_search import ensure_search_index
+from dedup import CONTENT_FIELDS, book_fingerprint, content_hash
+from subjects import sync_book_subjects
+
+logger = logging.getLogger(__name__)
+
+def _column_names(engine: Engine, table: str) -> set:
+    return {column['name'] for column in inspect(engine).get_columns(table)}
+
+def _index_names(engine: Engine, table: str) -> set:
+    return {index['name'] for index in inspect(engine).get_indexes(table)}
+
+def add_fingerprint_column(engine: Engine, batch_size: int = 5000):
+    """Add books.fingerprint, back-fill it and create its unique index"""
+    if 'fingerprint' not in _column_names(engine, 'books'):
+        logger.info("Adding books.fingerprint column")
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE books ADD COLUMN fingerprint VARCHAR(40)"))
+    
+    if 'ix_books_fingerprint' in _index_names(engine, 'books'):
+        return
+    
+    # Back-fill in id order so the oldest copy of a duplicate keeps the fingerprint
+    seen = set()
+    last_id = 0
+    filled = 0
+    update = text("UPDATE books SET fingerprint = :fingerprint WHERE id = :book_id")
+    
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text("SELECT id, title, author FROM books WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {'last_id': last_id, 'limit': batch_size}
+            ).all()
+            if not rows:
+                break
+            
+            params = []
+            for row in rows:
+                fingerprint = book_fingerprint(row.title, row.author)
+                if fingerprint in seen:
+                    logger.warning(f"Leaving duplicate book {row.id} ({row.title}) without a fingerprint")
+                    continue
+                seen.add(fingerprint)
+                params.append({'book_id': row.id, 'fingerprint': fingerprint})
+            
+            if params:
+                conn.execute(update, params)
+            filled += len(params)
+            last_id = rows[-1].id
+    
+    logger.info(f"Back-filled {filled} fingerprints, creating unique index")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE UNIQUE INDEX ix_books_fingerprint ON books (fingerprint)"))
+
+def backfill_book_subjects(engine: Engine, batch_size: int = 5000):
+    """Populate subjects/book_subjects from the legacy comma-separated Book.subjects column"""
+    from sqlalchemy.orm import Session
+    
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT 1 FROM book_subjects LIMIT 1")).first():
+            return
+        if not conn.execute(text("SELECT 1 FROM books WHERE subjects IS NOT NULL LIMIT 1")).first():
+            return
+    
+    logger.info("Back-filling book_subjects from books.subjects")
+    last_id = 0
+    total = 0
+    while True:
+        with Session(engine) as session:
+            rows = session.execute(
+                text("SELECT id, subjects FROM books WHERE id > :last_id AND subjects IS NOT NULL "
+                     "ORDER BY id LIMIT :limit"),
+                {'last_id': last_id, 'limit': batch_size}
+            ).all()
+            if not rows:
+                break
+            
+            sync_book_subjects(session, {row.id: row.subjects for row in rows}, replace=False)
+            session.commit()
+            total += len(rows)
+            last_id = rows[-1].id
+    
+    logger.info(f"Back-filled subjects for {total} books")
+
+def add_refresh_columns(engine: Engine, batch_size: int = 5000):
+    """Add last_fetched_at/content_hash, back-fill content hashes and make the timestamps real DATETIMEs"""
+    columns = {column['name']: column for column in inspect(engine).get_columns('books')}
+    
+    with engine.begin() as conn:
+        if 'last_fetched_at' not in columns:
+            logger.info("Adding books.last_fetched_at column")
+            conn.execute(text("ALTER TABLE books ADD COLUMN last_fetched_at DATETIME"))
+        if 'content_hash' not in columns:
+            logger.info("Adding books.content_hash column")
+            conn.execute(text("ALTER TABLE books ADD COLUMN content_hash VARCHAR(40)"))
+        
+        # Older versions stored str(datetime) in VARCHARs; MySQL converts those values in place.
+        # SQLite stores DateTime as the same ISO text, so existing values already read back correctly.
+        if engine.dialect.name == 'mysql' and 'CHAR' in str(columns['created_at']['type']).upper():
+            logger.info("Converting books.created_at/updated_at to DATETIME")
+            conn.execute(text("ALTER TABLE books MODIFY created_at DATETIME NULL, MODIFY updated_at DATETIME NULL"))
+    
+    if 'ix_books_last_fetched_at' not in _index_names(engine, 'books'):
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX ix_books_last_fetched_at ON books (last_fetched_at)"))
+    
+    last_id = 0
+    filled = 0
+    update = text("UPDATE books SET content_hash = :content_hash WHERE id = :book_id")
+    select_missing = text(
+        f"SELECT id, {', '.join(CONTENT_FIELDS)} FROM books "
+        f"WHERE id > :last_id AND content_hash IS NULL ORDER BY id LIMIT :limit"
+    )
+    
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(select_missing, {'last_id': last_id, 'limit': batch_size}).mappings().all()
+            if not rows:
+                break
+            conn.execute(update, [{'book_id': row['id'], 'content_hash': content_hash(row)} for row in rows])
+            filled += len(rows)
+            last_id = rows[-1]['id']
+    
+    if filled:
+        logger.info(f"Back-filled {filled} content hashes")
+
+def add_cover_columns(engine: Engine):
+    """Add the local cover image paths written by covers.py"""
+    columns = _column_names(engine, 'books')
+    with engine.begin() as conn:
+        for name in ('cover_path', 'cover_thumbnail_path'):
+            if name not in columns:
+                logger.info(f"Adding books.{name} column")
+                conn.execute(text(f"ALTER TABLE books ADD COLUMN {name} VARCHAR(300)"))
+
+def add_tags_column(engine: Engine):
+    """Add books.tags_hash; book_tags itself is created by create_all"""
+    if 'tags_hash' not in _column_names(engine, 'books'):
+        logger.info("Adding books.tags_hash column")
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE books ADD COLUMN tags_hash VARCHAR(40)"))
+
+def run_migrations(engine: Engine) -> bool:
+    """Bring an existing database up to the current schema"""
+    try:
+        add_fingerprint_column(engine)
+        backfill_book_subjects(engine)
+        add_refresh_columns(engine)
+        add_cover_columns(engine)
+        add_tags_column(engine)
+        ensure_search_index(engine)
+        return True
+    except Exception as e:
+        logger.error(f"Migration failed: {e}")
+        return False
+
+if __name__ == "__main__":
+    from database import db_manager
+    
+    logging.basicConfig(level=logging.INFO)
+    if not db_manager.connect() or not run_migrations(db_manager.engine):
+        raise SystemExit(1)
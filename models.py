@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Date, Float, create_engine
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Float, ForeignKey, Index, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
@@ -16,6 +16,9 @@ class Book(Base):
     isbn = Column(String(20), nullable=True)
     isbn13 = Column(String(20), nullable=True)
     
+    # Normalized title/author hash used for duplicate detection (see dedup.py)
+    fingerprint = Column(String(40), nullable=True, unique=True, index=True)
+    
     # Publication details
     first_publish_year = Column(Integer, nullable=True)
     publisher = Column(String(300), nullable=True)
@@ -37,10 +40,19 @@ class Book(Base):
     # Additional metadata
     language = Column(String(10), nullable=True, default='en')
     cover_image_url = Column(Text, nullable=True)
+    cover_path = Column(String(300), nullable=True)  # Relative to COVER_CACHE_DIR, '' if there is no cover
+    cover_thumbnail_path = Column(String(300), nullable=True)
+    
+    # Timestamps (updated_at only moves when the content changes, last_fetched_at on every fetch)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    last_fetched_at = Column(DateTime, nullable=True, index=True)
     
-    # Timestamps
-    created_at = Column(String(50), default=str(datetime.now()))
-    updated_at = Column(String(50), default=str(datetime.now()))
+    # Hash of the formatted payload, used to skip rewriting unchanged works (see dedup.content_hash)
+    content_hash = Column(String(40), nullable=True)
+    
+    # content_hash the book's keyword tags were computed from (see tags.py)
+    tags_hash = Column(String(40), nullable=True)
     
     def __repr__(self):
         return f"<Book(id={self.id}, title='{self.title}', author='{self.author}')>"
@@ -65,6 +77,39 @@ class Book(Base):
             'rating_count': self.rating_count,
             'language': self.language,
             'cover_image_url': self.cover_image_url,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at
-        } 
\ No newline at end of file
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'last_fetched_at': self.last_fetched_at.isoformat() if self.last_fetched_at else None
+        } 
+
+class Subject(Base):
+    __tablename__ = 'subjects'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True, index=True)  # Trimmed and lowercased
+    
+    def __repr__(self):
+        return f"<Subject(id={self.id}, name='{self.name}')>"
+
+class BookSubject(Base):
+    __tablename__ = 'book_subjects'
+    
+    # The primary key serves book -> subjects lookups, the index serves subject -> books
+    book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    subject_id = Column(Integer, ForeignKey('subjects.id', ondelete='CASCADE'), primary_key=True)
+    
+    __table_args__ = (
+        Index('ix_book_subjects_subject_book', 'subject_id', 'book_id'),
+    )
+
+class BookTag(Base):
+    __tablename__ = 'book_tags'
+    
+    # Keyword tags scored by TF-IDF over descriptions and subjects; the index serves tag -> best books
+    book_id = Column(Integer, ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    tag = Column(String(100), primary_key=True)
+    weight = Column(Float, nullable=False)
+    
+    __table_args__ = (
+        Index('ix_book_tags_tag_weight', 'tag', 'weight'),
+    )
@@ -1,54 +1,352 @@
 import requests
+import threading
 import time
 import json
 import logging
-from typing import List, Dict, Optional
-from config import Config
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from config import get_config
+from http_cache import ResponseCache
+from metrics import metrics
+from throttle import RETRYABLE_STATUSES, AdaptiveController, parse_retry_after
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Genres used to build a diverse collection
+DEFAULT_SUBJECTS = [
+    "fiction", "science fiction", "mystery", "romance", "fantasy",
+    "biography", "history", "science", "philosophy", "psychology",
+    "business", "self-help", "cooking", "travel", "poetry"
+]
+
+# Only the fields format_book_data uses, to keep search responses small
+SEARCH_FIELDS = (
+    'key,title,author_name,first_publish_year,isbn,subject,cover_i,publisher,number_of_pages_median,'
+    'cover_edition_key'
+)
+
+# Formatted fields that an edition from the Books API can fill in when search left them empty
+EDITION_FIELDS = ('isbn', 'isbn13', 'publisher', 'number_of_pages', 'edition_key', 'cover_image_url', 'subjects')
+
+class TokenBucket:
+    """Thread-safe token bucket used to share one request budget across workers"""
+    
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self) -> float:
+        """Block until a token is available and return the time spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                
+                delay = (1 - self.tokens) / self.rate
+            
+            time.sleep(delay)
+            waited += delay
+    
+    def set_rate(self, rate: float):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.rate = rate
+
 class OpenLibraryClient:
-    def __init__(self):
-        self.config = Config()
+    def __init__(self, max_workers: Optional[int] = None, rate_limiter: Optional[TokenBucket] = None,
+                 cache: Optional[ResponseCache] = None, controller: Optional[AdaptiveController] = None):
+        self.config = get_config()
+        self.max_workers = max_workers or self.config.MAX_CONCURRENT_REQUESTS
+        self.rate_limiter = rate_limiter or TokenBucket(self.config.REQUESTS_PER_SECOND)
+        
+        # Adapts requests in flight and the request rate to throttling, errors and latency
+        self.controller = controller or AdaptiveController(
+            self.max_workers,
+            self.rate_limiter,
+            max_attempts=self.config.MAX_REQUEST_ATTEMPTS,
+            base_delay=self.config.RETRY_BASE_DELAY,
+            max_delay=self.config.RETRY_MAX_DELAY,
+            retry_ratio=self.config.RETRY_BUDGET_RATIO,
+            failure_threshold=self.config.CIRCUIT_FAILURE_THRESHOLD,
+            open_seconds=self.config.CIRCUIT_OPEN_SECONDS,
+            max_wait=self.config.CIRCUIT_MAX_WAIT
+        )
+        
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'LitWise-Books/1.0 (https://github.com/yourusername/litwise-books)'
         })
+        
+        # Keep pooled connections for every worker (plus callers outside the pool) so sockets are reused
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers * 2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # Optional persistent response cache (opt-in via HTTP_CACHE_PATH)
+        self.cache = cache
+        if self.cache is None and self.config.HTTP_CACHE_PATH:
+            self.cache = ResponseCache(
+                self.config.HTTP_CACHE_PATH,
+                ttls=self.config.HTTP_CACHE_TTLS,
+                max_bytes=self.config.HTTP_CACHE_MAX_MB * 1024 * 1024
+            )
+    
+    def _get_json(self, url: str, params: Optional[Dict] = None, endpoint: str = 'default') -> Dict:
+        """GET a JSON document, going through the response cache and adaptive controller"""
+        cache_key = None
+        cached = None
+        headers = {}
+        
+        if self.cache:
+            cache_key = self.cache.make_key(url, params)
+            cached = self.cache.get(cache_key)
+            if cached and cached['fresh']:
+                metrics.inc('openlibrary_cache_total', endpoint=endpoint, result='hit')
+                return self._decode(cached['body'], endpoint)
+            
+            # Revalidate stale entries so unchanged documents come back as cheap 304s
+            if cached:
+                if cached['etag']:
+                    headers['If-None-Match'] = cached['etag']
+                if cached['last_modified']:
+                    headers['If-Modified-Since'] = cached['last_modified']
+        
+        response = self._send(url, params, headers, endpoint)
+        metrics.inc('openlibrary_response_bytes_total', len(response.content), endpoint=endpoint)
+        
+        if response.status_code == 304 and cached:
+            metrics.inc('openlibrary_cache_total', endpoint=endpoint, result='revalidated')
+            self.cache.refresh(cache_key, endpoint)
+            return self._decode(cached['body'], endpoint)
+        
+        response.raise_for_status()
+        data = self._decode(response.text, endpoint)  # Before caching, so a bad body is never stored
+        
+        if self.cache:
+            metrics.inc('openlibrary_cache_total', endpoint=endpoint, result='miss')
+            self.cache.put(
+                cache_key, endpoint, response.text,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+        
+        return data
     
-    def search_books(self, query: str, limit: int = 50) -> List[Dict]:
+    def _send(self, url: str, params: Optional[Dict], headers: Dict, endpoint: str) -> requests.Response:
+        """Send a GET through the adaptive controller, retrying throttled and failed attempts with backoff
+        
+        Raises the last error once attempts or the retry budget run out, or CircuitOpenError
+        after a sustained outage.
+        """
+        attempt = 0
+        while True:
+            waited = self.controller.acquire() + self.rate_limiter.acquire()
+            metrics.observe('openlibrary_rate_limit_wait_seconds', waited, endpoint=endpoint)
+            
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.config.REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                latency = time.perf_counter() - started
+                metrics.observe('openlibrary_request_seconds', latency, endpoint=endpoint)
+                self.controller.release(False, latency, endpoint)
+                metrics.inc('openlibrary_requests_total', endpoint=endpoint, status='error')
+                error, reason = e, 'error'
+            else:
+                latency = time.perf_counter() - started
+                metrics.observe('openlibrary_request_seconds', latency, endpoint=endpoint)
+                metrics.inc('openlibrary_requests_total', endpoint=endpoint, status=str(response.status_code))
+                if response.status_code not in RETRYABLE_STATUSES:
+                    self.controller.release(True, latency, endpoint)
+                    return response
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                throttled = response.status_code == 429 or retry_after is not None
+                self.controller.release(False, latency, endpoint, retry_after, throttled)
+                error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+                reason = str(response.status_code)
+            
+            attempt += 1
+            delay = self.controller.retry_delay(attempt, retry_after)
+            if delay is None:
+                raise error
+            metrics.inc('openlibrary_retries_total', endpoint=endpoint, reason=reason)
+            logger.debug(f"Retrying {endpoint} request in {delay:.2f}s after {reason} (attempt {attempt})")
+            time.sleep(delay)
+    
+    def _decode(self, body: str, endpoint: str) -> Dict:
+        """Parse a JSON body; a non-JSON one (e.g. an HTML maintenance page) raises a RequestException"""
+        with metrics.timer('openlibrary_json_decode_seconds', endpoint=endpoint):
+            try:
+                return json.loads(body)
+            except ValueError as e:
+                raise requests.exceptions.InvalidJSONError(f"Invalid JSON from {endpoint}: {e}") from e
+    
+    def map_concurrently(self, func: Callable, items: Iterable) -> List:
+        """Apply func to every item using the worker pool, preserving input order"""
+        items = list(items)
+        if len(items) <= 1 or self.max_workers <= 1:
+            return [func(item) for item in items]
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            return list(executor.map(func, items))
+    
+    def search_books(self, query: str, limit: int = 50, page: int = 1) -> List[Dict]:
         """Search for books using Open Library search API"""
         params = {
             'q': query,
             'limit': limit,
-            'fields': 'key,title,author_name,first_publish_year,isbn,subject,cover_i,publisher,number_of_pages_median'
+            'fields': SEARCH_FIELDS
         }
+        if page > 1:
+            params['page'] = page
         
         try:
-            logger.info(f"Searching for books with query: {query}")
-            response = self.session.get(
-                self.config.OPENLIBRARY_SEARCH_URL,
-                params=params,
-                timeout=self.config.REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-            
-            data = response.json()
+            logger.info(f"Searching for books with query: {query} (page {page})")
+            data = self._get_json(self.config.OPENLIBRARY_SEARCH_URL, params, endpoint='search')
             books = data.get('docs', [])
             logger.info(f"Found {len(books)} books")
             
-            # Add delay to be respectful to the API
-            time.sleep(self.config.REQUEST_DELAY)
-            
             return books
             
         except requests.RequestException as e:
             logger.error(f"Error searching books: {e}")
             return []
     
+    def search_page(self, query: str, limit: int = 100, offset: int = 0) -> Optional[Dict]:
+        """One slice of search results plus the total hit count, or None if the request failed"""
+        params = {'q': query, 'limit': limit, 'offset': offset, 'fields': SEARCH_FIELDS}
+        
+        try:
+            data = self._get_json(self.config.OPENLIBRARY_SEARCH_URL, params, endpoint='search')
+        except requests.RequestException as e:
+            logger.error(f"Error searching books for {query} at offset {offset}: {e}")
+            return None
+        
+        return {
+            'docs': data.get('docs', []),
+            'num_found': data.get('numFound', data.get('num_found', 0)),
+            'offset': offset
+        }
+    
+    def search_by_keys(self, work_keys: List[str]) -> Optional[Dict[str, Dict]]:
+        """Search docs for specific works in one request, keyed by work key; None if the request failed"""
+        keys = [key if key.startswith('/works/') else f"/works/{key}" for key in work_keys]
+        if not keys:
+            return {}
+        
+        page = self.search_page('key:(' + ' OR '.join(f'"{key}"' for key in keys) + ')', limit=len(keys))
+        if page is None:
+            return None
+        return {doc['key']: doc for doc in page['docs'] if doc.get('key')}
+    
+    def harvest_subjects(self, subjects: List[str], target_count: int, page_size: Optional[int] = None,
+                         max_attempts: int = 3) -> List[Dict]:
+        """Collect up to target_count distinct works, paging through subjects concurrently
+        
+        Subjects are visited round-robin so the result stays diverse. A subject gets one
+        request in flight until its numFound is known, so small subjects are never over-fetched,
+        and request sizes shrink as the target gets close.
+        """
+        page_size = page_size or self.config.SEARCH_PAGE_SIZE
+        # Spread small targets across subjects instead of filling them from the first one
+        share = max(1, -(-target_count // max(1, len(subjects))))
+        order = deque(subjects)
+        next_offset = {subject: 0 for subject in subjects}
+        num_found: Dict[str, int] = {}
+        attempts: Dict[tuple, int] = {}
+        retries = deque()
+        in_flight = {}
+        seen = set()
+        collected: List[Dict] = []
+        per_subject = {subject: 0 for subject in subjects}
+        request_count = 0
+        
+        def next_request(budget: int) -> Optional[tuple]:
+            if retries:
+                return retries.popleft()
+            busy = {subject for subject, _, _ in in_flight.values()}
+            for _ in range(len(order)):
+                subject = order[0]
+                order.rotate(-1)
+                if subject not in num_found and subject in busy:
+                    continue
+                offset = next_offset[subject]
+                limit = min(page_size, budget, share, num_found.get(subject, offset + page_size) - offset)
+                if limit <= 0:
+                    continue
+                next_offset[subject] = offset + limit
+                return subject, offset, limit
+            return None
+        
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while len(collected) < target_count:
+                while len(in_flight) < self.max_workers:
+                    budget = target_count - len(collected) - sum(limit for _, _, limit in in_flight.values())
+                    request = next_request(budget) if budget > 0 else None
+                    if not request:
+                        break
+                    subject, offset, limit = request
+                    future = executor.submit(self.search_page, f"subject:{subject}", limit, offset)
+                    in_flight[future] = request
+                    request_count += 1
+                
+                if not in_flight:
+                    break
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    subject, offset, limit = request = in_flight.pop(future)
+                    page = future.result()
+                    if page is None:
+                        attempts[request] = attempts.get(request, 0) + 1
+                        if attempts[request] < max_attempts:
+                            retries.append(request)
+                        else:
+                            # Stop paging a subject at a page that keeps failing
+                            num_found[subject] = offset
+                        continue
+                    
+                    # A short page also marks the end, in case numFound overstates what can be paged
+                    docs = page['docs']
+                    num_found[subject] = page['num_found'] if len(docs) >= limit else offset + len(docs)
+                    
+                    for doc in docs:
+                        key = doc.get('key')
+                        if not key or key in seen or len(collected) >= target_count:
+                            continue
+                        seen.add(key)
+                        collected.append(doc)
+                        per_subject[subject] += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        logger.info(
+            f"Harvested {len(collected)} distinct works from {len(subjects)} subjects "
+            f"in {request_count} search requests: {per_subject}"
+        )
+        return collected
+    
     def get_work_details(self, work_key: str) -> Optional[Dict]:
-        """Get detailed information about a book work"""
+        """Get detailed information about a book work
+        
+        Returns {} for a work Open Library does not have and None if the lookup failed, so
+        callers can hold a book back instead of writing it without its description.
+        """
         if not work_key.startswith('/works/'):
             work_key = f"/works/{work_key}"
         
@@ -56,18 +354,24 @@ class OpenLibraryClient:
         
         try:
             logger.info(f"Fetching work details for: {work_key}")
-            response = self.session.get(url, timeout=self.config.REQUEST_TIMEOUT)
-            response.raise_for_status()
-            
-            # Add delay to be respectful to the API
-            time.sleep(self.config.REQUEST_DELAY)
-            
-            return response.json()
+            return self._get_json(url, endpoint='works')
             
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                logger.warning(f"No work details for {work_key}")
+                return {}
+            logger.error(f"Error fetching work details for {work_key}: {e}")
+            return None
         except requests.RequestException as e:
             logger.error(f"Error fetching work details for {work_key}: {e}")
             return None
     
+    def get_work_details_many(self, work_keys: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        """Fetch details for several works concurrently, keyed by the given work key"""
+        work_keys = list(dict.fromkeys(work_keys))
+        results = self.map_concurrently(self.get_work_details, work_keys)
+        return dict(zip(work_keys, results))
+    
     def get_edition_details(self, edition_key: str) -> Optional[Dict]:
         """Get detailed information about a book edition"""
         if not edition_key.startswith('/books/'):
@@ -77,47 +381,68 @@ class OpenLibraryClient:
         
         try:
             logger.info(f"Fetching edition details for: {edition_key}")
-            response = self.session.get(url, timeout=self.config.REQUEST_TIMEOUT)
-            response.raise_for_status()
-            
-            # Add delay to be respectful to the API
-            time.sleep(self.config.REQUEST_DELAY)
-            
-            return response.json()
+            return self._get_json(url, endpoint='editions')
             
         except requests.RequestException as e:
             logger.error(f"Error fetching edition details for {edition_key}: {e}")
             return None
     
-    def search_popular_books(self, subject: str = "fiction", limit: int = 50) -> List[Dict]:
+    def get_books_by_bibkeys(self, bibkeys: List[str]) -> Optional[Dict[str, Dict]]:
+        """Look up many editions (ISBN:..., OLID:...) in one Books API request; None if it failed"""
+        if not bibkeys:
+            return {}
+        
+        params = {'bibkeys': ','.join(bibkeys), 'jscmd': 'data', 'format': 'json'}
+        try:
+            logger.info(f"Fetching {len(bibkeys)} editions from the Books API")
+            return self._get_json(self.config.OPENLIBRARY_BOOKS_API_URL, params, endpoint='books')
+        except requests.RequestException as e:
+            logger.error(f"Error fetching editions for {len(bibkeys)} bibkeys: {e}")
+            return None
+    
+    def enrich_with_editions(self, books: List[Dict]) -> List[Dict]:
+        """Fill missing edition fields of formatted books with batched Books API lookups
+        
+        Returns the books whose lookup failed, so callers that must not lose data can skip them.
+        """
+        wanted = {}
+        for book in books:
+            if any(book.get(field) is None for field in ('isbn13', 'publisher', 'number_of_pages')):
+                bibkey = edition_bibkey(book)
+                if bibkey:
+                    wanted.setdefault(bibkey, []).append(book)
+        if not wanted:
+            return []
+        
+        bibkeys = list(wanted)
+        size = self.config.BIBKEYS_PER_REQUEST
+        chunks = [bibkeys[start:start + size] for start in range(0, len(bibkeys), size)]
+        
+        failed = []
+        filled = 0
+        for chunk, editions in zip(chunks, self.map_concurrently(self.get_books_by_bibkeys, chunks)):
+            for bibkey in chunk:
+                if editions is None:
+                    failed.extend(wanted[bibkey])
+                elif bibkey in editions:
+                    for book in wanted[bibkey]:
+                        filled += merge_edition_data(book, editions[bibkey])
+        
+        logger.info(f"Filled {filled} edition fields for {len(wanted)} books in {len(chunks)} Books API requests")
+        return failed
+    
+    def search_popular_books(self, subject: str = "fiction", limit: int = 50, page: int = 1) -> List[Dict]:
         """Search for popular books by subject"""
-        return self.search_books(f"subject:{subject}", limit)
+        return self.search_books(f"subject:{subject}", limit, page)
     
     def get_diverse_book_collection(self, limit: int = 50) -> List[Dict]:
-        """Get a diverse collection of books from different genres"""
-        subjects = [
-            "fiction", "science fiction", "mystery", "romance", "fantasy",
-            "biography", "history", "science", "philosophy", "psychology",
-            "business", "self-help", "cooking", "travel", "poetry"
-        ]
-        
-        books_per_subject = max(1, limit // len(subjects))
-        all_books = []
-        
-        for subject in subjects:
-            if len(all_books) >= limit:
-                break
-                
-            books = self.search_popular_books(subject, books_per_subject)
-            all_books.extend(books)
-            
-            logger.info(f"Collected {len(books)} books from {subject} category")
-        
-        # Return only the requested number of books
-        return all_books[:limit]
+        """Get a diverse collection of distinct books from different genres"""
+        return self.harvest_subjects(DEFAULT_SUBJECTS, limit)
     
     def format_book_data(self, book_data: Dict, work_details: Optional[Dict] = None) -> Dict:
         """Format book data into a standardized structure"""
+        started = time.perf_counter()
+        
         # Extract basic information
         title = book_data.get('title', 'Unknown Title')
         authors = book_data.get('author_name', [])
@@ -142,7 +467,7 @@ class OpenLibraryClient:
         
         # Get cover image
         cover_id = book_data.get('cover_i')
-        cover_image_url = f"https://covers.openlibrary.org/b/id/{cover_id}-L.jpg" if cover_id else None
+        cover_image_url = f"{self.config.OPENLIBRARY_COVERS_URL}/b/id/{cover_id}-L.jpg" if cover_id else None
         
         # Get publisher
         publishers = book_data.get('publisher', [])
@@ -153,6 +478,7 @@ class OpenLibraryClient:
         
         # Get work key for future reference
         work_key = book_data.get('key')
+        edition_key = book_data.get('cover_edition_key')
         
         # Extract description from work details if available
         description = None
@@ -163,7 +489,7 @@ class OpenLibraryClient:
             elif isinstance(desc, str):
                 description = desc
         
-        return {
+        formatted = {
             'title': title,
             'author': author,
             'isbn': isbn,
@@ -173,8 +499,42 @@ class OpenLibraryClient:
             'number_of_pages': number_of_pages,
             'openlibrary_key': work_key,
             'work_key': work_key,
+            'edition_key': f"/books/{edition_key}" if edition_key else None,
             'description': description,
             'subjects': subjects_str,
             'cover_image_url': cover_image_url,
             'language': 'en'  # Default to English
-        } 
\ No newline at end of file
+        }
+        metrics.observe('format_book_seconds', time.perf_counter() - started)
+        return formatted
+
+def edition_bibkey(book: Dict) -> Optional[str]:
+    """Books API key for a formatted book, preferring ISBNs over the edition OLID"""
+    isbn = book.get('isbn13') or book.get('isbn')
+    if isbn:
+        return f"ISBN:{isbn}"
+    if book.get('edition_key'):
+        return f"OLID:{book['edition_key'].rsplit('/', 1)[-1]}"
+    return None
+
+def merge_edition_data(book: Dict, edition: Dict) -> int:
+    """Fill empty fields of a formatted book from a jscmd=data edition; returns how many were filled"""
+    identifiers = edition.get('identifiers', {})
+    publishers = [publisher.get('name') for publisher in edition.get('publishers', []) if publisher.get('name')]
+    subjects = [subject.get('name') for subject in edition.get('subjects', []) if subject.get('name')]
+    candidates = {
+        'isbn': (identifiers.get('isbn_10') or identifiers.get('isbn_13') or [None])[0],
+        'isbn13': (identifiers.get('isbn_13') or [None])[0],
+        'publisher': publishers[0] if publishers else None,
+        'number_of_pages': edition.get('number_of_pages'),
+        'edition_key': edition.get('key'),
+        'cover_image_url': edition.get('cover', {}).get('large'),
+        'subjects': ', '.join(subjects[:10]) if subjects else None
+    }
+    
+    filled = 0
+    for field in EDITION_FIELDS:
+        if book.get(field) is None and candidates[field] is not None:
+            book[field] = candidates[field]
+            filled += 1
+    return filled
@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from bulk_writer import BulkBookWriter
+from database import db_manager
+from dedup import FingerprintIndex
+from openlibrary_client import DEFAULT_SUBJECTS, OpenLibraryClient
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output
+_DONE = object()
+
+class IngestCheckpoint:
+    """Resumable record of harvested subject pages and written work keys
+    
+    The page state is a small JSON file rewritten after every batch; written work keys are
+    appended to a key log next to it (path + '.keys'), so each save costs only its new keys.
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.keys_path = f"{path}.keys" if path else None
+        self.lock = threading.Lock()
+        self.next_pages: Dict[str, int] = {}
+        self.exhausted = set()
+        self.done_keys = set()
+        self.unsaved_keys: List[str] = []
+        self.outstanding = defaultdict(int)  # (subject, page) -> docs not yet written
+        
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.next_pages = data.get('next_pages', {})
+            self.exhausted = set(data.get('exhausted', []))
+            # Checkpoints from before the key log kept their keys inline; move them into the log
+            self.unsaved_keys = data.get('done_keys', [])
+            self.done_keys = set(self.unsaved_keys)
+            if os.path.exists(self.keys_path):
+                with open(self.keys_path) as f:
+                    self.done_keys.update(line.strip() for line in f if line.strip())
+            logger.info(f"Resuming from checkpoint {path}: {len(self.done_keys)} works already handled")
+    
+    def next_page(self, subject: str) -> int:
+        with self.lock:
+            return self.next_pages.get(subject, 1)
+    
+    def page_harvested(self, subject: str, page: int, doc_count: int, exhausted: bool = False):
+        """Record a fetched page; it only counts as done once all its docs are written"""
+        with self.lock:
+            self.next_pages[subject] = page + 1
+            if doc_count:
+                self.outstanding[(subject, page)] += doc_count
+            if exhausted:
+                self.exhausted.add(subject)
+    
+    def active_subjects(self, subjects: List[str]) -> List[str]:
+        with self.lock:
+            return [subject for subject in subjects if subject not in self.exhausted]
+    
+    def docs_finished(self, docs: List[Dict]):
+        """Mark docs as written (or deliberately skipped)"""
+        with self.lock:
+            for doc in docs:
+                meta = doc['_meta']
+                key = doc.get('key')
+                if key and key not in self.done_keys:
+                    self.done_keys.add(key)
+                    self.unsaved_keys.append(key)
+                self.outstanding[meta] -= 1
+                if self.outstanding[meta] <= 0:
+                    del self.outstanding[meta]
+    
+    def is_done(self, key: str) -> bool:
+        with self.lock:
+            return key in self.done_keys
+    
+    def save(self):
+        """Append new keys to the key log, then atomically rewrite the page state
+        
+        Subjects are rewound to their oldest unfinished page. Keys are logged first, so a
+        crash in between only means re-harvesting pages whose docs are then skipped.
+        """
+        if not self.path:
+            return
+        
+        with self.lock:
+            next_pages = dict(self.next_pages)
+            for subject, page in self.outstanding:
+                next_pages[subject] = min(next_pages.get(subject, page), page)
+            data = {
+                'next_pages': next_pages,
+                'exhausted': sorted(self.exhausted - {subject for subject, _ in self.outstanding})
+            }
+            new_keys, self.unsaved_keys = self.unsaved_keys, []
+        
+        if new_keys:
+            with open(self.keys_path, 'a') as f:
+                f.write(''.join(f"{key}\n" for key in new_keys))
+        
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+class StageStats:
+    """Throughput counters for one pipeline stage"""
+    
+    def __init__(self, name: str, output: Optional[queue.Queue] = None):
+        self.name = name
+        self.output = output
+        self.processed = 0
+        self.started_at = time.monotonic()
+    
+    def snapshot(self) -> Dict:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            'processed': self.processed,
+            'per_second': round(self.processed / elapsed, 2),
+            'queue_depth': self.output.qsize() if self.output else 0
+        }
+
+class IngestPipeline:
+    """Streaming search -> enrich -> format -> write ingest connected by bounded queues"""
+    
+    def __init__(self, client: Optional[OpenLibraryClient] = None, checkpoint_path: Optional[str] = None,
+                 subjects: Optional[List[str]] = None, page_size: int = 100, queue_size: int = 1000,
+                 batch_size: Optional[int] = None, preload_fingerprints: bool = True, max_attempts: int = 3):
+        self.client = client or OpenLibraryClient()
+        self.checkpoint = IngestCheckpoint(checkpoint_path)
+        self.subjects = subjects or DEFAULT_SUBJECTS
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.preload_fingerprints = preload_fingerprints
+        self.max_attempts = max_attempts  # Per search page or work lookup, on top of the client's own retries
+        
+        self.search_queue = queue.Queue(maxsize=queue_size)
+        self.enrich_queue = queue.Queue(maxsize=queue_size)
+        self.format_queue = queue.Queue(maxsize=queue_size)
+        self.stats = {
+            'search': StageStats('search', self.search_queue),
+            'enrich': StageStats('enrich', self.enrich_queue),
+            'format': StageStats('format', self.format_queue),
+            'write': StageStats('write')
+        }
+        
+        self.stop_event = threading.Event()
+        self.errors: List[str] = []
+        self.deferred = {'enrich': 0, 'format': 0}  # Docs held back after failed lookups
+        self.target_count = 0
+        self.totals = {}
+        self.written_ids: List[int] = []
+    
+    def _put(self, output: queue.Queue, item) -> bool:
+        """Put with back-pressure, giving up if the pipeline is stopping"""
+        while not self.stop_event.is_set():
+            try:
+                output.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _get(self, source: queue.Queue):
+        """Get the next item, returning _DONE if the pipeline is stopping"""
+        while not self.stop_event.is_set():
+            try:
+                return source.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+    
+    def _search_stage(self):
+        """Harvest subject pages round-robin so every genre is represented early"""
+        seen = set()
+        failures = defaultdict(int)
+        try:
+            while not self.stop_event.is_set():
+                active = self.checkpoint.active_subjects(self.subjects)
+                if not active:
+                    break
+                
+                for subject in active:
+                    page = self.checkpoint.next_page(subject)
+                    result = self.client.search_page(f"subject:{subject}", self.page_size, (page - 1) * self.page_size)
+                    if result is None:
+                        # The client already retried; a failed page must not look like the end of the subject
+                        failures[subject] += 1
+                        if failures[subject] >= self.max_attempts:
+                            raise RuntimeError(f"giving up on {subject} page {page} after {failures[subject]} attempts")
+                        continue
+                    failures[subject] = 0
+                    docs = result['docs']
+                    
+                    fresh = []
+                    for doc in docs:
+                        key = doc.get('key')
+                        if key and (key in seen or self.checkpoint.is_done(key)):
+                            continue
+                        seen.add(key)
+                        fresh.append(dict(doc, _meta=(subject, page)))
+                    
+                    # A short page means there is nothing further to harvest for this subject
+                    self.checkpoint.page_harvested(subject, page, len(fresh), exhausted=len(docs) < self.page_size)
+                    
+                    for doc in fresh:
+                        if not self._put(self.search_queue, doc):
+                            return
+                        self.stats['search'].processed += 1
+        except Exception as e:
+            self.errors.append(f"search: {e}")
+            logger.error(f"Search stage failed: {e}")
+        finally:
+            self._put(self.search_queue, _DONE)
+    
+    def _enrich_stage(self):
+        """Fetch work details for small groups of docs using the client's worker pool"""
+        group_size = self.client.max_workers * 2
+        attempts = defaultdict(int)
+        retry: List[Dict] = []
+        try:
+            finished = False
+            while not finished or retry:
+                # Docs whose lookup failed ride along with the next group
+                group, retry = retry, []
+                if not finished and not group:
+                    item = self._get(self.search_queue)
+                    if item is _DONE:
+                        break
+                    group.append(item)
+                
+                while not finished and len(group) < group_size:
+                    try:
+                        item = self.search_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        finished = True
+                        break
+                    group.append(item)
+                
+                details = self.client.get_work_details_many(doc['key'] for doc in group if doc.get('key'))
+                for doc in group:
+                    key = doc.get('key')
+                    if key and details.get(key) is None:
+                        # After max_attempts the doc stays unfinished in the checkpoint, so a resumed run retries it
+                        attempts[key] += 1
+                        if attempts[key] < self.max_attempts:
+                            retry.append(doc)
+                        else:
+                            self.deferred['enrich'] += 1
+                        continue
+                    if not self._put(self.enrich_queue, (doc, details.get(key))):
+                        return
+                    self.stats['enrich'].processed += 1
+        except Exception as e:
+            self.errors.append(f"enrich: {e}")
+            logger.error(f"Enrich stage failed: {e}")
+            self.stop_event.set()
+        finally:
+            self._put(self.enrich_queue, _DONE)
+    
+    def _format_stage(self):
+        """Format groups of docs and fill missing edition fields with one Books API call per group"""
+        group_size = self.client.config.BIBKEYS_PER_REQUEST
+        try:
+            finished = False
+            while not finished:
+                item = self._get(self.enrich_queue)
+                if item is _DONE:
+                    break
+                
+                group = [item]
+                while len(group) < group_size:
+                    try:
+                        item = self.enrich_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        finished = True
+                        break
+                    group.append(item)
+                
+                formatted = [self.client.format_book_data(doc, work_details) for doc, work_details in group]
+                lookup_failed = {id(book) for book in self.client.enrich_with_editions(formatted)}
+                self.deferred['format'] += len(lookup_failed)
+                for (doc, _), book in zip(group, formatted):
+                    if id(book) in lookup_failed:
+                        continue  # Left unfinished in the checkpoint rather than written without edition data
+                    if not self._put(self.format_queue, (doc, book)):
+                        return
+                    self.stats['format'].processed += 1
+        except Exception as e:
+            self.errors.append(f"format: {e}")
+            logger.error(f"Format stage failed: {e}")
+            self.stop_event.set()
+        finally:
+            self._put(self.format_queue, _DONE)
+    
+    def _write_stage(self):
+        """Write through the bulk writer and checkpoint after every committed batch"""
+        session = db_manager.get_session()
+        if not session:
+            self.errors.append("write: failed to get database session")
+            self.stop_event.set()
+            return
+        
+        try:
+            fingerprints = FingerprintIndex.preload(session) if self.preload_fingerprints else None
+            writer = BulkBookWriter(session, self.batch_size, fingerprints, track_ids=True)
+            self.written_ids = writer.written_ids
+            self.totals = writer.totals  # Live view for progress reports until the final copy below
+            pending = []
+            
+            def committed(result):
+                # Rows that failed stay unfinished, so a resumed run retries them
+                failed = {id(row) for row in writer.failed_rows}
+                self.checkpoint.docs_finished([doc for doc, formatted in pending if id(formatted) not in failed])
+                self.checkpoint.save()
+                pending.clear()
+                if writer.totals['inserted'] >= self.target_count:
+                    logger.info(f"Reached target of {self.target_count} books")
+                    self.stop_event.set()
+            
+            while True:
+                item = self._get(self.format_queue)
+                if item is _DONE:
+                    break
+                
+                doc, formatted = item
+                pending.append((doc, formatted))
+                self.stats['write'].processed += 1
+                result = writer.add(formatted)
+                if result:
+                    committed(result)
+                elif writer.totals['inserted'] + len(pending) >= self.target_count:
+                    # Flush early so we don't overshoot the target by a whole batch
+                    committed(writer.flush())
+            
+            if pending:
+                committed(writer.flush())
+            self.totals = dict(writer.totals)
+        except Exception as e:
+            self.errors.append(f"write: {e}")
+            logger.error(f"Write stage failed: {e}")
+            self.stop_event.set()
+        finally:
+            session.close()
+    
+    def get_stats(self) -> Dict:
+        """Per-stage throughput and the depth of each stage's output queue"""
+        return {name: stage.snapshot() for name, stage in self.stats.items()}
+    
+    def run(self, target_count: int, report_interval: float = 10.0,
+            on_progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Run all stages until target_count books are inserted or the sources are exhausted
+        
+        on_progress, if given, receives the write totals so far at every report.
+        """
+        self.target_count = target_count
+        threads = [
+            threading.Thread(target=stage, name=f"ingest-{name}", daemon=True)
+            for name, stage in (
+                ('search', self._search_stage),
+                ('enrich', self._enrich_stage),
+                ('format', self._format_stage),
+                ('write', self._write_stage)
+            )
+        ]
+        for thread in threads:
+            thread.start()
+        
+        # The writer finishes last; report progress while waiting on it
+        while threads[-1].is_alive():
+            threads[-1].join(report_interval)
+            logger.info(f"Pipeline stats: {self.get_stats()}")
+            if on_progress:
+                on_progress(dict(self.totals, processed=self.stats['write'].processed))
+        
+        self.stop_event.set()
+        for thread in threads:
+            thread.join()
+        
+        logger.info(f"Pipeline finished: {self.totals}, deferred {self.deferred}, client {self.client.controller.get_stats()}")
+        return {'totals': self.totals, 'stages': self.get_stats(), 'errors': self.errors, 'deferred': self.deferred}
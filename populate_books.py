@@ -3,56 +3,66 @@
 Script to populate the database with books from Open Library API
 """
 
+import argparse
 import logging
 import sys
-from typing import List, Dict
+from datetime import timedelta
+from typing import List, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
 
+from bulk_writer import BulkBookWriter
+from config import Config
 from database import init_database, db_manager
+from dedup import FingerprintIndex
+from metrics import metrics
 from openlibrary_client import OpenLibraryClient
+from pipeline import IngestPipeline
+from refresh import StaleWorkRefresher
 from models import Book
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 class BookPopulator:
-    def __init__(self):
+    def __init__(self, batch_size: Optional[int] = None, preload_fingerprints: bool = True,
+                 fetch_covers: bool = False, extract_tags: bool = False):
         self.client = OpenLibraryClient()
+        self.batch_size = batch_size
+        self.preload_fingerprints = preload_fingerprints
+        self.fetch_covers = fetch_covers
+        self.extract_tags = extract_tags
+        self.similarity_index = None  # Set while a background compaction may still be running
         
-    def save_book_to_db(self, session: Session, book_data: Dict) -> bool:
-        """Save a single book to the database"""
-        try:
-            # Check if book already exists (by title and author)
-            existing_book = session.query(Book).filter(
-                Book.title == book_data['title'],
-                Book.author == book_data['author']
-            ).first()
-            
-            if existing_book:
-                logger.info(f"Book already exists: {book_data['title']} by {book_data['author']}")
-                return False
-            
-            # Create new book
-            book = Book(**book_data)
-            session.add(book)
-            session.commit()
-            
-            logger.info(f"Successfully added: {book_data['title']} by {book_data['author']}")
-            return True
-            
-        except IntegrityError as e:
-            session.rollback()
-            logger.warning(f"Integrity error for book '{book_data['title']}': {e}")
-            return False
-        except Exception as e:
-            session.rollback()
-            logger.error(f"Error saving book '{book_data['title']}': {e}")
-            return False
+    def prepare_books(self, raw_books: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Format search docs with their descriptions and edition data
+        
+        Returns the formatted books plus the docs held back because a lookup failed, so
+        nothing is written without its description or edition fields.
+        """
+        work_details = self.client.get_work_details_many(
+            raw_book['key'] for raw_book in raw_books if raw_book.get('key')
+        )
+        
+        held_back = []
+        formatted_books = {}
+        for raw_book in raw_books:
+            key = raw_book.get('key')
+            if key and work_details.get(key) is None:
+                held_back.append(raw_book)
+            else:
+                formatted_books[id(raw_book)] = self.client.format_book_data(raw_book, work_details.get(key))
+        
+        # Fill missing ISBNs, publishers and page counts with batched edition lookups
+        lookup_failed = {id(book) for book in self.client.enrich_with_editions(list(formatted_books.values()))}
+        ready = []
+        for raw_book in raw_books:
+            book = formatted_books.get(id(raw_book))
+            if book is None:
+                continue
+            if id(book) in lookup_failed:
+                held_back.append(raw_book)
+            else:
+                ready.append(book)
+        return ready, held_back
     
     def fetch_and_save_books(self, target_count: int = 50) -> int:
         """Fetch books from Open Library and save to database"""
@@ -73,30 +83,54 @@ class BookPopulator:
                 return 0
             
             saved_count = 0
+            processed = 0
             total_books = len(raw_books)
+            fingerprints = FingerprintIndex.preload(session) if self.preload_fingerprints else None
+            writer = BulkBookWriter(session, self.batch_size, fingerprints, track_ids=True)
             
             logger.info(f"Processing {total_books} books...")
             
-            for i, raw_book in enumerate(raw_books):
-                logger.info(f"Processing book {i+1}/{total_books}: {raw_book.get('title', 'Unknown')}")
-                
-                # Format book data
-                formatted_book = self.client.format_book_data(raw_book)
-                
-                # Try to get work details for description
-                work_key = raw_book.get('key')
-                if work_key:
-                    work_details = self.client.get_work_details(work_key)
-                    if work_details:
-                        formatted_book = self.client.format_book_data(raw_book, work_details)
-                
-                # Save to database
-                if self.save_book_to_db(session, formatted_book):
-                    saved_count += 1
+            # Fetch work details concurrently, one worker-sized chunk at a time so
+            # we don't request descriptions for books we won't need
+            chunk_size = self.client.max_workers * 4
+            
+            # Books whose lookups failed get one more pass once the rest are written
+            pending = raw_books
+            for attempt in range(2):
+                held_back = []
+                for start in range(0, len(pending), chunk_size):
+                    formatted_books, failed = self.prepare_books(pending[start:start + chunk_size])
+                    held_back.extend(failed)
+                    
+                    for formatted_book in formatted_books:
+                        processed += 1
+                        logger.info(f"Processing book {processed}/{total_books}: {formatted_book['title']}")
+                        
+                        # Buffer for the next bulk upsert
+                        batch_result = writer.add(formatted_book)
+                        if batch_result:
+                            saved_count += batch_result['inserted']
+                    
+                    # Stop if we've reached our target
+                    if saved_count >= target_count:
+                        break
                 
-                # Stop if we've reached our target
-                if saved_count >= target_count:
+                if saved_count >= target_count or not held_back:
                     break
+                logger.info(f"Retrying {len(held_back)} books whose lookups failed")
+                pending = held_back
+            
+            saved_count += writer.flush()['inserted']
+            logger.info(f"Write totals: {writer.totals}")
+            if held_back and saved_count < target_count:
+                logger.warning(f"Held back {len(held_back)} books whose lookups failed; a later run will add them")
+            logger.info(f"Request controller: {self.client.controller.get_stats()}")
+            self.update_similarity_index(session, writer.written_ids)
+            if self.fetch_covers:
+                self.prefetch_covers(writer.written_ids)
+            if self.extract_tags:
+                self.tag_books()
+            self.finish_similarity_index()
             
             logger.info(f"Successfully saved {saved_count} books to the database")
             return saved_count
@@ -106,6 +140,130 @@ class BookPopulator:
             return 0
         finally:
             session.close()
+            if self.client.cache:
+                logger.info(f"HTTP cache stats: {self.client.cache.get_stats()}")
+    
+    def stream_and_save_books(self, target_count: int, checkpoint_path: Optional[str] = None) -> int:
+        """Ingest through the streaming pipeline, resuming from a checkpoint if one exists"""
+        pipeline = IngestPipeline(
+            self.client,
+            checkpoint_path=checkpoint_path,
+            batch_size=self.batch_size,
+            preload_fingerprints=self.preload_fingerprints
+        )
+        report = pipeline.run(target_count)
+        
+        for error in report['errors']:
+            logger.error(f"Pipeline error: {error}")
+        
+        session = db_manager.get_session()
+        if session:
+            try:
+                self.update_similarity_index(session, pipeline.written_ids)
+            finally:
+                session.close()
+        if self.fetch_covers:
+            self.prefetch_covers(pipeline.written_ids)
+        if self.extract_tags:
+            self.tag_books()
+        self.finish_similarity_index()
+        return report['totals'].get('inserted', 0)
+    
+    def shard_and_save_books(self, target_count: int, workers: int, checkpoint_path: Optional[str] = None) -> int:
+        """Ingest with one streaming pipeline process per shard of the subject list"""
+        from sharded_ingest import ShardedIngest
+        result = ShardedIngest(workers, batch_size=self.batch_size).run_subjects(target_count, checkpoint_path=checkpoint_path)
+        
+        session = db_manager.get_session()
+        if session:
+            try:
+                self.update_similarity_index(session, result['written_ids'])
+            finally:
+                session.close()
+        if self.fetch_covers:
+            self.prefetch_covers(result['written_ids'])
+        if self.extract_tags:
+            self.tag_books()
+        self.finish_similarity_index()
+        return result['totals']['inserted']
+    
+    def refresh_stale_books(self, limit: int, older_than_days: Optional[float] = None) -> Dict:
+        """Re-fetch the stalest works and rewrite only those whose content changed"""
+        refresher = StaleWorkRefresher(self.client, self.batch_size)
+        older_than = timedelta(days=older_than_days) if older_than_days is not None else None
+        totals = refresher.refresh(limit, older_than)
+        
+        session = db_manager.get_session()
+        if session:
+            try:
+                self.update_similarity_index(session, refresher.written_ids)
+            finally:
+                session.close()
+        self.finish_similarity_index()
+        return totals
+    
+    def prefetch_covers(self, book_ids: List[int]) -> Dict:
+        """Download covers for newly written books into the local cover store"""
+        if not book_ids:
+            return {}
+        
+        from covers import CoverPrefetcher
+        session = db_manager.get_session()
+        if not session:
+            logger.error("Failed to get database session")
+            return {}
+        
+        prefetcher = CoverPrefetcher()
+        try:
+            return prefetcher.prefetch(session, book_ids)
+        except Exception as e:
+            logger.error(f"Error prefetching covers: {e}")
+            return {}
+        finally:
+            session.close()
+            prefetcher.store.close()
+    
+    def tag_books(self) -> Dict:
+        """Extract keyword tags for books added or changed since the last extraction"""
+        from tags import TagExtractor
+        session = db_manager.get_session()
+        if not session:
+            logger.error("Failed to get database session")
+            return {}
+        
+        try:
+            return TagExtractor().extract(session)
+        except Exception as e:
+            logger.error(f"Error extracting tags: {e}")
+            return {}
+        finally:
+            session.close()
+    
+    def update_similarity_index(self, session: Session, book_ids: List[int]):
+        """Fold newly written books into the saved recommendation index, if there is one
+        
+        A compaction this triggers runs in the background while covers and tags are
+        fetched; finish_similarity_index() waits for it and saves the result.
+        """
+        if not book_ids:
+            return
+        
+        try:
+            # Imported lazily so ingest doesn't pay for numpy/scipy when no index exists
+            from recommender import update_index
+            self.similarity_index = update_index(Config.SIMILARITY_INDEX_PATH, session, book_ids)
+        except Exception as e:
+            logger.error(f"Error updating similarity index: {e}")
+    
+    def finish_similarity_index(self):
+        """Save the similarity index once its background compaction, if any, is done"""
+        index, self.similarity_index = self.similarity_index, None
+        if index is None:
+            return
+        try:
+            index.finish_compaction(Config.SIMILARITY_INDEX_PATH)
+        except Exception as e:
+            logger.error(f"Error compacting similarity index: {e}")
     
     def get_database_stats(self):
         """Get current database statistics"""
@@ -130,8 +288,31 @@ class BookPopulator:
         finally:
             session.close()
 
-def main():
-    """Main function to populate the database"""
+def add_populate_arguments(parser: argparse.ArgumentParser):
+    """Options shared by this script and the litwise populate subcommand"""
+    parser.add_argument('--count', type=int, default=50, help="Number of new books to add")
+    parser.add_argument('--stream', action='store_true',
+                        help="Use the streaming pipeline (constant memory, resumable)")
+    parser.add_argument('--checkpoint', help="Checkpoint file for resumable runs (implies --stream)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Streaming pipeline processes, each harvesting its own share of the subjects")
+    parser.add_argument('--covers', action='store_true',
+                        help="Download covers of newly added books into the local cover store")
+    parser.add_argument('--tags', action='store_true',
+                        help="Extract keyword tags for new and changed books afterwards")
+    parser.add_argument('--refresh', type=int, metavar='N',
+                        help="Re-fetch the N least recently fetched works instead of adding new ones")
+    parser.add_argument('--stale-days', type=float,
+                        help="With --refresh, only consider works not fetched for this many days")
+    parser.add_argument('--metrics', help="Write run metrics here (.prom for Prometheus text, else JSON)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Populate the database with books from Open Library")
+    add_populate_arguments(parser)
+    return parser.parse_args()
+
+def run(args):
+    """Populate (or refresh) the database as described by parsed arguments"""
     logger.info("Starting book database population")
     
     # Initialize database
@@ -141,14 +322,28 @@ def main():
         sys.exit(1)
     
     # Create populator and fetch books
-    populator = BookPopulator()
+    populator = BookPopulator(fetch_covers=args.covers, extract_tags=args.tags)
+    
+    if args.refresh:
+        totals = populator.refresh_stale_books(args.refresh, args.stale_days)
+        if args.metrics:
+            metrics.write(args.metrics)
+        sys.exit(0 if totals else 1)
     
     # Get current stats
     populator.get_database_stats()
     
     # Fetch and save books
-    target_count = 50
-    saved_count = populator.fetch_and_save_books(target_count)
+    if args.workers > 1:
+        saved_count = populator.shard_and_save_books(args.count, args.workers, args.checkpoint)
+    elif args.stream or args.checkpoint:
+        saved_count = populator.stream_and_save_books(args.count, args.checkpoint)
+    else:
+        saved_count = populator.fetch_and_save_books(args.count)
+    
+    if args.metrics:
+        metrics.write(args.metrics)
+        logger.info(f"Metrics written to {args.metrics}")
     
     if saved_count > 0:
         logger.info(f"Successfully populated database with {saved_count} books!")
@@ -159,5 +354,14 @@ def main():
         logger.error("No books were added to the database")
         sys.exit(1)
 
+def main():
+    """Main function to populate the database"""
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    run(args)
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+Similar-books engine over hashed TF-IDF vectors of book subjects and descriptions
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+
+from config import Config
+from models import Book
+
+logger = logging.getLogger(__name__)
+
+N_FEATURES = 2 ** 20
+_WORD = re.compile(r"[a-z][a-z']{2,}")
+STOPWORDS = frozenset("""
+    about above after again against all also and any are because been before being below between both
+    but can could did does doing down during each few for from further had has have having her here hers
+    herself him himself his how into its itself just more most not now off once only other our ours
+    ourselves out over own same she should some such than that the their theirs them themselves then
+    there these they this those through too under until very was were what when where which while who
+    whom why will with would you your yours yourself yourselves book books novel story stories one two
+    new first many may much well even still back way life world years time
+""".split())
+
+def extract_terms(subjects: Optional[str], description: Optional[str]) -> Counter:
+    """Turn a book's subjects and description into term counts"""
+    terms = Counter()
+    for subject in (subjects or '').split(','):
+        subject = subject.strip().lower()
+        if subject:
+            # Whole subjects are strong signals, so keep them as their own features too
+            terms[f"subject:{subject}"] += 2
+            terms.update(word for word in _WORD.findall(subject) if word not in STOPWORDS)
+    if description:
+        terms.update(word for word in _WORD.findall(description.lower()) if word not in STOPWORDS)
+    return terms
+
+def hash_terms(terms: Counter, n_features: int = N_FEATURES) -> Tuple[np.ndarray, np.ndarray]:
+    """Map term counts onto sublinear TF values in hashed feature columns"""
+    buckets = Counter()
+    for term, count in terms.items():
+        buckets[zlib.crc32(term.encode('utf-8')) % n_features] += count
+    columns = np.fromiter(buckets.keys(), dtype=np.int32, count=len(buckets))
+    values = 1.0 + np.log(np.fromiter(buckets.values(), dtype=np.float32, count=len(buckets)))
+    return columns, values.astype(np.float32)
+
+def _normalize_rows(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1.0 / norms) @ matrix, dtype=np.float32)
+
+def _compute_idf(document_frequency: np.ndarray, n_docs: int) -> np.ndarray:
+    return (np.log((1 + n_docs) / (1 + document_frequency)) + 1).astype(np.float32)
+
+def _vectorize(documents: Iterable[Tuple[int, Optional[str], Optional[str]]],
+               n_features: int) -> Tuple[np.ndarray, sparse.csr_matrix]:
+    """Hash (book_id, subjects, description) tuples into a TF matrix"""
+    ids, indptr, columns, values = [], [0], [], []
+    for book_id, subjects, description in documents:
+        cols, vals = hash_terms(extract_terms(subjects, description), n_features)
+        ids.append(book_id)
+        columns.append(cols)
+        values.append(vals)
+        indptr.append(indptr[-1] + len(cols))
+    
+    columns = np.concatenate(columns) if columns else np.zeros(0, dtype=np.int32)
+    values = np.concatenate(values) if values else np.zeros(0, dtype=np.float32)
+    tf = sparse.csr_matrix(
+        (values, columns, np.asarray(indptr, dtype=np.int64)),
+        shape=(len(ids), n_features)
+    )
+    return np.asarray(ids, dtype=np.int64), tf
+
+class _Segment:
+    """Block of rows holding raw TF, IDF-weighted vectors and an inverted (CSC) copy"""
+    
+    def __init__(self, ids: np.ndarray, tf: sparse.csr_matrix, matrix: sparse.csr_matrix,
+                 by_feature: Optional[sparse.csc_matrix] = None, dead: Optional[np.ndarray] = None):
+        self.ids = ids
+        self.tf = tf
+        self.matrix = matrix
+        # Column-major copy: a query only touches the postings of its own features
+        self.by_feature = by_feature if by_feature is not None else matrix.tocsc()
+        self.dead = dead if dead is not None else np.zeros(len(ids), dtype=bool)
+        self.rows = None if len(ids) < 2 or np.all(ids[1:] > ids[:-1]) else {int(i): r for r, i in enumerate(ids)}
+    
+    @classmethod
+    def weighted(cls, ids: np.ndarray, tf: sparse.csr_matrix, idf: np.ndarray) -> '_Segment':
+        return cls(ids, tf, _normalize_rows(tf @ sparse.diags(idf)))
+    
+    def row_of(self, book_id: int) -> Optional[int]:
+        if self.rows is not None:
+            row = self.rows.get(book_id)
+        else:
+            row = int(np.searchsorted(self.ids, book_id))
+            row = row if row < len(self.ids) and self.ids[row] == book_id else None
+        if row is None or self.dead[row]:
+            return None
+        return row
+    
+    def scores(self, columns: np.ndarray, values: np.ndarray) -> np.ndarray:
+        scores = np.asarray(self.by_feature[:, columns] @ values).ravel()
+        scores[self.dead] = -1.0
+        return scores
+
+class SimilarityIndex:
+    """Hashed TF-IDF index: a large compacted base segment plus a small delta of recent books
+    
+    New and updated books are appended to the delta using the current IDF weights, and
+    replaced or deleted books are tombstoned. compact() folds the delta into the base and
+    re-weights every row with fresh IDF, either on demand or from a background thread.
+    """
+    
+    def __init__(self, base: _Segment, document_frequency: np.ndarray, n_docs: int,
+                 delta: Optional[_Segment] = None, compacted_docs: Optional[int] = None):
+        self.base = base
+        self.delta = delta
+        self.document_frequency = document_frequency
+        self.n_docs = n_docs
+        self.compacted_docs = compacted_docs if compacted_docs is not None else n_docs
+        self.idf = _compute_idf(document_frequency, n_docs)
+        self.lock = threading.RLock()
+        self.frozen = None  # Delta being folded into the base by a running compaction
+        self.removed_during_compaction = None
+        self.compaction_thread = None
+    
+    @property
+    def n_features(self) -> int:
+        return self.base.tf.shape[1]
+    
+    @classmethod
+    def from_documents(cls, documents: Iterable[Tuple[int, Optional[str], Optional[str]]],
+                       n_features: int = N_FEATURES) -> 'SimilarityIndex':
+        """Build from (book_id, subjects, description) tuples"""
+        ids, tf = _vectorize(documents, n_features)
+        document_frequency = np.bincount(tf.indices, minlength=n_features).astype(np.int64)
+        idf = _compute_idf(document_frequency, len(ids))
+        return cls(_Segment.weighted(ids, tf, idf), document_frequency, len(ids))
+    
+    @classmethod
+    def build_from_database(cls, session, chunk_size: int = 10000) -> 'SimilarityIndex':
+        """Stream subjects and descriptions for the whole catalog"""
+        started = time.monotonic()
+        rows = session.execute(
+            select(Book.id, Book.subjects, Book.description)
+            .order_by(Book.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        index = cls.from_documents(rows)
+        logger.info(f"Built similarity index for {index.n_docs} books in {time.monotonic() - started:.1f}s")
+        return index
+    
+    def _segments(self) -> List[_Segment]:
+        return [segment for segment in (self.base, self.frozen, self.delta) if segment is not None]
+    
+    def _make_writable(self):
+        # Arrays loaded with mmap are read-only until the first update
+        if not self.document_frequency.flags.writeable:
+            self.document_frequency = self.document_frequency.copy()
+    
+    def _locate(self, book_id: int) -> Optional[Tuple[_Segment, int]]:
+        for segment in self._segments():
+            row = segment.row_of(book_id)
+            if row is not None:
+                return segment, row
+        return None
+    
+    def _tombstone(self, book_ids: Iterable[int]) -> int:
+        removed = 0
+        for book_id in book_ids:
+            located = self._locate(int(book_id))
+            if located is None:
+                continue
+            segment, row = located
+            if not segment.dead.flags.writeable:
+                segment.dead = segment.dead.copy()
+            segment.dead[row] = True
+            if self.removed_during_compaction is not None:
+                self.removed_during_compaction.append(int(book_id))
+            np.subtract.at(self.document_frequency, segment.tf.indices[segment.tf.indptr[row]:segment.tf.indptr[row + 1]], 1)
+            removed += 1
+        self.n_docs -= removed
+        return removed
+    
+    def remove(self, book_ids: Iterable[int]) -> int:
+        """Tombstone deleted books; their rows are dropped at the next compaction"""
+        with self.lock:
+            self._make_writable()
+            removed = self._tombstone(book_ids)
+            self.idf = _compute_idf(self.document_frequency, self.n_docs)
+            return removed
+    
+    def add_documents(self, documents: Iterable[Tuple[int, Optional[str], Optional[str]]]) -> int:
+        """Append new or updated books to the delta segment, replacing any previous version"""
+        ids, tf = _vectorize(documents, self.n_features)
+        if not len(ids):
+            return 0
+        
+        with self.lock:
+            self._make_writable()
+            self._tombstone(ids)
+            np.add.at(self.document_frequency, tf.indices, 1)
+            self.n_docs += len(ids)
+            self.idf = _compute_idf(self.document_frequency, self.n_docs)
+            
+            added = _Segment.weighted(ids, tf, self.idf)
+            if self.delta is not None:
+                added = _Segment(
+                    np.concatenate([self.delta.ids, added.ids]),
+                    sparse.vstack([self.delta.tf, added.tf], format='csr'),
+                    sparse.vstack([self.delta.matrix, added.matrix], format='csr'),
+                    dead=np.concatenate([self.delta.dead, added.dead])
+                )
+            self.delta = added
+        
+        logger.info(f"Added {len(ids)} books to the similarity index ({len(self.delta.ids)} in delta)")
+        return len(ids)
+    
+    def needs_compaction(self, threshold: float = 0.1) -> bool:
+        """True once the delta, tombstones or IDF drift exceed threshold of the catalog"""
+        with self.lock:
+            base_size = max(len(self.base.ids), 1)
+            delta_size = len(self.delta.ids) if self.delta is not None else 0
+            dead = int(self.base.dead.sum())
+            drift = abs(self.n_docs - self.compacted_docs) / max(self.compacted_docs, 1)
+            return (delta_size + dead) / base_size > threshold or drift > threshold
+    
+    def compact(self):
+        """Merge live rows into a new base segment re-weighted with current IDF"""
+        started = time.monotonic()
+        with self.lock:
+            if self.frozen is not None:
+                return
+            # Freeze the current delta; books added while compacting go to a fresh one
+            self.frozen, self.delta = self.delta, None
+            segments = [segment for segment in (self.base, self.frozen) if segment is not None]
+            dead = [segment.dead.copy() for segment in segments]
+            document_frequency = self.document_frequency.copy()
+            n_docs = self.n_docs
+            self.removed_during_compaction = []
+        
+        # The heavy lifting happens outside the lock so queries keep being served
+        ids = np.concatenate([segment.ids[~mask] for segment, mask in zip(segments, dead)])
+        tf = sparse.vstack([segment.tf[~mask] for segment, mask in zip(segments, dead)], format='csr')
+        order = np.argsort(ids, kind='stable')
+        base = _Segment.weighted(ids[order], tf[order], _compute_idf(document_frequency, n_docs))
+        
+        with self.lock:
+            # Replay tombstones that landed on the old segments while we were compacting
+            for book_id in self.removed_during_compaction:
+                row = base.row_of(book_id)
+                if row is not None:
+                    base.dead[row] = True
+            self.base = base
+            self.frozen = None
+            self.removed_during_compaction = None
+            self.compacted_docs = n_docs
+        
+        logger.info(f"Compacted similarity index to {len(ids)} books in {time.monotonic() - started:.1f}s")
+    
+    def compact_in_background(self, threshold: float = 0.1) -> bool:
+        """Start a compaction thread if one is needed and none is running"""
+        if self.compaction_thread is not None and self.compaction_thread.is_alive():
+            return False
+        if not self.needs_compaction(threshold):
+            return False
+        self.compaction_thread = threading.Thread(target=self.compact, name='similarity-compaction', daemon=True)
+        self.compaction_thread.start()
+        return True
+    
+    def finish_compaction(self, path: str) -> bool:
+        """Wait for a background compaction and save its result; False if none was started"""
+        if self.compaction_thread is None:
+            return False
+        self.compaction_thread.join()
+        self.compaction_thread = None
+        self.save(path)
+        return True
+    
+    def _top_k(self, k: int, columns: np.ndarray, values: np.ndarray,
+               exclude_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        candidates = []
+        for segment in self._segments():
+            scores = segment.scores(columns, values)
+            if exclude_id is not None:
+                row = segment.row_of(exclude_id)
+                if row is not None:
+                    scores[row] = -1.0
+            count = min(k, len(scores))
+            if count <= 0:
+                continue
+            top = np.argpartition(-scores, count - 1)[:count]
+            candidates.extend((int(segment.ids[row]), float(scores[row])) for row in top if scores[row] > 0)
+        
+        candidates.sort(key=lambda item: -item[1])
+        return candidates[:k]
+    
+    def similar_books(self, book_id: int, k: int = 10) -> List[Tuple[int, float]]:
+        """Return up to k (book_id, cosine similarity) pairs most similar to a catalog book"""
+        with self.lock:
+            located = self._locate(book_id)
+            if located is None:
+                return []
+            segment, row = located
+            vector = segment.matrix[row]
+            return self._top_k(k, vector.indices, vector.data, exclude_id=book_id)
+    
+    def similar_to_text(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """Return up to k (book_id, cosine similarity) pairs matching free text"""
+        columns, values = hash_terms(extract_terms(None, query), self.n_features)
+        if not len(columns):
+            return []
+        with self.lock:
+            values = values * self.idf[columns]
+            values /= np.linalg.norm(values)
+            return self._top_k(k, columns, values)
+    
+    def save(self, path: str):
+        """Write a new generation of .npy arrays and switch the CURRENT pointer to it
+        
+        Older generations are removed; processes that still have them memory-mapped keep
+        reading the unlinked files safely.
+        """
+        if self.compaction_thread is not None:
+            self.compaction_thread.join()
+        
+        with self.lock:
+            segments = {'base': self.base, 'delta': self.delta}
+            meta = {
+                'n_features': self.n_features,
+                'n_docs': self.n_docs,
+                'compacted_docs': self.compacted_docs,
+                'segments': [name for name, segment in segments.items() if segment is not None]
+            }
+            arrays = {'document_frequency': self.document_frequency}
+            for name, segment in segments.items():
+                if segment is None:
+                    continue
+                arrays[f"{name}_ids"] = segment.ids
+                arrays[f"{name}_dead"] = segment.dead
+                for part, matrix in (('tf', segment.tf), ('csr', segment.matrix), ('csc', segment.by_feature)):
+                    arrays[f"{name}_{part}_data"] = matrix.data
+                    arrays[f"{name}_{part}_indices"] = matrix.indices
+                    arrays[f"{name}_{part}_indptr"] = matrix.indptr
+        
+        os.makedirs(path, exist_ok=True)
+        generation = f"gen-{time.time_ns()}"
+        generation_path = os.path.join(path, generation)
+        os.makedirs(generation_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(generation_path, f"{name}.npy"), array)
+        with open(os.path.join(generation_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        
+        current_tmp = os.path.join(path, 'CURRENT.tmp')
+        with open(current_tmp, 'w') as f:
+            f.write(generation)
+        os.replace(current_tmp, os.path.join(path, 'CURRENT'))
+        
+        for entry in os.listdir(path):
+            if entry.startswith('gen-') and entry != generation:
+                shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+        logger.info(f"Saved similarity index to {generation_path}")
+    
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'SimilarityIndex':
+        """Load the current generation; with mmap the arrays are paged in lazily and shared between processes"""
+        with open(os.path.join(path, 'CURRENT')) as f:
+            generation_path = os.path.join(path, f.read().strip())
+        with open(os.path.join(generation_path, 'meta.json')) as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        
+        def array(name):
+            return np.load(os.path.join(generation_path, f"{name}.npy"), mmap_mode=mode)
+        
+        def matrix(name, kind, n_rows):
+            shape = (n_rows, meta['n_features'])
+            parts = (array(f"{name}_data"), array(f"{name}_indices"), array(f"{name}_indptr"))
+            return kind(parts, shape=shape, copy=False)
+        
+        segments = {}
+        for name in meta['segments']:
+            ids = array(f"{name}_ids")
+            segments[name] = _Segment(
+                ids,
+                matrix(f"{name}_tf", sparse.csr_matrix, len(ids)),
+                matrix(f"{name}_csr", sparse.csr_matrix, len(ids)),
+                matrix(f"{name}_csc", sparse.csc_matrix, len(ids)),
+                dead=array(f"{name}_dead")
+            )
+        
+        return cls(
+            segments['base'],
+            array('document_frequency'),
+            meta['n_docs'],
+            delta=segments.get('delta'),
+            compacted_docs=meta['compacted_docs']
+        )
+
+def update_index(path: str, session, book_ids: Iterable[int], chunk_size: int = 1000) -> Optional[SimilarityIndex]:
+    """Append inserted/updated books to a saved index and save it, compacting in the background once it has drifted
+    
+    The new books are saved to the delta straight away; call finish_compaction() on the
+    returned index before exiting so the compacted generation is saved too.
+    """
+    if not os.path.exists(os.path.join(path, 'CURRENT')):
+        logger.info(f"No similarity index at {path}, skipping incremental update")
+        return None
+    
+    index = SimilarityIndex.load(path)
+    book_ids = list(book_ids)
+    for start in range(0, len(book_ids), chunk_size):
+        rows = session.execute(
+            select(Book.id, Book.subjects, Book.description).where(Book.id.in_(book_ids[start:start + chunk_size]))
+        )
+        index.add_documents(rows)
+    
+    index.save(path)
+    if index.compact_in_background():
+        logger.info("Similarity index has drifted, compacting in the background")
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the similar-books index")
+    parser.add_argument('--index', default=Config.SIMILARITY_INDEX_PATH, help="Index directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="Build the index from the database")
+    similar = subparsers.add_parser('similar', help="Books similar to a catalog book")
+    similar.add_argument('book_id', type=int)
+    similar.add_argument('-k', type=int, default=10)
+    query = subparsers.add_parser('query', help="Books matching free text")
+    query.add_argument('text')
+    query.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    if args.command == 'build':
+        from database import db_manager
+        session = db_manager.get_session()
+        if not session:
+            logger.error("Failed to get database session")
+            sys.exit(1)
+        try:
+            SimilarityIndex.build_from_database(session).save(args.index)
+        finally:
+            session.close()
+        return
+    
+    index = SimilarityIndex.load(args.index)
+    started = time.perf_counter()
+    if args.command == 'similar':
+        results = index.similar_books(args.book_id, args.k)
+    else:
+        results = index.similar_to_text(args.text, args.k)
+    logger.info(f"Query took {(time.perf_counter() - started) * 1000:.1f}ms")
+    
+    for book_id, score in results:
+        print(f"{book_id}\t{score:.3f}")
+
+if __name__ == "__main__":
+    main()
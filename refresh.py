@@ -0,0 +1,101 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import or_, select, update
+
+from bulk_writer import BulkBookWriter
+from database import db_manager
+from models import Book
+from openlibrary_client import OpenLibraryClient
+
+logger = logging.getLogger(__name__)
+
+class StaleWorkRefresher:
+    """Re-fetches the least recently fetched works and rewrites only the ones whose content changed"""
+    
+    def __init__(self, client: Optional[OpenLibraryClient] = None, batch_size: Optional[int] = None,
+                 lookup_size: int = 50):
+        self.client = client or OpenLibraryClient()
+        self.batch_size = batch_size
+        self.lookup_size = lookup_size  # Work keys per key:(...) search request
+        self.written_ids: List[int] = []
+    
+    def stale_keys(self, session, limit: int, older_than: Optional[timedelta] = None) -> List[str]:
+        """Work keys ordered by last fetch, never-fetched (NULL) rows first on both MySQL and SQLite"""
+        query = select(Book.openlibrary_key).where(Book.openlibrary_key.isnot(None))
+        if older_than is not None:
+            cutoff = datetime.now() - older_than
+            query = query.where(or_(Book.last_fetched_at.is_(None), Book.last_fetched_at < cutoff))
+        query = query.order_by(Book.last_fetched_at, Book.id).limit(limit)
+        return list(session.execute(query).scalars())
+    
+    def _touch(self, session, keys: List[str]):
+        # Works that no longer show up in search go to the back of the queue instead of being retried forever
+        session.execute(
+            update(Book)
+            .where(Book.openlibrary_key.in_(keys))
+            .values(last_fetched_at=datetime.now(), updated_at=Book.updated_at)
+        )
+        session.commit()
+    
+    def refresh(self, limit: int, older_than: Optional[timedelta] = None) -> Dict:
+        """Refresh up to limit stale works; returns the writer totals plus missing/failed counts"""
+        session = db_manager.get_session()
+        if not session:
+            logger.error("Failed to get database session")
+            return {}
+        
+        started = time.monotonic()
+        missing = 0
+        failed = 0
+        try:
+            keys = self.stale_keys(session, limit, older_than)
+            logger.info(f"Refreshing {len(keys)} stale works")
+            
+            # Every row is expected to exist, so skip the fingerprint preload and compare content hashes instead
+            writer = BulkBookWriter(session, self.batch_size, track_ids=True)
+            self.written_ids = writer.written_ids
+            group_size = self.lookup_size * self.client.max_workers
+            
+            for start in range(0, len(keys), group_size):
+                group = keys[start:start + group_size]
+                chunks = [group[i:i + self.lookup_size] for i in range(0, len(group), self.lookup_size)]
+                docs: Dict[str, Dict] = {}
+                gone = []
+                
+                for chunk, found in zip(chunks, self.client.map_concurrently(self.client.search_by_keys, chunks)):
+                    if found is None:
+                        failed += len(chunk)
+                        continue
+                    docs.update(found)
+                    gone.extend(key for key in chunk if key not in found)
+                
+                details = self.client.get_work_details_many(docs)
+                books = []
+                for key, doc in docs.items():
+                    # A failed details fetch would blank the description; leave the work stale for the next run
+                    if details.get(key) is None:
+                        failed += 1
+                        continue
+                    books.append(self.client.format_book_data(doc, details[key]))
+                
+                # Enrich exactly like ingest does, or every enriched row would look changed
+                lookup_failed = self.client.enrich_with_editions(books)
+                failed += len(lookup_failed)
+                skip = {id(book) for book in lookup_failed}
+                for book in books:
+                    if id(book) not in skip:
+                        writer.add(book)
+                
+                writer.flush()
+                if gone:
+                    self._touch(session, gone)
+                    missing += len(gone)
+            
+            elapsed = time.monotonic() - started
+            totals = dict(writer.totals, missing=missing, failed=writer.totals['failed'] + failed)
+            logger.info(f"Refresh finished in {elapsed:.1f}s: {totals}")
+            return totals
+        finally:
+            session.close()
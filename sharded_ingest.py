@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Multi-process ingest: shards of subjects or dump files run in a process pool, one engine per worker
+"""
+
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import get_config
+from database import db_manager, init_database
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+COUNT_FIELDS = ('inserted', 'updated', 'unchanged', 'skipped', 'failed', 'processed')
+
+# Set in each worker by _init_worker
+_progress_queue = None
+
+def _init_worker(progress_queue, pool_size: Optional[int], shard_count: int):
+    global _progress_queue
+    _progress_queue = progress_queue
+    
+    # A forked worker inherits the parent's engine; its pooled connections belong to the parent
+    if db_manager.engine is not None:
+        db_manager.engine.dispose(close=False)
+    db_manager.connect(pool_size=pool_size)
+    metrics.reset()
+    
+    # Shards share the Open Library limits rather than multiplying them
+    config = get_config()
+    config.REQUESTS_PER_SECOND = config.REQUESTS_PER_SECOND / shard_count
+    config.MAX_CONCURRENT_REQUESTS = max(1, math.ceil(config.MAX_CONCURRENT_REQUESTS / shard_count))
+
+def _reporter(shard: int) -> Callable[[Dict], None]:
+    def report(progress: Dict):
+        _progress_queue.put((shard, progress))
+    return report
+
+def _subject_shard(shard: int, subjects: List[str], target_count: int, checkpoint_path: Optional[str],
+                   batch_size: Optional[int]) -> Dict:
+    from pipeline import IngestPipeline
+    
+    pipeline = IngestPipeline(subjects=subjects, checkpoint_path=checkpoint_path, batch_size=batch_size)
+    report = pipeline.run(target_count, on_progress=_reporter(shard))
+    return {
+        'totals': dict(report['totals'], processed=report['stages']['write']['processed']),
+        'errors': report['errors'],
+        'written_ids': pipeline.written_ids
+    }
+
+def _dump_shard(shard: int, works_path: str, scratch_path: str, limit: Optional[int],
+                byte_range: Optional[Tuple[int, int]], hash_shard: Optional[Tuple[int, int]],
+                batch_size: Optional[int]) -> Dict:
+    from dump_ingest import DumpIngester
+    
+    ingester = DumpIngester(scratch_path, batch_size)
+    try:
+        totals = ingester.ingest(works_path, limit=limit, byte_range=byte_range, shard=hash_shard,
+                                 on_progress=_reporter(shard), progress_every=10000)
+    finally:
+        ingester.close()
+    return {'totals': totals, 'errors': [] if totals else ["ingest failed, see the worker log"], 'written_ids': []}
+
+class ShardedIngest:
+    """Runs ingest shards in a process pool and merges their progress, counts and errors
+    
+    Each worker disposes the engine it inherited and connects with its own pool of
+    pool_size connections. Shards share nothing but the database, whose unique keys keep
+    them consistent when two shards write the same book at once. On MySQL the upsert leaves
+    a row stored under another openlibrary_key untouched and BulkBookWriter counts the later
+    one as skipped; elsewhere the later batch fails and is retried with every fingerprint
+    checked against the database.
+    """
+    
+    def __init__(self, workers: Optional[int] = None, pool_size: int = 2, batch_size: Optional[int] = None,
+                 report_interval: float = 10.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.report_interval = report_interval
+    
+    def _run(self, worker: Callable, shards: List[tuple]) -> Dict:
+        started = time.monotonic()
+        progress_queue = multiprocessing.Queue()
+        latest: Dict[int, Dict] = {}
+        finished = set()
+        totals = dict.fromkeys(COUNT_FIELDS, 0)
+        errors: List[str] = []
+        written_ids: List[int] = []
+        
+        def merged_progress() -> Dict:
+            while True:
+                try:
+                    shard, progress = progress_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if shard not in finished:
+                    latest[shard] = progress
+            merged = {field: sum(progress.get(field, 0) for progress in latest.values()) for field in COUNT_FIELDS}
+            elapsed = max(time.monotonic() - started, 1e-9)
+            return dict(merged, shards_done=len(finished), per_second=round(merged['processed'] / elapsed, 1))
+        
+        with ProcessPoolExecutor(max_workers=len(shards), initializer=_init_worker,
+                                 initargs=(progress_queue, self.pool_size, len(shards))) as executor:
+            futures = {executor.submit(worker, index, *args): index for index, args in enumerate(shards)}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=self.report_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard = futures[future]
+                    finished.add(shard)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        errors.append(f"shard {shard}: {e}")
+                        logger.error(f"Shard {shard} failed: {e}")
+                        continue
+                    # Final counts replace the shard's last progress report
+                    latest[shard] = result['totals']
+                    for field in COUNT_FIELDS:
+                        totals[field] += result['totals'].get(field, 0)
+                    errors.extend(f"shard {shard}: {error}" for error in result['errors'])
+                    written_ids.extend(result['written_ids'])
+                logger.info(f"Sharded ingest progress: {merged_progress()}")
+        
+        elapsed = time.monotonic() - started
+        logger.info(f"Sharded ingest finished in {elapsed:.1f}s over {len(shards)} shards: {totals}")
+        for error in errors:
+            logger.error(f"Shard error: {error}")
+        return {'totals': totals, 'errors': errors, 'written_ids': written_ids, 'elapsed': round(elapsed, 1)}
+    
+    def run_subjects(self, target_count: int, subjects: Optional[List[str]] = None,
+                     checkpoint_path: Optional[str] = None) -> Dict:
+        """Split the subject list round-robin across workers, each running its own streaming pipeline
+        
+        Checkpoints are kept per shard (checkpoint_path.N), so resume with the same worker count.
+        """
+        from openlibrary_client import DEFAULT_SUBJECTS
+        
+        subjects = list(subjects or DEFAULT_SUBJECTS)
+        count = max(1, min(self.workers, len(subjects)))
+        shards = [
+            (subjects[index::count], math.ceil(target_count / count),
+             f"{checkpoint_path}.{index}" if checkpoint_path else None, self.batch_size)
+            for index in range(count)
+        ]
+        return self._run(_subject_shard, shards)
+    
+    def run_dump(self, works_path: str, editions_path: Optional[str] = None, authors_path: Optional[str] = None,
+                 limit: Optional[int] = None, partition: str = 'auto', scratch_path: Optional[str] = None) -> Dict:
+        """Load the author/edition lookups once, then split the works dump by byte range or key hash"""
+        from dump_ingest import DumpIngester, split_byte_ranges
+        
+        if partition == 'auto':
+            partition = 'hash' if works_path.endswith('.gz') else 'range'
+        temporary_scratch = scratch_path is None
+        if temporary_scratch:
+            fd, scratch_path = tempfile.mkstemp(suffix='.db', prefix='litwise_dump_')
+            os.close(fd)
+        
+        loader = DumpIngester(scratch_path)
+        try:
+            if authors_path:
+                loader.load_authors(authors_path)
+            if editions_path:
+                loader.load_editions(editions_path)
+        finally:
+            loader.close()
+        
+        # Gzip cannot be split, so every hash shard decompresses the whole file but only parses its own keys
+        if partition == 'range':
+            ranges = [(byte_range, None) for byte_range in split_byte_ranges(works_path, self.workers)]
+        else:
+            ranges = [(None, (index, self.workers)) for index in range(self.workers)]
+        shard_limit = math.ceil(limit / self.workers) if limit else None
+        shards = [
+            (works_path, scratch_path, shard_limit, byte_range, hash_shard, self.batch_size)
+            for byte_range, hash_shard in ranges
+        ]
+        try:
+            return self._run(_dump_shard, shards)
+        finally:
+            if temporary_scratch and os.path.exists(scratch_path):
+                os.remove(scratch_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest with one process per shard")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per core)")
+    parser.add_argument('--pool-size', type=int, default=2, help="Database connections per worker")
+    subparsers = parser.add_subparsers(dest='source', required=True)
+    
+    api = subparsers.add_parser('api', help="Harvest Open Library by subject, one subject shard per worker")
+    api.add_argument('--count', type=int, default=1000, help="Number of new books to add")
+    api.add_argument('--checkpoint', help="Checkpoint file prefix for resumable runs")
+    
+    dump = subparsers.add_parser('dump', help="Ingest dump files split by byte range or work-key hash")
+    dump.add_argument('--works', required=True, help="Path to ol_dump_works_*.txt(.gz)")
+    dump.add_argument('--editions', help="Path to ol_dump_editions_*.txt.gz")
+    dump.add_argument('--authors', help="Path to ol_dump_authors_*.txt.gz")
+    dump.add_argument('--limit', type=int, help="Stop after about this many works")
+    dump.add_argument('--partition', choices=['auto', 'range', 'hash'], default='auto',
+                      help="range needs an uncompressed works dump; auto picks range unless it is gzipped")
+    dump.add_argument('--scratch', help="SQLite file for author/edition lookups (default: temp file)")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    if not init_database():
+        logger.error("Failed to initialize database. Please check your database configuration.")
+        sys.exit(1)
+    
+    ingest = ShardedIngest(args.workers, args.pool_size)
+    if args.source == 'api':
+        result = ingest.run_subjects(args.count, checkpoint_path=args.checkpoint)
+    else:
+        result = ingest.run_dump(args.works, args.editions, args.authors, args.limit, args.partition, args.scratch)
+    sys.exit(1 if result['errors'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped columnar snapshot of the catalog for database-free, read-heavy serving
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from config import Config
+from models import Book
+
+logger = logging.getLogger(__name__)
+
+# Fixed-width columns; NULL is NULL_INT for integers, NaN for floats and NaT for timestamps
+NULL_INT = np.iinfo(np.int32).min
+INT_COLUMNS = ('first_publish_year', 'number_of_pages', 'rating_count')
+FLOAT_COLUMNS = ('average_rating',)
+TIME_COLUMNS = ('created_at', 'updated_at', 'last_fetched_at')
+# Repetitive strings interned into one table per column; rows hold int32 codes, -1 for NULL
+DICTIONARY_COLUMNS = ('author', 'publisher', 'language')
+# Mostly unique strings kept as a UTF-8 heap plus int64 offsets; empty reads back as None
+TEXT_COLUMNS = ('title', 'isbn', 'isbn13', 'openlibrary_key', 'work_key', 'edition_key',
+                'description', 'cover_image_url')
+
+# Key order of Book.to_dict()
+ROW_FIELDS = ('id', 'title', 'author', 'isbn', 'isbn13', 'first_publish_year', 'publisher', 'number_of_pages',
+              'openlibrary_key', 'work_key', 'edition_key', 'description', 'subjects', 'average_rating',
+              'rating_count', 'language', 'cover_image_url') + TIME_COLUMNS
+
+_NAT = np.iinfo(np.int64).min
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_EMPTY = -1
+
+def _normalize_isbn(isbn: str) -> str:
+    return isbn.replace('-', '').replace(' ', '').upper()
+
+def _normalize_work_key(key: str) -> str:
+    return key if key.startswith('/') else f"/works/{key}"
+
+def _hash_key(key) -> int:
+    # Stable across processes, unlike hash(); ids use Fibonacci hashing
+    if isinstance(key, int):
+        return (key * 2654435769) & 0xFFFFFFFF
+    return zlib.crc32(key.encode('utf-8'))
+
+def _build_table(keys: List[Tuple[object, int]]) -> np.ndarray:
+    """Open-addressing table of row numbers with linear probing, kept at most half full"""
+    size = 1 << max(3, (2 * len(keys)).bit_length())
+    mask = size - 1
+    table = [_EMPTY] * size
+    for key, row in keys:
+        slot = _hash_key(key) & mask
+        while table[slot] != _EMPTY:
+            slot = (slot + 1) & mask
+        table[slot] = row
+    return np.array(table, dtype=np.int32)
+
+def _split_subjects(subjects: Optional[str]) -> List[str]:
+    return [name.strip() for name in (subjects or '').split(',') if name.strip()]
+
+class _Heap:
+    """Appends UTF-8 strings to a temporary file, recording where each one ends"""
+    
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self.temp_path = os.path.join(directory, f"{name}.tmp")
+        self.file = open(self.temp_path, 'wb')
+        self.ends = array('q')
+        self.size = 0
+    
+    def extend(self, values: Iterable[Optional[str]]):
+        encoded = [value.encode('utf-8') if value else b'' for value in values]
+        self.file.write(b''.join(encoded))
+        ends = list(accumulate(map(len, encoded), initial=self.size))
+        self.ends.extend(ends[1:])
+        self.size = ends[-1]
+    
+    def finish(self, chunk_size: int = 1 << 24):
+        """Write <name>_offsets.npy and <name>_data.npy without reading the heap back into memory"""
+        self.file.close()
+        offsets = np.zeros(len(self.ends) + 1, dtype=np.int64)
+        offsets[1:] = np.frombuffer(self.ends, dtype=np.int64)
+        np.save(os.path.join(self.directory, f"{self.name}_offsets.npy"), offsets)
+        
+        data_path = os.path.join(self.directory, f"{self.name}_data.npy")
+        if not self.size:
+            np.save(data_path, np.zeros(0, dtype=np.uint8))
+        else:
+            data = np.lib.format.open_memmap(data_path, mode='w+', dtype=np.uint8, shape=(self.size,))
+            position = 0
+            with open(self.temp_path, 'rb') as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    data[position:position + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+                    position += len(chunk)
+            data.flush()
+            del data
+        os.remove(self.temp_path)
+
+class _Dictionary:
+    """Interns strings to dense int32 codes while a snapshot is being built"""
+    
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+    
+    def encode(self, value: Optional[str]) -> int:
+        if value is None:
+            return _EMPTY
+        return self.codes.setdefault(value, len(self.codes))
+    
+    def save(self, directory: str, name: str):
+        heap = _Heap(directory, name)
+        heap.extend(self.codes)  # Insertion order is code order
+        heap.finish()
+
+def build_snapshot(session, path: Optional[str] = None, chunk_size: int = 10000) -> int:
+    """Stream the books table into a new snapshot generation and switch CURRENT to it
+    
+    path defaults to CATALOG_SNAPSHOT_PATH. Older generations are removed; processes that still have them memory-mapped keep
+    reading the unlinked files safely.
+    """
+    started = time.monotonic()
+    path = path or Config.CATALOG_SNAPSHOT_PATH
+    os.makedirs(path, exist_ok=True)
+    generation = f"gen-{time.time_ns()}"
+    generation_path = os.path.join(path, generation)
+    os.makedirs(generation_path)
+    
+    ids = array('q')
+    ints = {name: array('i') for name in INT_COLUMNS}
+    floats = {name: array('d') for name in FLOAT_COLUMNS}
+    times = {name: array('q') for name in TIME_COLUMNS}
+    codes = {name: array('i') for name in DICTIONARY_COLUMNS}
+    dictionaries = {name: _Dictionary() for name in DICTIONARY_COLUMNS + ('subject',)}
+    heaps = {name: _Heap(generation_path, name) for name in TEXT_COLUMNS}
+    subject_ends = array('q')
+    subject_codes = array('i')
+    work_keys: List[Tuple[str, int]] = []
+    isbns: List[Tuple[str, int]] = []
+    
+    columns = ('id',) + INT_COLUMNS + FLOAT_COLUMNS + TIME_COLUMNS + DICTIONARY_COLUMNS + TEXT_COLUMNS + ('subjects',)
+    rows = session.execute(
+        select(*(Book.__table__.c[name] for name in columns))
+        .order_by(Book.id)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    # Column-at-a-time over each fetched partition keeps the per-value work in C where possible
+    for partition in rows.partitions():
+        start = len(ids)
+        values = dict(zip(columns, zip(*partition)))
+        ids.extend(values['id'])
+        for name in INT_COLUMNS:
+            ints[name].extend(NULL_INT if value is None else value for value in values[name])
+        for name in FLOAT_COLUMNS:
+            floats[name].extend(math.nan if value is None else value for value in values[name])
+        for name in TIME_COLUMNS:
+            times[name].extend(_NAT if value is None else (value - _EPOCH) // _MICROSECOND for value in values[name])
+        for name in DICTIONARY_COLUMNS:
+            codes[name].extend(map(dictionaries[name].encode, values[name]))
+        for name in TEXT_COLUMNS:
+            heaps[name].extend(values[name])
+        
+        for row, (subjects, work_key, isbn, isbn13) in enumerate(
+                zip(values['subjects'], values['work_key'], values['isbn'], values['isbn13']), start):
+            subject_codes.extend(map(dictionaries['subject'].encode, _split_subjects(subjects)))
+            subject_ends.append(len(subject_codes))
+            if work_key:
+                work_keys.append((work_key, row))
+            for value in {isbn, isbn13} - {None, ''}:
+                isbns.append((_normalize_isbn(value), row))
+    
+    def save(name, values):
+        np.save(os.path.join(generation_path, f"{name}.npy"), values)
+    
+    save('id', np.frombuffer(ids, dtype=np.int64))
+    for name in INT_COLUMNS:
+        save(name, np.frombuffer(ints[name], dtype=np.int32))
+    for name in FLOAT_COLUMNS:
+        save(name, np.frombuffer(floats[name], dtype=np.float64).astype(np.float32))
+    for name in TIME_COLUMNS:
+        save(name, np.frombuffer(times[name], dtype=np.int64).view('datetime64[us]'))
+    for name in DICTIONARY_COLUMNS:
+        save(f"{name}_codes", np.frombuffer(codes[name], dtype=np.int32))
+    for name, dictionary in dictionaries.items():
+        dictionary.save(generation_path, f"{name}_dictionary")
+    for heap in heaps.values():
+        heap.finish()
+    
+    subject_offsets = np.zeros(len(subject_ends) + 1, dtype=np.int64)
+    subject_offsets[1:] = np.frombuffer(subject_ends, dtype=np.int64)
+    save('subject_offsets', subject_offsets)
+    save('subject_codes', np.frombuffer(subject_codes, dtype=np.int32))
+    
+    save('id_table', _build_table([(int(book_id), row) for row, book_id in enumerate(ids)]))
+    save('work_key_table', _build_table(work_keys))
+    save('isbn_table', _build_table(isbns))
+    
+    meta = {'rows': len(ids), 'built_at': time.time()}
+    with open(os.path.join(generation_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    
+    current_tmp = os.path.join(path, 'CURRENT.tmp')
+    with open(current_tmp, 'w') as f:
+        f.write(generation)
+    os.replace(current_tmp, os.path.join(path, 'CURRENT'))
+    
+    for entry in os.listdir(path):
+        if entry.startswith('gen-') and entry != generation:
+            shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+    logger.info(f"Built catalog snapshot of {len(ids)} books in {time.monotonic() - started:.1f}s at {generation_path}")
+    return len(ids)
+
+class CatalogSnapshot:
+    """Read-only view of a snapshot; O(1) lookups by id, work key and ISBN without a database
+    
+    Every array is memory-mapped, so worker processes opening the same snapshot share one
+    copy of its pages through the OS page cache.
+    """
+    
+    def __init__(self, generation_path: str, mmap: bool = True):
+        with open(os.path.join(generation_path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        mode = 'r' if mmap else None
+        # asarray drops the np.memmap subclass, whose per-slice bookkeeping dominates small reads
+        self.arrays: Dict[str, np.ndarray] = {
+            entry[:-4]: np.asarray(np.load(os.path.join(generation_path, entry), mmap_mode=mode))
+            for entry in os.listdir(generation_path) if entry.endswith('.npy')
+        }
+        self.ids = self.arrays['id']
+    
+    @classmethod
+    def open(cls, path: Optional[str] = None, mmap: bool = True) -> 'CatalogSnapshot':
+        """Open the current generation of the snapshot at path (default: CATALOG_SNAPSHOT_PATH)"""
+        path = path or Config.CATALOG_SNAPSHOT_PATH
+        with open(os.path.join(path, 'CURRENT')) as f:
+            return cls(os.path.join(path, f.read().strip()), mmap)
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def _string(self, name: str, index: int) -> Optional[str]:
+        start, end = self.arrays[f"{name}_offsets"][index:index + 2].tolist()
+        if start == end:
+            return None
+        return self.arrays[f"{name}_data"][start:end].tobytes().decode('utf-8')
+    
+    def _lookup(self, table_name: str, key, matches) -> Optional[int]:
+        table = self.arrays[f"{table_name}_table"]
+        mask = len(table) - 1
+        slot = _hash_key(key) & mask
+        while True:
+            row = int(table[slot])
+            if row == _EMPTY:
+                return None
+            if matches(row):
+                return row
+            slot = (slot + 1) & mask
+    
+    def row_of_id(self, book_id: int) -> Optional[int]:
+        book_id = int(book_id)
+        return self._lookup('id', book_id, lambda row: self.ids[row] == book_id)
+    
+    def row_of_work_key(self, work_key: str) -> Optional[int]:
+        work_key = _normalize_work_key(work_key)
+        return self._lookup('work_key', work_key, lambda row: self._string('work_key', row) == work_key)
+    
+    def row_of_isbn(self, isbn: str) -> Optional[int]:
+        isbn = _normalize_isbn(isbn)
+        
+        def matches(row):
+            return any(value and _normalize_isbn(value) == isbn
+                       for value in (self._string('isbn', row), self._string('isbn13', row)))
+        return self._lookup('isbn', isbn, matches)
+    
+    def subjects_of(self, row: int) -> List[str]:
+        offsets = self.arrays['subject_offsets']
+        codes = self.arrays['subject_codes'][offsets[row]:offsets[row + 1]]
+        return [self._string('subject_dictionary', int(code)) for code in codes]
+    
+    def value(self, row: int, name: str):
+        """One column of one row as a plain Python value"""
+        if name == 'id':
+            return int(self.ids[row])
+        if name == 'subjects':
+            return ', '.join(self.subjects_of(row)) or None
+        if name in INT_COLUMNS:
+            value = self.arrays[name][row].item()
+            return None if value == NULL_INT else value
+        if name in FLOAT_COLUMNS:
+            value = self.arrays[name][row].item()
+            return None if value != value else value  # NaN
+        if name in TIME_COLUMNS:
+            return self.arrays[name][row].item()  # NaT converts to None
+        if name in DICTIONARY_COLUMNS:
+            code = self.arrays[f"{name}_codes"][row].item()
+            return None if code == _EMPTY else self._string(f"{name}_dictionary", code)
+        if name in TEXT_COLUMNS:
+            return self._string(name, row)
+        raise KeyError(name)
+    
+    def row(self, row: int) -> Dict:
+        """The row as a dictionary shaped like Book.to_dict()"""
+        book = {name: self.value(row, name) for name in ROW_FIELDS}
+        for name in TIME_COLUMNS:
+            book[name] = book[name].isoformat() if book[name] else None
+        return book
+    
+    def lookup(self, key: str) -> Optional[Dict]:
+        """Dispatch a command-line key: book id, work key (OL123W) or ISBN"""
+        if key.isdigit() and len(key) not in (10, 13):
+            return self.get(int(key))
+        if key.upper().endswith('W'):
+            return self.get_by_work_key(key)
+        return self.get_by_isbn(key)
+    
+    def get(self, book_id: int) -> Optional[Dict]:
+        row = self.row_of_id(book_id)
+        return self.row(row) if row is not None else None
+    
+    def get_by_work_key(self, work_key: str) -> Optional[Dict]:
+        row = self.row_of_work_key(work_key)
+        return self.row(row) if row is not None else None
+    
+    def get_by_isbn(self, isbn: str) -> Optional[Dict]:
+        row = self.row_of_isbn(isbn)
+        return self.row(row) if row is not None else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query the memory-mapped catalog snapshot")
+    parser.add_argument('--path', default=Config.CATALOG_SNAPSHOT_PATH, help="Snapshot directory")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Build a new snapshot from the database")
+    build.add_argument('--chunk-size', type=int, default=10000)
+    get = subparsers.add_parser('get', help="Look up one book by id, work key or ISBN")
+    get.add_argument('key', help="Book id, work key (OL123W or /works/OL123W) or ISBN")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    if args.command == 'build':
+        from database import db_manager
+        session = db_manager.get_session()
+        if not session:
+            logger.error("Failed to get database session")
+            sys.exit(1)
+        try:
+            build_snapshot(session, args.path, args.chunk_size)
+        finally:
+            session.close()
+        return
+    
+    snapshot = CatalogSnapshot.open(args.path)
+    started = time.perf_counter()
+    book = snapshot.lookup(args.key)
+    logger.info(f"Lookup took {(time.perf_counter() - started) * 1000:.3f}ms")
+    
+    if book is None:
+        logger.error(f"No book found for {args.key}")
+        sys.exit(1)
+    print(json.dumps(book, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
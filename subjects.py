@@ -0,0 +1,101 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import Session
+
+from models import Book, BookSubject, Subject
+
+logger = logging.getLogger(__name__)
+
+def parse_subjects(subjects: Optional[str]) -> List[str]:
+    """Split a comma-separated subjects string into normalized, de-duplicated names"""
+    names = []
+    for name in (subjects or '').split(','):
+        name = ' '.join(name.split()).lower()[:255]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def _insert_ignore(session: Session, table, rows: List[Dict]):
+    """Multi-row insert that silently skips rows violating a unique key"""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table).values(rows).prefix_with('IGNORE')
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(table).values(rows).on_conflict_do_nothing()
+    else:
+        stmt = insert(table).values(rows)
+    session.execute(stmt)
+
+def get_subject_ids(session: Session, names: List[str], create: bool = False) -> Dict[str, int]:
+    """Resolve subject names to ids, optionally creating the missing ones in bulk"""
+    if not names:
+        return {}
+    
+    ids = dict(session.execute(select(Subject.name, Subject.id).where(Subject.name.in_(names))).all())
+    missing = [name for name in names if name not in ids]
+    if create and missing:
+        _insert_ignore(session, Subject.__table__, [{'name': name} for name in missing])
+        ids.update(session.execute(select(Subject.name, Subject.id).where(Subject.name.in_(missing))).all())
+    return ids
+
+def sync_book_subjects(session: Session, book_subjects: Dict[int, Optional[str]], replace: bool = True):
+    """Write the subject associations for a batch of books in a handful of statements
+    
+    The caller owns the transaction; nothing is committed here.
+    """
+    parsed = {book_id: parse_subjects(subjects) for book_id, subjects in book_subjects.items()}
+    names = sorted({name for names in parsed.values() for name in names})
+    subject_ids = get_subject_ids(session, names, create=True)
+    
+    if replace:
+        session.execute(delete(BookSubject).where(BookSubject.book_id.in_(list(parsed))))
+    
+    links = [
+        {'book_id': book_id, 'subject_id': subject_ids[name]}
+        for book_id, names in parsed.items()
+        for name in names
+        if name in subject_ids
+    ]
+    if links:
+        _insert_ignore(session, BookSubject.__table__, links)
+
+def _paginate(query, limit: int, offset: int):
+    return query.order_by(Book.id).limit(limit).offset(offset)
+
+def books_by_subject(session: Session, subject: str, limit: int = 50, offset: int = 0) -> List[Book]:
+    """Books tagged with one subject"""
+    return books_with_subjects(session, [subject], match='any', limit=limit, offset=offset)
+
+def books_with_subjects(session: Session, subjects: List[str], match: str = 'all',
+                        limit: int = 50, offset: int = 0) -> List[Book]:
+    """Books tagged with all (or any) of the given subjects"""
+    names = parse_subjects(','.join(subjects))
+    subject_ids = list(get_subject_ids(session, names).values())
+    if not subject_ids or (match == 'all' and len(subject_ids) < len(names)):
+        return []
+    
+    matching = (
+        select(BookSubject.book_id)
+        .where(BookSubject.subject_id.in_(subject_ids))
+        .group_by(BookSubject.book_id)
+    )
+    if match == 'all':
+        matching = matching.having(func.count(BookSubject.subject_id) == len(subject_ids))
+    
+    query = select(Book).where(Book.id.in_(matching))
+    return list(session.execute(_paginate(query, limit, offset)).scalars())
+
+def subject_counts(session: Session, limit: int = 50, prefix: Optional[str] = None) -> List[Tuple[str, int]]:
+    """Most common subjects with the number of books tagged with each"""
+    query = (
+        select(Subject.name, func.count(BookSubject.book_id).label('book_count'))
+        .join(BookSubject, BookSubject.subject_id == Subject.id)
+        .group_by(Subject.id, Subject.name)
+        .order_by(func.count(BookSubject.book_id).desc())
+        .limit(limit)
+    )
+    if prefix:
+        query = query.where(Subject.name.like(f"{prefix.lower()}%"))
+    return [(name, count) for name, count in session.execute(query).all()]
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Keyword tags for books: TF-IDF over normalized description and subject terms, scored in a process pool
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from config import get_config
+from dedup import normalize_text
+from models import Book, BookTag
+from recommender import STOPWORDS
+from subjects import parse_subjects
+
+logger = logging.getLogger(__name__)
+
+N_FEATURES = 2 ** 20
+MAX_TAG_LENGTH = 100
+# Open Library descriptions often end in markdown source links
+TAG_STOPWORDS = STOPWORDS | frozenset({'http', 'https', 'www', 'com', 'org', 'source', 'edition', 'author'})
+
+def _words(text: str) -> List[str]:
+    return [word for word in text.split()
+            if 3 <= len(word) <= MAX_TAG_LENGTH and not word.isdigit() and word not in TAG_STOPWORDS]
+
+def _normalize(text: Optional[str]) -> str:
+    # Drop apostrophes first so "children's" becomes "childrens" rather than "children s"
+    return normalize_text(text.replace("'", '').replace('\u2019', '')) if text else ''
+
+def extract_keywords(subjects: Optional[str], description: Optional[str]) -> Counter:
+    """Normalized keyword counts for a book; whole subjects count double, as in the similarity index"""
+    terms = Counter()
+    for subject in parse_subjects(subjects):
+        phrase = _normalize(subject)[:MAX_TAG_LENGTH]
+        if phrase and phrase not in TAG_STOPWORDS:
+            terms[phrase] += 2
+            terms.update(word for word in _words(phrase) if word != phrase)
+    terms.update(_words(_normalize(description)))
+    return terms
+
+def _feature(term: str) -> int:
+    return zlib.crc32(term.encode('utf-8')) & (N_FEATURES - 1)
+
+def _distinct_features(terms: Counter) -> np.ndarray:
+    return np.fromiter({_feature(term) for term in terms}, dtype=np.int64)
+
+# Per-process state, set once by the pool initializer instead of being pickled with every chunk
+_document_frequency = None
+_n_docs = 0
+
+def _init_worker(document_frequency: Optional[np.ndarray], n_docs: int):
+    global _document_frequency, _n_docs
+    _document_frequency = document_frequency
+    _n_docs = n_docs
+
+def _count_chunk(documents: List[Tuple]) -> Tuple[np.ndarray, np.ndarray]:
+    """Document frequencies of the hashed terms in a chunk of (book_id, subjects, description) rows"""
+    features = [_distinct_features(extract_keywords(subjects, description)) for _, subjects, description in documents]
+    return np.unique(np.concatenate(features) if features else np.zeros(0, dtype=np.int64), return_counts=True)
+
+def _score_chunk(documents: List[Tuple], counted_through: int, per_book: int,
+                 min_document_frequency: int) -> Tuple[List[Dict], np.ndarray, np.ndarray, int]:
+    """Top TF-IDF tags per book, plus the frequencies of books not yet counted in the corpus"""
+    keywords = []
+    for book_id, subjects, description in documents:
+        terms = extract_keywords(subjects, description)
+        columns = np.fromiter((_feature(term) for term in terms), dtype=np.int64, count=len(terms))
+        keywords.append((book_id, terms, columns))
+    
+    # Uncounted books add their own terms first, so a chunk of new books can share tags
+    uncounted = [np.unique(columns) for book_id, _, columns in keywords if book_id > counted_through]
+    features, counts = np.unique(
+        np.concatenate(uncounted) if uncounted else np.zeros(0, dtype=np.int64), return_counts=True
+    )
+    chunk_frequency = np.zeros(N_FEATURES, dtype=np.int64)
+    chunk_frequency[features] = counts
+    n_docs = _n_docs + len(uncounted)
+    
+    rows = []
+    for book_id, terms, columns in keywords:
+        if not terms:
+            continue
+        names = list(terms)
+        frequency = _document_frequency[columns] + chunk_frequency[columns]
+        tf = 1.0 + np.log(np.fromiter(terms.values(), dtype=np.float64, count=len(names)))
+        weights = tf * (np.log((1 + n_docs) / (1 + frequency)) + 1)
+        weights[frequency < min_document_frequency] = 0.0
+        norm = np.linalg.norm(weights)
+        if norm == 0:
+            continue
+        weights /= norm
+        for i in np.argsort(-weights, kind='stable')[:per_book]:
+            if weights[i] > 0:
+                rows.append({'book_id': book_id, 'tag': names[i], 'weight': round(float(weights[i]), 4)})
+    return rows, features, counts, len(uncounted)
+
+class TagExtractor:
+    """Keeps book_tags in step with the catalog, one process per core
+    
+    Document frequencies are hashed into a fixed array and saved between runs along with
+    the highest book id they cover. The first run counts the whole catalog, then tags every
+    book; later runs only tag books whose content_hash differs from the one their tags were
+    computed from, and add books past that id to the frequencies. Edited books keep their
+    old contribution until a rebuild recounts everything. Each chunk is committed on its
+    own, so an interrupted run resumes where it stopped.
+    """
+    
+    def __init__(self, path: Optional[str] = None, workers: Optional[int] = None, chunk_size: int = 5000,
+                 per_book: Optional[int] = None, min_document_frequency: Optional[int] = None):
+        config = get_config()
+        self.path = path or config.TAG_FREQUENCIES_PATH
+        self.workers = workers or config.TAG_WORKERS or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.per_book = per_book or config.TAGS_PER_BOOK
+        self.min_document_frequency = min_document_frequency or config.TAG_MIN_DOCUMENT_FREQUENCY
+        self.document_frequency = np.zeros(N_FEATURES, dtype=np.int64)
+        self.n_docs = 0
+        self.counted_through = 0  # Highest book id included in the frequencies
+    
+    def load_frequencies(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as saved:
+            self.document_frequency = saved['document_frequency'].astype(np.int64)
+            self.n_docs = int(saved['n_docs'])
+            self.counted_through = int(saved['counted_through'])
+        return True
+    
+    def save_frequencies(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, document_frequency=self.document_frequency, n_docs=self.n_docs,
+                     counted_through=self.counted_through)
+        os.replace(tmp_path, self.path)
+    
+    def _chunks(self, session: Session, stale_only: bool) -> Iterator[Tuple[List[Tuple], Dict[int, str]]]:
+        """(documents, content hashes) in id order; reads only ever run ahead of the writes"""
+        query = select(Book.id, Book.subjects, Book.description, Book.content_hash).order_by(Book.id)
+        if stale_only:
+            query = query.where(or_(
+                Book.tags_hash.is_(None),
+                Book.tags_hash != func.coalesce(Book.content_hash, ''),
+                Book.id > self.counted_through
+            ))
+        
+        last_id = 0
+        while True:
+            rows = session.execute(query.where(Book.id > last_id).limit(self.chunk_size)).all()
+            if not rows:
+                return
+            yield [(row.id, row.subjects, row.description) for row in rows], \
+                {row.id: row.content_hash or '' for row in rows}
+            last_id = rows[-1].id
+    
+    def _map(self, fn, chunks: Iterator, *args) -> Iterator:
+        """Run fn over chunks in the pool, yielding (chunk, result) in order with a bounded backlog"""
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.document_frequency, self.n_docs)) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append((chunk, executor.submit(fn, chunk[0], *args)))
+                if len(pending) >= 2 * self.workers:
+                    chunk, future = pending.popleft()
+                    yield chunk, future.result()
+            while pending:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+    
+    def count_frequencies(self, session: Session):
+        """Count document frequencies over the whole catalog"""
+        started = time.monotonic()
+        self.document_frequency = np.zeros(N_FEATURES, dtype=np.int64)
+        self.n_docs = 0
+        self.counted_through = 0
+        for (documents, _), (features, counts) in self._map(_count_chunk, self._chunks(session, stale_only=False)):
+            self.document_frequency[features] += counts
+            self.n_docs += len(documents)
+            self.counted_through = documents[-1][0]
+        session.rollback()  # End the read transaction before the writes start
+        logger.info(f"Counted term frequencies over {self.n_docs} books in {time.monotonic() - started:.1f}s")
+    
+    def extract(self, session: Session, rebuild: bool = False) -> Dict:
+        """Tag new and changed books (every book when rebuilding) and return totals"""
+        started = time.monotonic()
+        if rebuild or not self.load_frequencies():
+            self.count_frequencies(session)
+            self.save_frequencies()
+        
+        record = (
+            update(Book.__table__)
+            .where(Book.__table__.c.id == bindparam('book_id'))
+            .values(tags_hash=bindparam('tags_hash'), updated_at=Book.__table__.c.updated_at)
+        )
+        totals = {'books': 0, 'tags': 0}
+        counted_through = self.counted_through
+        added_frequency = np.zeros(N_FEATURES, dtype=np.int64)
+        added_docs = 0
+        last_id = counted_through
+        
+        chunks = self._chunks(session, stale_only=not rebuild)
+        scored = self._map(_score_chunk, chunks, counted_through, self.per_book, self.min_document_frequency)
+        for (documents, hashes), (rows, features, counts, n_new) in scored:
+            book_ids = list(hashes)
+            session.execute(delete(BookTag).where(BookTag.book_id.in_(book_ids)))
+            if rows:
+                session.execute(insert(BookTag), rows)
+            session.execute(record, [{'book_id': book_id, 'tags_hash': value} for book_id, value in hashes.items()])
+            session.commit()
+            
+            added_frequency[features] += counts
+            added_docs += n_new
+            last_id = max(last_id, book_ids[-1])
+            totals['books'] += len(book_ids)
+            totals['tags'] += len(rows)
+            logger.info(f"Tag extraction progress: {totals}")
+        
+        # Only a completed run moves the frequencies forward, so an interrupted one is never counted twice
+        if added_docs:
+            self.document_frequency += added_frequency
+            self.n_docs += added_docs
+            self.counted_through = last_id
+            self.save_frequencies()
+        
+        logger.info(f"Tagged {totals['books']} books with {totals['tags']} tags in {time.monotonic() - started:.1f}s")
+        return totals
+
+def tags_for_book(session: Session, book_id: int) -> List[Tuple[str, float]]:
+    """A book's tags, strongest first"""
+    query = select(BookTag.tag, BookTag.weight).where(BookTag.book_id == book_id).order_by(BookTag.weight.desc())
+    return [(tag, weight) for tag, weight in session.execute(query).all()]
+
+def books_by_tag(session: Session, tag: str, limit: int = 50) -> List[Tuple[int, float]]:
+    """Ids of the books a tag describes best, with their weights"""
+    query = (
+        select(BookTag.book_id, BookTag.weight)
+        .where(BookTag.tag == _normalize(tag))
+        .order_by(BookTag.weight.desc())
+        .limit(limit)
+    )
+    return [(book_id, weight) for book_id, weight in session.execute(query).all()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract keyword tags from book descriptions and subjects")
+    parser.add_argument('--rebuild', action='store_true', help="Recount term frequencies and re-tag every book")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: TAG_WORKERS or one per core)")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="Books per chunk and commit")
+    args = parser.parse_args()
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    
+    from database import init_database, db_manager
+    if not init_database():
+        logger.error("Failed to initialize database. Please check your database configuration.")
+        sys.exit(1)
+    
+    session = db_manager.get_session()
+    try:
+        TagExtractor(workers=args.workers, chunk_size=args.chunk_size).extract(session, rebuild=args.rebuild)
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    main()
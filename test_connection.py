@@ -7,8 +7,6 @@ import logging
 from database import init_database, db_manager
 from models import Book
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def test_connection():
@@ -70,6 +68,8 @@ def test_connection():
 
 def main():
     """Main function"""
+    logging.basicConfig(level=logging.INFO)
+    
     logger.info("=" * 50)
     logger.info("LitWise Books - Database Connection Test")
     logger.info("=" * 50)
@@ -0,0 +1,107 @@
+"""
+BulkBookWriter's insert/update/unchanged/skipped classification on SQLite
+"""
+
+import pytest
+from sqlalchemy import insert, select
+
+from bulk_writer import BulkBookWriter
+from config import Config
+from database import db_manager, init_database
+from dedup import FingerprintIndex, book_fingerprint
+from models import Book
+
+def book(key, title, description='A description.', author='Author One'):
+    return {'title': title, 'author': author, 'openlibrary_key': key, 'work_key': key,
+            'description': description, 'subjects': 'Fiction, Adventure'}
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'DB_URL', f"sqlite:///{tmp_path / 'books.db'}")
+    assert init_database()
+    session = db_manager.get_session()
+    yield session
+    session.close()
+    db_manager.engine.dispose()
+
+def write(session, rows, fingerprints=None):
+    writer = BulkBookWriter(session, batch_size=100, fingerprints=fingerprints)
+    for row in rows:
+        writer.add(row)
+    return writer.flush()
+
+def stored(session):
+    return {row.openlibrary_key: row for row in session.execute(select(Book)).scalars()}
+
+def test_new_rows_are_inserted(session):
+    result = write(session, [book('/works/OL1W', 'First'), book('/works/OL2W', 'Second')])
+    assert result == {'inserted': 2, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+    
+    rows = stored(session)
+    assert rows['/works/OL1W'].fingerprint == book_fingerprint('First', 'Author One')
+    assert rows['/works/OL1W'].content_hash
+    assert rows['/works/OL1W'].last_fetched_at is not None
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_refetch_unchanged_only_moves_fetch_time(session, preload):
+    write(session, [book('/works/OL1W', 'First')])
+    fetched_at = stored(session)['/works/OL1W'].last_fetched_at
+    session.expire_all()
+    
+    fingerprints = FingerprintIndex.preload(session) if preload else None
+    result = write(session, [book('/works/OL1W', 'First')], fingerprints)
+    assert result['unchanged'] == 1
+    assert result['inserted'] == result['updated'] == result['skipped'] == 0
+    session.expire_all()
+    assert stored(session)['/works/OL1W'].last_fetched_at > fetched_at
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_refetch_changed_is_updated(session, preload):
+    write(session, [book('/works/OL1W', 'First')])
+    
+    fingerprints = FingerprintIndex.preload(session) if preload else None
+    result = write(session, [book('/works/OL1W', 'First', 'A new description.')], fingerprints)
+    assert result['updated'] == 1
+    assert result['inserted'] == result['skipped'] == 0
+    session.expire_all()
+    rows = stored(session)
+    assert len(rows) == 1
+    assert rows['/works/OL1W'].description == 'A new description.'
+
+@pytest.mark.parametrize('preload', [False, True])
+def test_same_fingerprint_under_another_key_is_skipped(session, preload):
+    write(session, [book('/works/OL1W', 'First')])
+    
+    fingerprints = FingerprintIndex.preload(session) if preload else None
+    result = write(session, [book('/works/OL9W', 'First', 'Different text.')], fingerprints)
+    assert result['skipped'] == 1
+    assert result['inserted'] == result['updated'] == 0
+    session.expire_all()
+    rows = stored(session)
+    assert set(rows) == {'/works/OL1W'}
+    assert rows['/works/OL1W'].description == 'A description.'
+
+def test_duplicates_within_a_batch_are_skipped(session):
+    result = write(session, [
+        book('/works/OL1W', 'First'),
+        book('/works/OL1W', 'First again'),  # Same key
+        book('/works/OL2W', 'first'),  # Same fingerprint: title and author are normalized
+        book(None, 'Second'),
+    ])
+    assert result['inserted'] == 2
+    assert result['skipped'] == 2
+    assert len(stored(session)) == 2
+
+def test_stale_preloaded_index_retries_with_check_all(session):
+    fingerprints = FingerprintIndex.preload(session)
+    
+    # Another process stores the book after the index was preloaded
+    session.execute(insert(Book).values(
+        title='First', author='Author One', openlibrary_key='/works/OL7W',
+        fingerprint=book_fingerprint('First', 'Author One')
+    ))
+    session.commit()
+    
+    result = write(session, [book('/works/OL1W', 'First'), book('/works/OL2W', 'Second')], fingerprints)
+    assert result == {'inserted': 1, 'updated': 0, 'unchanged': 0, 'skipped': 1, 'failed': 0}
+    assert set(stored(session)) == {'/works/OL7W', '/works/OL2W'}
@@ -0,0 +1,102 @@
+"""
+Dump ingest against a small fixture holding author, edition and work lines plus one malformed line
+"""
+
+import gzip
+import os
+import shutil
+from collections import Counter
+
+import pytest
+
+from config import Config
+from database import db_manager, init_database
+from dump_ingest import DumpIngester, iter_dump_records, split_byte_ranges
+
+SAMPLE = os.path.join(os.path.dirname(__file__), 'fixtures', 'ol_dump_sample.txt')
+WORK_KEYS = {f"/works/OL{n}W" for n in (1, 2, 4, 5, 6, 7, 8)}  # OL3W is the malformed line
+
+@pytest.fixture
+def ingester(tmp_path):
+    ingester = DumpIngester(str(tmp_path / 'scratch.db'), lookup_batch=2)
+    ingester.load_authors(SAMPLE)
+    ingester.load_editions(SAMPLE)
+    yield ingester
+    ingester.close()
+
+def test_malformed_line_is_skipped():
+    keys = [key for key, _ in iter_dump_records(SAMPLE, '/type/work')]
+    assert sorted(keys) == sorted(WORK_KEYS)
+
+def test_mapped_fields(ingester):
+    books = {book['openlibrary_key']: book for book in ingester.iter_formatted_works(SAMPLE)}
+    assert set(books) == WORK_KEYS
+    
+    earthsea = books['/works/OL1W']
+    assert earthsea['title'] == 'A Wizard of Earthsea'
+    assert earthsea['author'] == 'Ursula K. Le Guin'
+    assert earthsea['description'] == 'A young wizard learns the true names of things.'
+    assert earthsea['first_publish_year'] == 1968
+    assert earthsea['subjects'] == 'Fantasy, Wizards'
+    assert earthsea['cover_image_url'].endswith('/b/id/6425013-L.jpg')
+    # Editions are merged with COALESCE: the first edition's publisher and pages, the second's ISBNs
+    assert earthsea['publisher'] == 'Parnassus Press'
+    assert earthsea['number_of_pages'] == 205
+    assert earthsea['isbn'] == '0553383043'
+    assert earthsea['isbn13'] == '9780553383041'
+    
+    kindred = books['/works/OL2W']
+    assert kindred['description'] == 'A woman is pulled back in time.'
+    assert kindred['first_publish_year'] == 1979
+    assert kindred['isbn'] is None
+    assert books['/works/OL5W']['isbn13'] == '9780446675505'
+    assert books['/works/OL8W']['author'] == 'Unknown Author'
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 8])
+def test_byte_ranges_cover_every_work_once(count):
+    ranges = split_byte_ranges(SAMPLE, count)
+    keys = Counter(key for byte_range in ranges for key, _ in iter_dump_records(SAMPLE, '/type/work', byte_range))
+    assert set(keys) == WORK_KEYS
+    assert set(keys.values()) == {1}
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5])
+def test_hash_shards_cover_every_work_once(tmp_path, count):
+    gz_path = str(tmp_path / 'ol_dump_sample.txt.gz')
+    with open(SAMPLE, 'rb') as source, gzip.open(gz_path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    
+    keys = Counter(
+        key for index in range(count) for key, _ in iter_dump_records(gz_path, '/type/work', shard=(index, count))
+    )
+    assert set(keys) == WORK_KEYS
+    assert set(keys.values()) == {1}
+
+def test_byte_ranges_reject_gzip(tmp_path):
+    with pytest.raises(ValueError):
+        list(iter_dump_records(str(tmp_path / 'works.txt.gz'), '/type/work', (0, 10)))
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 6])
+def test_limit_stops_at_requested_count(ingester, limit):
+    assert len(list(ingester.iter_formatted_works(SAMPLE, limit=limit))) == limit
+
+def test_lookups_are_chunked(ingester):
+    keys = ['/authors/OL1A', '/authors/OL2A'] + [f"/authors/OL{n}X" for n in range(1200)]
+    found = ingester._lookup('authors', 'key', keys, chunk_size=500)
+    assert {key: row['name'] for key, row in found.items()} == {
+        '/authors/OL1A': 'Ursula K. Le Guin', '/authors/OL2A': 'Octavia E. Butler'
+    }
+
+def test_ingest_end_to_end(ingester, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'DB_URL', f"sqlite:///{tmp_path / 'books.db'}")
+    assert init_database()
+    try:
+        totals = ingester.ingest(SAMPLE)
+        assert totals['inserted'] == len(WORK_KEYS)
+        assert totals['failed'] == 0
+        
+        # A second pass finds every work already stored with the same content
+        totals = ingester.ingest(SAMPLE)
+        assert totals['unchanged'] == len(WORK_KEYS)
+        assert totals['inserted'] == totals['updated'] == 0
+    finally:
+        db_manager.engine.dispose()
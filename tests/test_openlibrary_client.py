@@ -0,0 +1,106 @@
+"""
+OpenLibraryClient against local stand-in servers
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmark import FakeOpenLibraryServer, point_config_at
+from config import Config
+from http_cache import ResponseCache
+from openlibrary_client import OpenLibraryClient
+
+@pytest.fixture
+def fast_config(monkeypatch):
+    """Keep Config's URLs and limits local to the test"""
+    for name in ('OPENLIBRARY_BASE_URL', 'OPENLIBRARY_SEARCH_URL', 'OPENLIBRARY_WORKS_URL',
+                 'OPENLIBRARY_BOOKS_API_URL', 'OPENLIBRARY_COVERS_URL'):
+        monkeypatch.setattr(Config, name, getattr(Config, name))
+    monkeypatch.setattr(Config, 'REQUESTS_PER_SECOND', 1000.0)
+    monkeypatch.setattr(Config, 'RETRY_BASE_DELAY', 0.01)
+    return Config
+
+@pytest.fixture
+def maintenance_server(fast_config):
+    """Answers every request with 200 and an HTML maintenance page"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+        
+        def do_GET(self):
+            body = b'<html><body>Open Library is down for maintenance</body></html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    point_config_at(f"http://127.0.0.1:{server.server_port}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_non_json_body_is_a_failed_request(maintenance_server, tmp_path):
+    client = OpenLibraryClient(cache=ResponseCache(str(tmp_path / 'cache.db')))
+    
+    assert client.get_work_details('OL1W') is None
+    assert client.search_books('subject:fiction') == []
+    assert client.search_page('subject:fiction') is None
+    assert client.search_by_keys(['OL1W']) is None
+    assert client.get_books_by_bibkeys(['ISBN:0000000001']) is None
+    assert client.get_diverse_book_collection(10) == []
+    
+    # The bad body must not be served from the cache later
+    url = f"{Config.OPENLIBRARY_BASE_URL}/works/OL1W.json"
+    assert client.cache.get(client.cache.make_key(url)) is None
+
+@pytest.fixture
+def fake_server(fast_config):
+    """Start FakeOpenLibraryServer instances and point Config at them"""
+    servers = []
+    
+    def start(**options):
+        server = FakeOpenLibraryServer(latency=0, **options)
+        point_config_at(server.start())
+        servers.append(server)
+        return server
+    
+    yield start
+    for server in servers:
+        server.stop()
+
+def test_editions_are_fetched_in_bibkey_chunks(fake_server, monkeypatch):
+    server = fake_server(corpus_size=30)
+    monkeypatch.setattr(Config, 'BIBKEYS_PER_REQUEST', 2)
+    client = OpenLibraryClient()
+    
+    # Works 0, 3, ... lack publisher and pages in the search index; work 99 is not in the corpus
+    books = [client.format_book_data(server.work(number)) for number in (0, 3, 6, 9, 12)]
+    books.append(dict(books[-1], isbn='0000000099', openlibrary_key='/works/OL99W'))
+    assert all(book['publisher'] is None and book['isbn13'] is None for book in books)
+    
+    assert client.enrich_with_editions(books) == []
+    assert server.request_count == 3  # Six bibkeys, two per request
+    
+    for book in books[:-1]:
+        number = int(book['isbn'])
+        assert book['isbn13'] == f"978{number:010d}"
+        assert book['publisher'] == f"Publisher {number % 31}"
+        assert book['number_of_pages'] == 100 + number % 400
+    assert books[-1]['publisher'] is None
+
+def test_failed_edition_lookups_are_returned(fake_server, monkeypatch):
+    server = fake_server(corpus_size=30, error_rate=1.0)
+    monkeypatch.setattr(Config, 'BIBKEYS_PER_REQUEST', 2)
+    monkeypatch.setattr(Config, 'MAX_REQUEST_ATTEMPTS', 1)
+    client = OpenLibraryClient()
+    
+    books = [client.format_book_data(server.work(number)) for number in (0, 3, 6)]
+    failed = client.enrich_with_editions(books)
+    assert [book['openlibrary_key'] for book in failed] == [book['openlibrary_key'] for book in books]
+    assert all(book['publisher'] is None for book in books)
@@ -0,0 +1,133 @@
+"""
+Retry-After parsing, AdaptiveController state and an ingest against a faulty fake Open Library
+"""
+
+import time
+from email.utils import formatdate
+
+import pytest
+from sqlalchemy import func, or_, select
+
+from benchmark import FakeOpenLibraryServer, point_config_at
+from config import Config
+from database import db_manager, init_database
+from models import Book
+from throttle import AdaptiveController, CircuitOpenError, parse_retry_after
+
+@pytest.mark.parametrize('value, expected', [
+    ('3', 3.0),
+    ('0.5', 0.5),
+    ('-5', 0.0),
+    (formatdate(0, usegmt=True), 0.0),  # A date in the past means "now"
+    (None, None),
+    ('', None),
+    ('soon', None),
+])
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
+
+def test_parse_retry_after_http_date():
+    seconds = parse_retry_after(formatdate(time.time() + 60, usegmt=True))
+    assert 55 <= seconds <= 60
+
+def fail(controller, times=1, **feedback):
+    for _ in range(times):
+        controller.acquire()
+        controller.release(False, 0.01, **feedback)
+
+def test_circuit_opens_probes_and_closes():
+    controller = AdaptiveController(4, failure_threshold=3, open_seconds=0.05)
+    fail(controller, 2)
+    assert controller.state == 'closed'
+    fail(controller)
+    assert controller.state == 'open'
+    
+    # Waits out the open period, then lets a single probe through
+    assert controller.acquire() >= 0.04
+    assert controller.state == 'half_open'
+    assert controller.probing
+    controller.release(True, 0.01)
+    assert controller.state == 'closed'
+    assert controller.consecutive_failures == 0
+
+def test_failed_probe_reopens_for_longer():
+    controller = AdaptiveController(4, failure_threshold=1, open_seconds=0.05)
+    fail(controller)
+    assert controller.state == 'open'
+    
+    fail(controller)  # The probe
+    assert controller.state == 'open'
+    assert controller.open_until - time.monotonic() > 0.05  # The pause doubled
+
+def test_open_circuit_gives_up_after_max_wait():
+    controller = AdaptiveController(4, failure_threshold=1, open_seconds=10, max_wait=0.05)
+    fail(controller)
+    with pytest.raises(CircuitOpenError):
+        controller.acquire()
+
+def test_retries_draw_from_a_budget_refilled_by_successes():
+    controller = AdaptiveController(4, max_attempts=10, base_delay=0.01, retry_ratio=0.5, retry_reserve=2)
+    assert controller.retry_delay(1) is not None
+    assert controller.retry_delay(1) is not None
+    assert controller.retry_delay(1) is None
+    
+    for _ in range(2):
+        controller.acquire()
+        controller.release(True, 0.01)
+    assert controller.retry_delay(1) is not None
+    assert controller.retry_delay(10) is None  # Out of attempts, whatever the budget
+
+def test_retry_after_pauses_every_request():
+    controller = AdaptiveController(4, retry_reserve=5)
+    fail(controller, retry_after=0.2, throttled=True)
+    assert controller.resume_at > time.monotonic() + 0.1
+    assert controller.window < controller.max_window
+    assert controller.retry_delay(1, 0.2) >= 0.2
+    assert controller.acquire() >= 0.1
+
+@pytest.fixture
+def faulty_ingest(tmp_path, monkeypatch):
+    """Run fetch_and_save_books against a FakeOpenLibraryServer started with the given faults"""
+    for name in ('OPENLIBRARY_BASE_URL', 'OPENLIBRARY_SEARCH_URL', 'OPENLIBRARY_WORKS_URL',
+                 'OPENLIBRARY_BOOKS_API_URL', 'OPENLIBRARY_COVERS_URL'):
+        monkeypatch.setattr(Config, name, getattr(Config, name))
+    monkeypatch.setattr(Config, 'DB_URL', f"sqlite:///{tmp_path / 'books.db'}")
+    monkeypatch.setattr(Config, 'REQUESTS_PER_SECOND', 200.0)
+    monkeypatch.setattr(Config, 'MAX_CONCURRENT_REQUESTS', 4)
+    monkeypatch.setattr(Config, 'RETRY_BASE_DELAY', 0.01)
+    monkeypatch.setattr(Config, 'RETRY_MAX_DELAY', 0.2)
+    monkeypatch.setattr(Config, 'CIRCUIT_OPEN_SECONDS', 0.2)
+    servers = []
+    
+    def run(count, **faults):
+        from populate_books import BookPopulator
+        
+        server = FakeOpenLibraryServer(corpus_size=500, latency=0.001, **faults)
+        servers.append(server)
+        point_config_at(server.start())
+        assert init_database()
+        return server, BookPopulator().fetch_and_save_books(count)
+    
+    yield run
+    db_manager.close_connection()
+    for server in servers:
+        server.stop()
+
+@pytest.mark.parametrize('faults', [
+    {'error_rate': 0.2},
+    {'throttle_rps': 50},
+    {'outage': (0.1, 0.5)},
+], ids=['errors', 'throttled', 'outage'])
+def test_faults_lose_no_records(faulty_ingest, faults):
+    server, saved = faulty_ingest(40, **faults)
+    assert server.error_count or server.throttled_count
+    assert saved == 40
+    
+    # Every fake work has a description and an edition, so a missing one was dropped on a failure
+    with db_manager.engine.connect() as connection:
+        stored = connection.execute(select(func.count()).select_from(Book)).scalar()
+        incomplete = connection.execute(
+            select(func.count()).select_from(Book).where(or_(Book.description.is_(None), Book.isbn13.is_(None)))
+        ).scalar()
+    assert stored == 40
+    assert incomplete == 0
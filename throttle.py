@@ -0,0 +1,214 @@
+"""
+Adaptive concurrency, retry/backoff and circuit breaking for Open Library requests
+"""
+
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import requests
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Answers that mean "slow down or try again later" rather than "this request is wrong"
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+class CircuitOpenError(requests.RequestException):
+    """Open Library kept failing for longer than a request is allowed to wait"""
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header given as delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class AdaptiveController:
+    """AIMD request window, retry budget and circuit breaker shared by all workers of a client
+    
+    The window caps requests in flight and scales the token bucket's rate. It grows by one slot
+    per adjust_interval of clean responses and shrinks multiplicatively on congestion signals:
+    explicit throttling (429 or Retry-After), an error rate above error_tolerance, or latency
+    well above the best seen. Decreases happen at most once per adjust_interval, so a burst of
+    simultaneous failures counts as one signal. Retries draw from a budget refilled by
+    successes, and after failure_threshold consecutive failures the circuit opens: requests
+    wait, without spending attempts or budget, while a single probe tests whether the service
+    is back.
+    """
+    
+    def __init__(self, max_window: int, rate_limiter=None, max_attempts: int = 5, base_delay: float = 0.1,
+                 max_delay: float = 30.0, retry_ratio: float = 0.2, retry_reserve: float = 10.0,
+                 latency_tolerance: float = 3.0, error_tolerance: float = 0.25, adjust_interval: float = 1.0,
+                 failure_threshold: int = 10,
+                 open_seconds: float = 5.0, max_open_seconds: float = 60.0, max_wait: float = 300.0):
+        self.max_window = max(1, max_window)
+        self.window = float(self.max_window)
+        self.rate_limiter = rate_limiter
+        self.max_rate = rate_limiter.rate if rate_limiter else None
+        
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_ratio = retry_ratio  # Retry tokens earned per successful request
+        self.retry_reserve = retry_reserve
+        self.retry_tokens = retry_reserve
+        
+        self.latency_tolerance = latency_tolerance
+        self.error_tolerance = error_tolerance
+        self.adjust_interval = adjust_interval
+        self.latency_floor: Dict[str, float] = {}
+        self.smoothed_latency: Dict[str, float] = {}
+        self.error_rate = 0.0  # Exponentially smoothed fraction of failed requests
+        self.decreased_at = 0.0
+        self.grow_at = 0.0  # Earliest time the window may grow again
+        self.ceiling = float(self.max_window)  # Window at the last congestion signal
+        
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.max_wait = max_wait
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.next_open_seconds = open_seconds
+        self.probing = False
+        
+        self.in_flight = 0
+        self.resume_at = 0.0  # Set from Retry-After; nobody sends before it
+        self.condition = threading.Condition()
+    
+    def _transition(self, state: str):
+        logger.warning(f"Open Library circuit {self.state} -> {state}")
+        metrics.inc('openlibrary_circuit_transitions_total', state=state)
+        self.state = state
+    
+    def _open(self, now: float):
+        self.open_until = now + self.next_open_seconds
+        self.next_open_seconds = min(self.max_open_seconds, self.next_open_seconds * 2)
+        self.probing = False
+        self._transition('open')
+    
+    def _decrease(self, now: float, factor: float, signal: str, hold_until: float = 0.0):
+        if now - self.decreased_at < self.adjust_interval:
+            return
+        self.decreased_at = now
+        self.grow_at = max(now, hold_until) + self.adjust_interval
+        self.ceiling = self.window
+        self.window = max(1.0, self.window * factor)
+        metrics.inc('openlibrary_window_decreases_total', signal=signal)
+        self._apply_rate()
+    
+    def _apply_rate(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.set_rate(self.max_rate * self.window / self.max_window)
+    
+    def acquire(self) -> float:
+        """Block until a request may be sent and return the time spent waiting
+        
+        Raises CircuitOpenError once the circuit has kept the caller waiting for max_wait.
+        """
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.state == 'open' and now >= self.open_until:
+                    self._transition('half_open')
+                
+                if self.state == 'half_open' and not self.probing:
+                    self.probing = True
+                    self.in_flight += 1
+                    return now - started
+                
+                wake_at = None  # Probe or window slot: woken by release()
+                if self.state == 'open':
+                    wake_at = self.open_until
+                elif self.state == 'closed':
+                    if now < self.resume_at:
+                        wake_at = self.resume_at
+                    elif self.in_flight < int(self.window):
+                        self.in_flight += 1
+                        return now - started
+                
+                if self.state == 'closed':
+                    self.condition.wait(wake_at - now if wake_at else None)
+                    continue
+                if now >= deadline:
+                    raise CircuitOpenError(f"Open Library unavailable, gave up after waiting {self.max_wait:.0f}s")
+                self.condition.wait(min(wake_at or deadline, deadline) - now)
+    
+    def release(self, ok: bool, latency: float, endpoint: str = 'default', retry_after: Optional[float] = None,
+                throttled: bool = False):
+        """Feed back the outcome of a sent request; ok means the service answered normally"""
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            self.error_rate = 0.95 * self.error_rate + (0.0 if ok else 0.05)
+            if ok:
+                self.consecutive_failures = 0
+                self.retry_tokens = min(self.retry_reserve, self.retry_tokens + self.retry_ratio)
+                if self.state != 'closed':
+                    self.probing = False
+                    self.next_open_seconds = self.open_seconds
+                    self._transition('closed')
+                
+                # The floor drifts slowly towards typical latency so a lasting change is not read as congestion
+                floor = min(self.latency_floor.get(endpoint, latency), latency)
+                smoothed = 0.9 * self.smoothed_latency.get(endpoint, latency) + 0.1 * latency
+                self.latency_floor[endpoint] = floor + 0.01 * (smoothed - floor)
+                self.smoothed_latency[endpoint] = smoothed
+                if smoothed > self.latency_tolerance * max(floor, 0.001):
+                    self._decrease(now, 0.9, 'latency')
+                elif self.window < self.max_window and now >= self.grow_at:
+                    self.grow_at = now + self.adjust_interval
+                    # Climb quickly back towards the last congestion point, then probe past it gently
+                    step = 1.0 if self.window + 1 <= 0.9 * self.ceiling else 0.1 * self.window
+                    self.window = min(self.max_window, self.window + step)
+                    self._apply_rate()
+            else:
+                self.consecutive_failures += 1
+                if retry_after:
+                    self.resume_at = max(self.resume_at, now + retry_after)
+                # Occasional failures are retried at full speed; only sustained ones mean overload
+                if throttled:
+                    # Time spent paused for Retry-After says nothing about the new window yet
+                    self._decrease(now, 0.7, 'throttled', hold_until=self.resume_at)
+                elif self.error_rate > self.error_tolerance:
+                    self._decrease(now, 0.5, 'error')
+                if self.state == 'half_open' or (
+                        self.state == 'closed' and self.consecutive_failures >= self.failure_threshold):
+                    self._open(now)
+            self.condition.notify_all()
+    
+    def retry_delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """Backoff before retrying after failed attempt number attempt, or None when it must not be retried"""
+        with self.condition:
+            if self.state != 'closed':
+                return retry_after or 0.0  # acquire() waits for the circuit instead
+            if attempt >= self.max_attempts or self.retry_tokens < 1:
+                return None
+            self.retry_tokens -= 1
+        # Full jitter keeps workers that failed together from retrying together
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(backoff, retry_after or 0.0)
+    
+    def get_stats(self) -> Dict:
+        with self.condition:
+            return {
+                'window': round(self.window, 2),
+                'rate': round(self.rate_limiter.rate, 2) if self.rate_limiter else None,
+                'in_flight': self.in_flight,
+                'retry_tokens': round(self.retry_tokens, 1),
+                'circuit': self.state
+            }